@@ -0,0 +1,160 @@
+# coding=utf-8
+
+import numpy as np
+
+from .asdl import ASDLCompositeType
+from .asdl_ast import AbstractSyntaxTree
+from .transition_system import ApplyRuleAction, GenTokenAction, ReduceAction, reduce_action
+
+
+class ActionCodec(object):
+    """
+    Canonical integer encoding of action sequences as int32 arrays. An action is encoded as
+
+        [0, len(grammar))    ApplyRule, the id of the production
+        len(grammar)         Reduce, the same id used by the parser's production readout
+        > len(grammar)       GenToken of a token in the primitive vocabulary, its id offset by len(grammar) + 1
+        < 0                  GenToken that copies the source token at position -code - 1
+
+    A token in the primitive vocabulary is always encoded by its id, other tokens must be copied from the source.
+    """
+
+    def __init__(self, transition_system, primitive_vocab):
+        self.transition_system = transition_system
+        self.grammar = transition_system.grammar
+        self.primitive_vocab = primitive_vocab
+
+        self.reduce_code = len(self.grammar)
+        self.token_offset = len(self.grammar) + 1
+
+    def encode_token(self, token, src_tokens=None):
+        if token in self.primitive_vocab:
+            return self.token_offset + self.primitive_vocab[token]
+
+        if src_tokens is not None:
+            try:
+                return -src_tokens.index(token) - 1
+            except ValueError:
+                pass
+
+        raise ValueError('cannot encode token [%s], it is neither in the vocabulary nor in the source' % token)
+
+    def decode_token(self, code, src_tokens=None):
+        if code < 0:
+            return src_tokens[-code - 1]
+
+        return self.primitive_vocab.id2word[code - self.token_offset]
+
+    def encode_actions(self, actions, src_tokens=None):
+        """encode a list of actions into an int32 array"""
+        prod2id = self.grammar.prod2id
+        codes = np.empty(len(actions), dtype=np.int32)
+
+        for t, action in enumerate(actions):
+            if isinstance(action, ApplyRuleAction):
+                codes[t] = prod2id[action.production]
+            elif isinstance(action, ReduceAction):
+                codes[t] = self.reduce_code
+            elif isinstance(action, GenTokenAction):
+                codes[t] = self.encode_token(action.token, src_tokens)
+            else:
+                raise ValueError('unknown action %s' % action)
+
+        return codes
+
+    def decode_actions(self, codes, src_tokens=None):
+        """decode an int32 array into a list of actions, ApplyRule and Reduce actions are interned"""
+        id2prod = self.grammar.id2prod
+        actions = []
+
+        for code in codes:
+            code = int(code)
+            if 0 <= code < self.reduce_code:
+                actions.append(self.transition_system.get_apply_rule_action(id2prod[code]))
+            elif code == self.reduce_code:
+                actions.append(reduce_action)
+            else:
+                actions.append(GenTokenAction(self.decode_token(code, src_tokens)))
+
+        return actions
+
+    def ast_to_array(self, asdl_ast, src_tokens=None):
+        """encode the oracle action sequence of an AST"""
+        return self.encode_actions(self.transition_system.get_actions(asdl_ast), src_tokens)
+
+    def array_to_ast(self, codes, src_tokens=None):
+        """
+        build the AST of an encoded action sequence without going through a `Hypothesis`.
+        The tree is the same as `Hypothesis.tree` after applying the decoded actions, including `created_time`
+        of nodes. A prefix of a complete action sequence gives a partial tree.
+        """
+        id2prod = self.grammar.id2prod
+        reduce_code = self.reduce_code
+
+        tree = None
+        # frontier stack of [node, index of the field to fill in]
+        stack = []
+        value_buffer = []
+
+        for t, code in enumerate(codes):
+            code = int(code)
+
+            if tree is None:
+                if not 0 <= code < reduce_code:
+                    raise ValueError('only ApplyRule action is valid at the beginning of decoding')
+
+                tree = AbstractSyntaxTree(id2prod[code])
+                stack.append([tree, 0])
+            else:
+                if not stack:
+                    raise ValueError('action at t=%d is applied on a completed tree' % t)
+
+                frontier = stack[-1]
+                field = frontier[0].fields[frontier[1]]
+
+                if code == reduce_code:
+                    if field.cardinality not in ('optional', 'multiple'):
+                        raise ValueError('Reduce action can only be applied on field with multiple cardinality')
+
+                    field.set_finish()
+                    frontier[1] += 1
+                elif isinstance(field.type, ASDLCompositeType):
+                    if not 0 <= code < reduce_code:
+                        raise ValueError('invalid action code %d on composite field [%s]' % (code, field))
+
+                    child = AbstractSyntaxTree(id2prod[code])
+                    child.created_time = t
+                    field.add_value(child)
+
+                    # single and optional fields are finished by their value
+                    if field.cardinality != 'multiple':
+                        frontier[1] += 1
+                    stack.append([child, 0])
+                else:
+                    if 0 <= code < reduce_code:
+                        raise ValueError('invalid action code %d on primitive field [%s]' % (code, field))
+
+                    token = self.decode_token(code, src_tokens)
+
+                    # only field of type string requires termination signal </primitive>
+                    end_primitive = False
+                    if field.type.name == 'string':
+                        if token == '</primitive>':
+                            field.add_value(' '.join(value_buffer))
+                            value_buffer = []
+                            end_primitive = True
+                        else:
+                            value_buffer.append(token)
+                    else:
+                        field.add_value(token)
+                        end_primitive = True
+
+                    if end_primitive and field.cardinality in ('single', 'optional'):
+                        field.set_finish()
+                        frontier[1] += 1
+
+            # pop the nodes whose fields are all filled in
+            while stack and stack[-1][1] == len(stack[-1][0].fields):
+                stack.pop()
+
+        return tree
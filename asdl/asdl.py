@@ -1,15 +1,23 @@
 # coding=utf-8
+import hashlib
+import struct
 from collections import OrderedDict, Counter
 from itertools import chain
 
-from .utils import remove_comment
+from .utils import remove_comment, get_slots_state, set_slots_state
+
+# header of binary compiled grammar files, followed by a format version and the grammar digest
+GRAMMAR_BIN_MAGIC = b'ASDLGRM'
+GRAMMAR_BIN_VERSION = 1
+
+CARDINALITIES = ('single', 'optional', 'multiple')
 
 
 class ASDLGrammar(object):
     """
     Collection of types, constructors and productions
     """
-    def __init__(self, productions):
+    def __init__(self, productions, sorted_entities=None):
         # productions are indexed by their head types
         self._productions = OrderedDict()
         self._constructor_production_map = dict()
@@ -23,10 +31,13 @@ class ASDLGrammar(object):
         # number of constructors
         self.size = sum(len(head) for head in self._productions.values())
 
+        # integer-indexed lookup tables, shared by all hot paths
+        self._compiled = CompiledGrammar(self, sorted_entities)
+
         # get entities to their ids map
-        self.prod2id = {prod: i for i, prod in enumerate(self.productions)}
-        self.type2id = {type: i for i, type in enumerate(self.types)}
-        self.field2id = {field: i for i, field in enumerate(self.fields)}
+        self.prod2id = self._compiled.prod2id
+        self.type2id = self._compiled.type2id
+        self.field2id = self._compiled.field2id
 
         self.id2prod = {i: prod for i, prod in enumerate(self.productions)}
         self.id2type = {i: type for i, type in enumerate(self.types)}
@@ -35,9 +46,18 @@ class ASDLGrammar(object):
     def __len__(self):
         return self.size
 
+    @property
+    def compiled(self):
+        # grammars unpickled from older checkpoints are compiled on first access, as are the ones whose
+        # per-type production ids were stored as ranges of ids
+        if not hasattr(self, '_compiled') or not hasattr(self._compiled, 'type_prod_ids'):
+            self._compiled = CompiledGrammar(self)
+
+        return self._compiled
+
     @property
     def productions(self):
-        return sorted(chain.from_iterable(self._productions.values()), key=lambda x: repr(x))
+        return self.compiled.productions
 
     def __getitem__(self, datum):
         if isinstance(datum, str):
@@ -50,40 +70,148 @@ class ASDLGrammar(object):
 
     @property
     def types(self):
-        if not hasattr(self, '_types'):
-            all_types = set()
-            for prod in self.productions:
-                all_types.add(prod.type)
-                all_types.update(map(lambda x: x.type, prod.constructor.fields))
-
-            self._types = sorted(all_types, key=lambda x: x.name)
-
-        return self._types
+        return self.compiled.types
 
     @property
     def fields(self):
-        if not hasattr(self, '_fields'):
-            all_fields = set()
-            for prod in self.productions:
-                all_fields.update(prod.constructor.fields)
-
-            self._fields = sorted(all_fields, key=lambda x: (x.name, x.type.name, x.cardinality))
-
-        return self._fields
+        return self.compiled.fields
 
     @property
     def primitive_types(self):
-        return filter(lambda x: isinstance(x, ASDLPrimitiveType), self.types)
+        return self.compiled.primitive_types
 
     @property
     def composite_types(self):
-        return filter(lambda x: isinstance(x, ASDLCompositeType), self.types)
+        return self.compiled.composite_types
 
     def is_composite_type(self, asdl_type):
-        return asdl_type in self.composite_types
+        return self.compiled.is_composite_type(asdl_type)
 
     def is_primitive_type(self, asdl_type):
-        return asdl_type in self.primitive_types
+        return self.compiled.is_primitive_type(asdl_type)
+
+    def get_prod_ids_by_type(self, asdl_type):
+        """ids of the productions headed by `asdl_type`"""
+        return self.compiled.get_prod_ids_by_type(asdl_type)
+
+    @property
+    def digest(self):
+        """SHA-1 digest of the grammar, identifies the id assignment of its productions, types and fields"""
+        if not hasattr(self, '_digest'):
+            lines = ['root %s' % self.root_type.name]
+            lines.extend('%s %s' % ('composite' if isinstance(t, ASDLCompositeType) else 'primitive', t.name)
+                         for t in self.types)
+            lines.extend(repr(prod) for prod in self.productions)
+
+            self._digest = hashlib.sha1('\n'.join(lines).encode('utf-8')).hexdigest()
+
+        return self._digest
+
+    def to_bytes(self):
+        """serialize the compiled grammar into a versioned binary blob
+
+        The payload is a table of names followed by an array of uint32 codes, the
+        header records the grammar digest and a checksum of the payload.
+        """
+        compiled = self.compiled
+        names = []
+        name2id = dict()
+        codes = []
+
+        def _name_id(name):
+            name = name or ''
+            if name not in name2id:
+                name2id[name] = len(names)
+                names.append(name)
+            return name2id[name]
+
+        codes.append(len(compiled.types))
+        for asdl_type in compiled.types:
+            codes.extend([int(isinstance(asdl_type, ASDLCompositeType)), _name_id(asdl_type.name)])
+
+        codes.append(len(compiled.fields))
+        for field in compiled.fields:
+            codes.extend([_name_id(field.name), compiled.type2id[field.type], CARDINALITIES.index(field.cardinality)])
+
+        codes.append(len(compiled.productions))
+        for prod in compiled.productions:
+            codes.extend([compiled.type2id[prod.type], _name_id(prod.constructor.name), len(prod.fields)])
+            codes.extend(compiled.field2id[field] for field in prod.fields)
+
+        # productions in declaration order
+        codes.extend(compiled.prod2id[prod] for prod in chain.from_iterable(self._productions.values()))
+
+        name_blob = '\0'.join(names).encode('utf-8')
+        payload = struct.pack('<II', len(name_blob), len(codes)) + name_blob + \
+            struct.pack('<%dI' % len(codes), *codes)
+
+        return GRAMMAR_BIN_MAGIC + struct.pack('<H', GRAMMAR_BIN_VERSION) + \
+            self.digest.encode('ascii') + hashlib.sha1(payload).hexdigest().encode('ascii') + payload
+
+    @staticmethod
+    def from_bytes(data):
+        """load a grammar serialized by `to_bytes`, no parsing or sorting is performed"""
+        if data[:len(GRAMMAR_BIN_MAGIC)] != GRAMMAR_BIN_MAGIC:
+            raise ValueError('not a compiled ASDL grammar')
+
+        offset = len(GRAMMAR_BIN_MAGIC)
+        version, = struct.unpack_from('<H', data, offset)
+        if version != GRAMMAR_BIN_VERSION:
+            raise ValueError('unsupported compiled grammar version %d' % version)
+        offset += 2
+
+        digest = data[offset: offset + 40].decode('ascii')
+        checksum = data[offset + 40: offset + 80].decode('ascii')
+        payload = data[offset + 80:]
+        if hashlib.sha1(payload).hexdigest() != checksum:
+            raise ValueError('compiled grammar is corrupted, checksum mismatch')
+
+        name_blob_len, code_num = struct.unpack_from('<II', payload, 0)
+        names = payload[8: 8 + name_blob_len].decode('utf-8').split('\0')
+        codes = iter(struct.unpack_from('<%dI' % code_num, payload, 8 + name_blob_len))
+
+        types = []
+        for _ in range(next(codes)):
+            type_cls = ASDLCompositeType if next(codes) else ASDLPrimitiveType
+            types.append(type_cls(names[next(codes)]))
+
+        fields = []
+        for _ in range(next(codes)):
+            name = names[next(codes)]
+            field_type = types[next(codes)]
+            fields.append(Field(name, field_type, CARDINALITIES[next(codes)]))
+
+        productions = []
+        prod_num = next(codes)
+        for _ in range(prod_num):
+            prod_type = types[next(codes)]
+            name = names[next(codes)] or None
+            prod_fields = [fields[next(codes)] for _ in range(next(codes))]
+            productions.append(ASDLProduction(prod_type, ASDLConstructor(name, prod_fields)))
+
+        declared_productions = [productions[next(codes)] for _ in range(prod_num)]
+
+        grammar = ASDLGrammar(declared_productions, sorted_entities=(productions, types, fields))
+        # the digest in the header is not covered by the checksum, it is checked against the decoded tables
+        if grammar.digest != digest:
+            raise ValueError('compiled grammar is corrupted, digest mismatch')
+
+        return grammar
+
+    def to_bin_file(self, file_path):
+        with open(file_path, 'wb') as f:
+            f.write(self.to_bytes())
+
+    @staticmethod
+    def from_file(file_path):
+        """load a grammar from either an ASDL specification or a compiled grammar file"""
+        with open(file_path, 'rb') as f:
+            data = f.read()
+
+        if data.startswith(GRAMMAR_BIN_MAGIC):
+            return ASDLGrammar.from_bytes(data)
+        else:
+            return ASDLGrammar.from_text(data.decode('utf-8'))
 
     @staticmethod
     def from_text(text):
@@ -159,6 +287,93 @@ class ASDLGrammar(object):
         return grammar
 
 
+class CompiledGrammar(object):
+    """
+    Integer-indexed lookup tables of an `ASDLGrammar`, computed once.
+
+    Productions are sorted by their `repr`, types by name and fields by
+    (name, type name, cardinality), so ids are identical to the ones of the
+    original `ASDLGrammar`. Composite and primitive types are stored as bitsets
+    over type ids, and the ids of the productions headed by each type are listed
+    in declaration order, the order in which `get_valid_continuating_productions`
+    returns them.
+    """
+    def __init__(self, grammar, sorted_entities=None):
+        if sorted_entities:
+            # productions, types and fields are already in id order (e.g., loaded from a compiled grammar file)
+            self.productions, self.types, self.fields = sorted_entities
+        else:
+            self.productions = sorted(chain.from_iterable(grammar._productions.values()), key=lambda x: repr(x))
+
+            all_types = set()
+            all_fields = set()
+            for prod in self.productions:
+                all_types.add(prod.type)
+                all_types.update(map(lambda x: x.type, prod.constructor.fields))
+                all_fields.update(prod.constructor.fields)
+
+            self.types = sorted(all_types, key=lambda x: x.name)
+            self.fields = sorted(all_fields, key=lambda x: (x.name, x.type.name, x.cardinality))
+
+        self.prod2id = {prod: i for i, prod in enumerate(self.productions)}
+        self.type2id = {type: i for i, type in enumerate(self.types)}
+        self.field2id = {field: i for i, field in enumerate(self.fields)}
+
+        # bitsets over type ids
+        self.composite_type_bits = 0
+        self.primitive_type_bits = 0
+        for type_id, asdl_type in enumerate(self.types):
+            if isinstance(asdl_type, ASDLCompositeType):
+                self.composite_type_bits |= 1 << type_id
+            elif isinstance(asdl_type, ASDLPrimitiveType):
+                self.primitive_type_bits |= 1 << type_id
+
+        self.composite_types = [t for t in self.types if isinstance(t, ASDLCompositeType)]
+        self.primitive_types = [t for t in self.types if isinstance(t, ASDLPrimitiveType)]
+
+        # type id -> ids of the productions headed by that type in declaration order, empty for primitive types.
+        # The order of candidate productions breaks ties between equally scored hypotheses in the beam search
+        self.type_prod_ids = [()] * len(self.types)
+        for asdl_type, productions in grammar._productions.items():
+            self.type_prod_ids[self.type2id[asdl_type]] = tuple(self.prod2id[prod] for prod in productions)
+
+        # field id -> type id
+        self.field_type_ids = [self.type2id[field.type] for field in self.fields]
+
+    def is_composite_type(self, asdl_type):
+        type_id = self.type2id.get(asdl_type)
+
+        return type_id is not None and (self.composite_type_bits >> type_id) & 1 == 1
+
+    def is_primitive_type(self, asdl_type):
+        type_id = self.type2id.get(asdl_type)
+
+        return type_id is not None and (self.primitive_type_bits >> type_id) & 1 == 1
+
+    def get_prod_ids_by_type(self, asdl_type):
+        type_id = self.type2id[asdl_type]
+
+        return self.type_prod_ids[type_id]
+
+    def get_prod_id(self, prod):
+        """id of a production, looked up by object identity first to avoid hashing the production"""
+        if not hasattr(self, '_prod_ids_by_identity'):
+            self._prod_ids_by_identity = {id(prod): i for i, prod in enumerate(self.productions)}
+
+        prod_id = self._prod_ids_by_identity.get(id(prod))
+        if prod_id is None:
+            prod_id = self.prod2id[prod]
+
+        return prod_id
+
+    def __getstate__(self):
+        # object ids are only valid in the current process
+        state = dict(self.__dict__)
+        state.pop('_prod_ids_by_identity', None)
+
+        return state
+
+
 class ASDLProduction(object):
     def __init__(self, type, constructor):
         self.type = type
@@ -224,6 +439,8 @@ class ASDLConstructor(object):
 
 
 class Field(object):
+    __slots__ = ('name', 'type', 'cardinality')
+
     def __init__(self, name, type, cardinality):
         self.name = name
         self.type = type
@@ -246,6 +463,12 @@ class Field(object):
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def __getstate__(self):
+        return get_slots_state(self)
+
+    def __setstate__(self, state):
+        set_slots_state(self, state)
+
     def __repr__(self, plain=False):
         plain_repr = '%s%s %s' % (self.type.__repr__(plain=True),
                                   Field.get_cardinality_repr(self.cardinality),
@@ -5,10 +5,15 @@ try:
 except:
     from io import StringIO
 
+import hashlib
+
 from .asdl import *
+from .utils import get_slots_state, set_slots_state
 
 
 class AbstractSyntaxTree(object):
+    __slots__ = ('production', 'fields', 'parent_field', 'created_time', '_digest')
+
     def __init__(self, production, realized_fields=None):
         self.production = production
 
@@ -21,6 +26,9 @@ class AbstractSyntaxTree(object):
         # used in decoding, record the time step when this node was created
         self.created_time = 0
 
+        # cached structural digest, a tuple of (unordered_fields, digest)
+        self._digest = None
+
         if realized_fields:
             assert len(realized_fields) == len(self.production.fields)
 
@@ -64,8 +72,118 @@ class AbstractSyntaxTree(object):
                 for value in old_field.as_value_list:
                     new_field.add_value(value)
 
+        new_tree._digest = getattr(self, '_digest', None)
+
         return new_tree
 
+    def structural_digest(self, unordered_fields=None):
+        """
+        Canonical digest of the tree structure, which ignores decoding metadata like `created_time`.
+        Two trees have the same digest iff they have the same productions and primitive values.
+
+        Args:
+            unordered_fields: optional dict mapping (constructor name, field name) to a sort key
+                function over child nodes (or None to sort by child digests). Values of these fields
+                are compared after sorting. Use the same dict object for all comparisons, since
+                the digest is cached per `unordered_fields` object.
+
+        The digest is computed once and cached on each node; adding values to a field of the tree
+        resets the cache, assigning `RealizedField.value` directly requires `reset_digest()`.
+        """
+        cached = getattr(self, '_digest', None)
+        if cached is not None and cached[0] is unordered_fields:
+            return cached[1]
+
+        constructor_name = self.production.constructor.name
+        sb = [self.production.type.name, constructor_name]
+        for field in self.fields:
+            values = field.as_value_list
+            if isinstance(field.type, ASDLCompositeType):
+                child_digests = [val.structural_digest(unordered_fields) for val in values]
+                if unordered_fields and (constructor_name, field.name) in unordered_fields:
+                    sort_key = unordered_fields[(constructor_name, field.name)]
+                    if sort_key is None:
+                        child_digests.sort()
+                    else:
+                        child_digests = [digest for key, digest in sorted(zip(map(sort_key, values), child_digests),
+                                                                          key=lambda x: x[0])]
+            else:
+                # length-prefixed, so that values containing separators cannot collide
+                child_digests = ['%d:%s' % (len(repr(val)), repr(val)) for val in values]
+
+            sb.append('%s[%s]' % (field.name, ','.join(child_digests)))
+
+        digest = hashlib.md5(' '.join(sb).encode('utf-8')).hexdigest()
+        self._digest = (unordered_fields, digest)
+
+        return digest
+
+    def reset_digest(self):
+        """reset the cached structural digest of this node and its ancestors"""
+        node = self
+        while node is not None and getattr(node, '_digest', None) is not None:
+            node._digest = None
+            node = node.parent_field.parent_node if node.parent_field else None
+
+    def structurally_equal(self, other, unordered_fields=None):
+        """compare two trees by their cached structural digests, ignoring decoding metadata"""
+        return isinstance(other, AbstractSyntaxTree) and \
+            self.structural_digest(unordered_fields) == other.structural_digest(unordered_fields)
+
+    def to_tuple(self, grammar):
+        """
+        compact form of the tree as nested tuples (production id, field value, ...), where the value of a
+        field with multiple cardinality is a tuple. It is much cheaper to pickle than the tree itself
+        """
+        values = [grammar.compiled.get_prod_id(self.production)]
+        for field in self.fields:
+            if isinstance(field.type, ASDLCompositeType):
+                if field.cardinality == 'multiple':
+                    values.append(tuple(child.to_tuple(grammar) for child in field.value))
+                else:
+                    values.append(field.value.to_tuple(grammar) if field.value is not None else None)
+            elif field.cardinality == 'multiple':
+                values.append(tuple(field.value))
+            else:
+                values.append(field.value)
+
+        return tuple(values)
+
+    @staticmethod
+    def from_tuple(grammar, tree_tuple, parent_field=None):
+        """rebuild a tree from `to_tuple`, decoding metadata like `created_time` is not kept"""
+        # nodes and fields are filled in directly instead of going through `__init__` and `add_value`,
+        # which is about three times faster
+        production = grammar.id2prod[tree_tuple[0]]
+        tree = AbstractSyntaxTree.__new__(AbstractSyntaxTree)
+        tree.production = production
+        tree.parent_field = parent_field
+        tree.created_time = 0
+        tree._digest = None
+        tree.fields = []
+
+        for field, value in zip(production.fields, tree_tuple[1:]):
+            realized_field = RealizedField.__new__(RealizedField)
+            realized_field.name = field.name
+            realized_field.type = field.type
+            realized_field.cardinality = field.cardinality
+            realized_field.field = field
+            realized_field.parent_node = tree
+            realized_field._not_single_cardinality_finished = False
+
+            if isinstance(field.type, ASDLCompositeType):
+                if field.cardinality == 'multiple':
+                    value = [AbstractSyntaxTree.from_tuple(grammar, child, realized_field) for child in value]
+                elif value is not None:
+                    value = AbstractSyntaxTree.from_tuple(grammar, value, realized_field)
+            elif field.cardinality == 'multiple':
+                value = list(value)
+
+            realized_field.value = value
+            tree.fields.append(realized_field)
+
+        return tree
+
     def to_string(self, sb=None):
         is_root = False
         if sb is None:
@@ -126,6 +244,12 @@ class AbstractSyntaxTree(object):
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def __getstate__(self):
+        return get_slots_state(self)
+
+    def __setstate__(self, state):
+        set_slots_state(self, state)
+
     def __repr__(self):
         return repr(self.production)
 
@@ -143,6 +267,8 @@ class AbstractSyntaxTree(object):
 
 class RealizedField(Field):
     """wrapper of field realized with values"""
+    __slots__ = ('parent_node', 'field', 'value', '_not_single_cardinality_finished')
+
     def __init__(self, field, value=None, parent=None):
         super(RealizedField, self).__init__(field.name, field.type, field.cardinality)
 
@@ -171,6 +297,9 @@ class RealizedField(Field):
         if isinstance(value, AbstractSyntaxTree):
             value.parent_field = self
 
+        if self.parent_node is not None:
+            self.parent_node.reset_digest()
+
         if self.cardinality == 'multiple':
             self.value.append(value)
         else:
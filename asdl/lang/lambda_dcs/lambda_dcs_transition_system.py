@@ -7,6 +7,24 @@ from .logical_form import ast_to_logical_form, logical_form_to_ast, Node, parse_
 from common.registerable import Registrable
 
 
+def get_logical_form_name(ast_node):
+    """name of the logical form node `ast_to_logical_form` converts `ast_node` into"""
+    constructor_name = ast_node.production.constructor.name
+    if constructor_name == 'Apply':
+        return ast_node['predicate'].value
+    elif constructor_name == 'Compare':
+        return {'GreaterThan': '>', 'Equal': '=', 'LessThan': '<'}[ast_node['op'].value.production.constructor.name]
+    elif constructor_name in ('Variable', 'Entity', 'Number'):
+        return ast_node.fields[0].value
+    else:
+        return constructor_name.lower()
+
+
+# `Node.__eq__` compares children of conjunctions and disjunctions after sorting them by name
+UNORDERED_FIELDS = {('And', 'arguments'): get_logical_form_name,
+                    ('Or', 'arguments'): get_logical_form_name}
+
+
 @Registrable.register('lambda_dcs')
 class LambdaCalculusTransitionSystem(TransitionSystem):
     def tokenize_code(self, code, mode=None):
@@ -16,10 +34,13 @@ class LambdaCalculusTransitionSystem(TransitionSystem):
         return logical_form_to_ast(self.grammar, parse_lambda_expr(code))
 
     def compare_ast(self, hyp_ast, ref_ast):
-        ref_lf = ast_to_logical_form(ref_ast)
-        hyp_lf = ast_to_logical_form(hyp_ast)
+        return hyp_ast.structurally_equal(ref_ast, UNORDERED_FIELDS)
+
+    def get_reference(self, ref_ast):
+        return ref_ast.structural_digest(UNORDERED_FIELDS)
 
-        return ref_lf == hyp_lf
+    def compare_ast_to_reference(self, hyp_ast, ref_digest):
+        return hyp_ast.structural_digest(UNORDERED_FIELDS) == ref_digest
 
     def ast_to_surface_code(self, asdl_ast):
         lf = ast_to_logical_form(asdl_ast)
@@ -238,10 +238,21 @@ def is_equal_ast(this_ast, other_ast):
     return True
 
 
+# arguments of conjunctions and disjunctions are compared regardless of their order, as in `is_equal_ast`
+UNORDERED_FIELDS = {('And', 'arguments'): lambda x: x.to_string(),
+                    ('Or', 'arguments'): lambda x: x.to_string()}
+
+
 @Registrable.register('prolog')
 class PrologTransitionSystem(TransitionSystem):
     def compare_ast(self, hyp_ast, ref_ast):
-        return is_equal_ast(hyp_ast, ref_ast)
+        return hyp_ast.structurally_equal(ref_ast, UNORDERED_FIELDS)
+
+    def get_reference(self, ref_ast):
+        return ref_ast.structural_digest(UNORDERED_FIELDS)
+
+    def compare_ast_to_reference(self, hyp_ast, ref_digest):
+        return hyp_ast.structural_digest(UNORDERED_FIELDS) == ref_digest
 
     def ast_to_surface_code(self, asdl_ast):
         return ast_to_prolog_expr(asdl_ast)
@@ -250,7 +261,7 @@ class PrologTransitionSystem(TransitionSystem):
         return prolog_expr_to_ast(self.grammar, code)
 
     def hyp_correct(self, hyp, example):
-        return is_equal_ast(hyp.tree, example.tgt_ast)
+        return self.compare_ast(hyp.tree, example.tgt_ast)
 
     def tokenize_code(self, code, mode):
         return code.split(' ')
@@ -2,6 +2,7 @@
 
 import sys
 
+from asdl.asdl import ASDLCompositeType
 from asdl.asdl_ast import RealizedField, AbstractSyntaxTree
 
 
@@ -67,7 +68,7 @@ def asdl_ast_to_python_ast(asdl_ast_node, grammar):
     for field in asdl_ast_node.fields:
         # for composite node
         field_value = None
-        if grammar.is_composite_type(field.type):
+        if isinstance(field.type, ASDLCompositeType):
             if field.value and field.cardinality == 'multiple':
                 field_value = []
                 for val in field.value:
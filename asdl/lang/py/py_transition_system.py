@@ -27,10 +27,15 @@ class PythonTransitionSystem(TransitionSystem):
         return code
 
     def compare_ast(self, hyp_ast, ref_ast):
-        hyp_code = self.ast_to_surface_code(hyp_ast)
+        return self.compare_ast_to_reference(hyp_ast, self.get_reference(ref_ast))
+
+    def get_reference(self, ref_ast):
         ref_reformatted_code = self.ast_to_surface_code(ref_ast)
 
-        ref_code_tokens = tokenize_code(ref_reformatted_code)
+        return tokenize_code(ref_reformatted_code)
+
+    def compare_ast_to_reference(self, hyp_ast, ref_code_tokens):
+        hyp_code = self.ast_to_surface_code(hyp_ast)
         hyp_code_tokens = tokenize_code(hyp_code)
 
         return ref_code_tokens == hyp_code_tokens
@@ -0,0 +1,774 @@
+# coding=utf-8
+
+"""
+Fast generation of Python 3 source code from Python ASTs, producing exactly the same output as `astor.to_source`.
+
+The generator follows the formatting rules of astor's `SourceGenerator` (precedence-based parenthesization,
+string quoting, blank lines around definitions), but passes operator precedences down the recursion instead
+of annotating AST nodes, and does not go through astor's generic line-wrapping post-processing.
+Code that astor would wrap or re-indent (lines longer than 79 characters, multi-line string literals),
+and AST nodes not covered here, are delegated to `astor.to_source`.
+"""
+
+import math
+
+import astor
+from astor.op_util import get_op_symbol, get_op_precedence, Precedence
+from astor.string_repr import pretty_string
+
+
+INDENT = ' ' * 4
+# astor wraps lines longer than this
+MAX_LINE_LENGTH = 79
+
+HIGHEST = Precedence.highest
+COMMA = Precedence.Comma
+
+
+class UnsupportedCode(Exception):
+    pass
+
+
+class SourceGenerator(object):
+    def __init__(self):
+        self.result = []
+        self.indentation = 0
+        # number of line feeds to insert before next code
+        self.new_lines = 0
+        # total number of line feeds inserted
+        self.num_line_feeds = 0
+        # index in result of the string starting the current line
+        self.line_start = 0
+
+    def write(self, text):
+        if self.new_lines:
+            self.result.append('\n' * self.new_lines)
+            self.num_line_feeds += self.new_lines
+            self.line_start = len(self.result)
+            self.result.append(INDENT * self.indentation)
+            self.new_lines = 0
+        if text:
+            self.result.append(text)
+
+    def newline(self, extra=0):
+        self.new_lines = max(self.new_lines, 1 + extra)
+
+    def to_source(self, node):
+        self.visit_stmt(node)
+        self.result.append('\n')
+        self.num_line_feeds += 1
+
+        result = self.result
+        if set(result[0]) == {'\n'}:
+            self.num_line_feeds -= len(result[0])
+            result[0] = ''
+
+        code = ''.join(result)
+        # some identifier or literal spans multiple lines
+        if code.count('\n') != self.num_line_feeds:
+            raise UnsupportedCode()
+        if len(code) > MAX_LINE_LENGTH and max(len(line) for line in code.split('\n')) > MAX_LINE_LENGTH:
+            raise UnsupportedCode()
+
+        return code
+
+    # Statements
+
+    def visit_stmt(self, node):
+        visitor = _stmt_visitors.get(type(node).__name__)
+        if visitor is None:
+            raise UnsupportedCode()
+
+        visitor(self, node)
+
+    def body(self, statements):
+        self.indentation += 1
+        for stmt in statements:
+            self.visit_stmt(stmt)
+        self.indentation -= 1
+
+    def else_body(self, orelse):
+        if orelse:
+            self.newline()
+            self.write('else:')
+            self.body(orelse)
+
+    def decorators(self, node, extra):
+        self.newline(extra)
+        for decorator in node.decorator_list:
+            self.newline()
+            self.write('@')
+            self.visit_expr(decorator, HIGHEST)
+
+    def visit_Module(self, node):
+        for stmt in node.body:
+            self.visit_stmt(stmt)
+
+    def visit_Expression(self, node):
+        self.visit_expr(node.body, HIGHEST)
+
+    def visit_Assign(self, node):
+        p = Precedence.Assign
+        self.newline()
+        for target in node.targets:
+            self.visit_expr(target, p)
+            self.write(' = ')
+        self.visit_expr(node.value, p)
+
+    def visit_AugAssign(self, node):
+        p = Precedence.AugAssign
+        self.newline()
+        self.visit_expr(node.target, p)
+        self.write(get_op_symbol(node.op, ' %s= '))
+        self.visit_expr(node.value, p)
+
+    def visit_ImportFrom(self, node):
+        self.newline()
+        self.write('from ')
+        self.write(node.level * '.')
+        self.write(node.module or '')
+        self.write(' import ')
+        self.comma_list(node.names, self.visit_alias)
+
+    def visit_Import(self, node):
+        self.newline()
+        self.write('import ')
+        self.comma_list(node.names, self.visit_alias)
+
+    def visit_Expr(self, node):
+        self.newline()
+        self.visit_expr(node.value, Precedence.Expr)
+
+    def visit_FunctionDef(self, node, prefix=''):
+        self.decorators(node, 1 if self.indentation else 2)
+        self.newline()
+        self.write('%sdef %s' % (prefix, node.name))
+        self.write('(')
+        self.visit_arguments(node.args)
+        self.write(')')
+        returns = getattr(node, 'returns', None)
+        if returns is not None:
+            self.write(' ->')
+            self.visit_expr(returns, HIGHEST)
+        self.write(':')
+        self.body(node.body)
+        if not self.indentation:
+            self.newline(2)
+
+    def visit_AsyncFunctionDef(self, node):
+        self.visit_FunctionDef(node, prefix='async ')
+
+    def visit_ClassDef(self, node):
+        self.decorators(node, 2)
+        self.newline()
+        self.write('class %s' % node.name)
+
+        have_args = False
+        for base in node.bases:
+            self.write(', ' if have_args else '(')
+            have_args = True
+            self.visit_expr(base, HIGHEST)
+        for keyword in getattr(node, 'keywords', ()):
+            self.write(', ' if have_args else '(')
+            have_args = True
+            self.write(keyword.arg or '')
+            self.write('=' if keyword.arg else '**')
+            self.visit_expr(keyword.value, HIGHEST)
+
+        self.write('):' if have_args else ':')
+        self.body(node.body)
+        if not self.indentation:
+            self.newline(2)
+
+    def visit_If(self, node):
+        p = Precedence.If
+        self.newline()
+        self.write('if ')
+        self.visit_expr(node.test, p)
+        self.write(':')
+        self.body(node.body)
+        while True:
+            orelse = node.orelse
+            if len(orelse) == 1 and type(orelse[0]).__name__ == 'If':
+                node = orelse[0]
+                self.newline()
+                self.write('elif ')
+                self.visit_expr(node.test, p)
+                self.write(':')
+                self.body(node.body)
+            else:
+                self.else_body(orelse)
+                break
+
+    def visit_For(self, node, prefix=''):
+        self.newline()
+        self.write('%sfor ' % prefix)
+        self.visit_expr(node.target, Precedence.For)
+        self.write(' in ')
+        self.visit_expr(node.iter, HIGHEST)
+        self.write(':')
+        self.body(node.body)
+        self.else_body(node.orelse)
+
+    def visit_AsyncFor(self, node):
+        self.visit_For(node, prefix='async ')
+
+    def visit_While(self, node):
+        self.newline()
+        self.write('while ')
+        self.visit_expr(node.test, Precedence.While)
+        self.write(':')
+        self.body(node.body)
+        self.else_body(node.orelse)
+
+    def visit_With(self, node, prefix=''):
+        self.newline()
+        self.write('%swith ' % prefix)
+        self.comma_list(node.items, self.visit_withitem)
+        self.write(':')
+        self.body(node.body)
+
+    def visit_AsyncWith(self, node):
+        self.visit_With(node, prefix='async ')
+
+    def visit_withitem(self, node):
+        self.visit_expr(node.context_expr, HIGHEST)
+        if node.optional_vars is not None:
+            self.write(' as ')
+            self.visit_expr(node.optional_vars, HIGHEST)
+
+    def visit_Pass(self, node):
+        self.newline()
+        self.write('pass')
+
+    def visit_Break(self, node):
+        self.newline()
+        self.write('break')
+
+    def visit_Continue(self, node):
+        self.newline()
+        self.write('continue')
+
+    def visit_Delete(self, node):
+        self.newline()
+        self.write('del ')
+        self.comma_list(node.targets)
+
+    def visit_Try(self, node):
+        self.newline()
+        self.write('try:')
+        self.body(node.body)
+        for handler in node.handlers:
+            self.visit_ExceptHandler(handler)
+        self.else_body(node.orelse)
+        if node.finalbody:
+            self.newline()
+            self.write('finally:')
+            self.body(node.finalbody)
+
+    def visit_ExceptHandler(self, node):
+        self.newline()
+        self.write('except')
+        if node.type is not None:
+            self.write(' ')
+            self.visit_expr(node.type, HIGHEST)
+            if node.name is not None:
+                self.write(' as ')
+                self.write(node.name)
+        self.write(':')
+        self.body(node.body)
+
+    def visit_Assert(self, node):
+        p = Precedence.Assert
+        self.newline()
+        self.write('assert ')
+        self.visit_expr(node.test, p)
+        if node.msg is not None:
+            self.write(', ')
+            self.visit_expr(node.msg, p)
+
+    def visit_Global(self, node):
+        self.newline()
+        self.write('global ')
+        self.write(', '.join(node.names))
+
+    def visit_Nonlocal(self, node):
+        self.newline()
+        self.write('nonlocal ')
+        self.write(', '.join(node.names))
+
+    def visit_Return(self, node):
+        self.newline()
+        self.write('return')
+        if node.value is not None:
+            self.write(' ')
+            self.visit_expr(node.value, Precedence.Return)
+
+    def visit_Raise(self, node):
+        self.newline()
+        self.write('raise')
+        if node.exc is not None:
+            self.write(' ')
+            self.visit_expr(node.exc, HIGHEST)
+            if node.cause is not None:
+                self.write(' from ')
+                self.visit_expr(node.cause, HIGHEST)
+
+    # Helper nodes
+
+    def visit_arguments(self, node):
+        # a list, so that the closure can update it
+        want_comma = []
+
+        def loop_args(args, defaults):
+            padding = [None] * (len(args) - len(defaults))
+            for arg, default in zip(args, padding + defaults):
+                write_comma()
+                self.visit_arg(arg)
+                if default is not None:
+                    self.write('=')
+                    self.visit_expr(default, COMMA)
+
+        def write_comma():
+            if want_comma:
+                self.write(', ')
+            else:
+                want_comma.append(True)
+
+        if getattr(node, 'posonlyargs', None):
+            raise UnsupportedCode()
+
+        loop_args(node.args, node.defaults)
+        if node.vararg is not None:
+            write_comma()
+            self.write('*')
+            self.visit_arg(node.vararg)
+
+        kwonlyargs = getattr(node, 'kwonlyargs', ())
+        if kwonlyargs:
+            if node.vararg is None:
+                write_comma()
+                self.write('*')
+            loop_args(kwonlyargs, node.kw_defaults)
+
+        if node.kwarg is not None:
+            write_comma()
+            self.write('**')
+            self.visit_arg(node.kwarg)
+
+    def visit_arg(self, node):
+        self.write(node.arg)
+        if node.annotation is not None:
+            self.write(': ')
+            self.visit_expr(node.annotation, HIGHEST)
+
+    def visit_alias(self, node):
+        self.write(node.name)
+        if node.asname is not None:
+            self.write(' as ')
+            self.write(node.asname)
+
+    def visit_comprehension(self, node):
+        p = Precedence.comprehension
+        self.write(' async for ' if getattr(node, 'is_async', None) else ' for ')
+        self.visit_expr(node.target, Precedence.comprehension_target)
+        self.write(' in ')
+        self.visit_expr(node.iter, p)
+        for if_ in node.ifs:
+            self.write(' if ')
+            self.visit_expr(if_, p)
+
+    def comma_list(self, items, visitor=None, trailing=False):
+        for idx, item in enumerate(items):
+            if idx:
+                self.write(', ')
+            if visitor is None:
+                self.visit_expr(item, COMMA)
+            else:
+                visitor(item)
+        if trailing:
+            self.write(',')
+
+    # Expressions, `pp` is the precedence set by the parent node
+
+    def visit_expr(self, node, pp):
+        visitor = _expr_visitors.get(type(node).__name__)
+        if visitor is None:
+            raise UnsupportedCode()
+
+        visitor(self, node, pp)
+
+    def open_paren(self, p, pp, delimiters='()'):
+        """write the opening delimiter unless the precedence of the node is higher than its parent,
+        return whether to close it"""
+        if p >= pp:
+            # flush any pending line feed as astor does
+            self.write('')
+            return False
+
+        self.write(delimiters[0])
+        return True
+
+    def visit_Attribute(self, node, pp):
+        self.visit_expr(node.value, HIGHEST)
+        self.write('.')
+        self.write(node.attr)
+
+    def visit_Call(self, node, pp):
+        args = node.args
+        keywords = node.keywords
+        p = COMMA if len(args) + len(keywords) > 1 else Precedence.call_one_arg
+
+        self.visit_expr(node.func, HIGHEST)
+        self.write('(')
+        want_comma = False
+        for arg in args:
+            if want_comma:
+                self.write(', ')
+            want_comma = True
+            self.visit_expr(arg, p)
+
+        for keyword in keywords:
+            if want_comma:
+                self.write(', ')
+            want_comma = True
+            # a keyword.arg of None indicates dictionary unpacking
+            arg = keyword.arg or ''
+            self.write(arg)
+            self.write('=' if arg else '**')
+            self.visit_expr(keyword.value, COMMA)
+        self.write(')')
+
+    def visit_Name(self, node, pp):
+        self.write(node.id)
+
+    def visit_Constant(self, node, pp):
+        value = node.value
+        if isinstance(value, (int, float, complex)):
+            close = self.open_paren(Precedence.Constant, pp)
+            self.write(numeric_constant_repr(value))
+            if close: self.write(')')
+        elif isinstance(value, str):
+            self.write_string_constant(node, value, pp)
+        elif value is Ellipsis:
+            self.write('...')
+        else:
+            self.write(repr(value))
+
+    def visit_Str(self, node, pp):
+        self.write_string_constant(node, node.s, pp)
+
+    def write_string_constant(self, node, value, pp):
+        # whether the string could be written as a triple-quoted string depends on its context
+        embedded = (pp > Precedence.Expr) + (pp >= Precedence.Assign)
+
+        self.write('')
+        current_line = ''.join(self.result[self.line_start:])
+
+        string_repr = pretty_string(value, embedded, current_line, False)
+        string_repr = getattr(node, 'kind', None) and node.kind + string_repr or string_repr
+        self.write(string_repr)
+
+    def visit_Bytes(self, node, pp):
+        self.write(repr(node.s))
+
+    def visit_NameConstant(self, node, pp):
+        self.write(repr(node.value))
+
+    def visit_Ellipsis(self, node, pp):
+        self.write('...')
+
+    def visit_Num(self, node, pp):
+        close = self.open_paren(Precedence.Num, pp)
+        self.write(numeric_constant_repr(node.n))
+        if close: self.write(')')
+
+    def visit_Tuple(self, node, pp):
+        elts = node.elts
+        # parentheses of an empty tuple are never discarded
+        close = self.open_paren(Precedence.Tuple if elts else -1, pp)
+        self.comma_list(elts, trailing=len(elts) == 1)
+        if close: self.write(')')
+
+    def visit_List(self, node, pp):
+        self.write('[')
+        self.comma_list(node.elts)
+        self.write(']')
+
+    def visit_Set(self, node, pp):
+        if node.elts:
+            self.write('{')
+            self.comma_list(node.elts)
+            self.write('}')
+        else:
+            self.write('{1}.__class__()')
+
+    def visit_Dict(self, node, pp):
+        self.write('{')
+        for idx, (key, value) in enumerate(zip(node.keys, node.values)):
+            if idx:
+                self.write(', ')
+            if key is not None:
+                self.visit_expr(key, HIGHEST)
+                self.write(': ')
+            else:
+                self.write('**')
+            self.visit_expr(value, COMMA)
+        self.write('}')
+
+    def visit_BinOp(self, node, pp):
+        op = node.op
+        p = get_op_precedence(op)
+        close = self.open_paren(p, pp)
+        if type(op).__name__ == 'Pow':
+            self.visit_expr(node.left, Precedence.Pow + 1)
+            self.write(get_op_symbol(op, ' %s '))
+            self.visit_expr(node.right, Precedence.PowRHS)
+        else:
+            self.visit_expr(node.left, p)
+            self.write(get_op_symbol(op, ' %s '))
+            self.visit_expr(node.right, p + 1)
+        if close: self.write(')')
+
+    def visit_BoolOp(self, node, pp):
+        p = get_op_precedence(node.op)
+        close = self.open_paren(p, pp)
+        op = get_op_symbol(node.op, ' %s ')
+        for idx, value in enumerate(node.values):
+            if idx:
+                self.write(op)
+            self.visit_expr(value, p + 1)
+        if close: self.write(')')
+
+    def visit_Compare(self, node, pp):
+        p = get_op_precedence(node.ops[0])
+        close = self.open_paren(p, pp)
+        self.visit_expr(node.left, p + 1)
+        for op, right in zip(node.ops, node.comparators):
+            self.write(get_op_symbol(op, ' %s '))
+            self.visit_expr(right, p + 1)
+        if close: self.write(')')
+
+    def visit_UnaryOp(self, node, pp):
+        p = get_op_precedence(node.op)
+        close = self.open_paren(p, pp)
+        sym = get_op_symbol(node.op)
+        self.write(sym)
+        self.write(' ' if sym.isalpha() else '')
+        self.visit_expr(node.operand, p)
+        if close: self.write(')')
+
+    def visit_Subscript(self, node, pp):
+        self.visit_expr(node.value, HIGHEST)
+        self.write('[')
+        self.visit_expr(node.slice, Precedence.Subscript)
+        self.write(']')
+
+    def visit_Slice(self, node, pp):
+        p = Precedence.Slice
+        if node.lower is not None:
+            self.visit_expr(node.lower, p)
+        self.write(':')
+        if node.upper is not None:
+            self.visit_expr(node.upper, p)
+        if node.step is not None:
+            self.write(':')
+            if not (type(node.step).__name__ == 'Name' and node.step.id == 'None'):
+                self.visit_expr(node.step, p)
+
+    def visit_Index(self, node, pp):
+        p = Precedence.Index
+        close = self.open_paren(p, pp)
+        self.visit_expr(node.value, p)
+        if close: self.write(')')
+
+    def visit_ExtSlice(self, node, pp):
+        dims = node.dims
+        self.comma_list(dims, trailing=len(dims) == 1)
+
+    def visit_Yield(self, node, pp):
+        p = Precedence.Yield
+        close = self.open_paren(p, pp)
+        self.write('yield')
+        if node.value is not None:
+            self.write(' ')
+            self.visit_expr(node.value, p + 1)
+        if close: self.write(')')
+
+    def visit_YieldFrom(self, node, pp):
+        close = self.open_paren(Precedence.YieldFrom, pp)
+        self.write('yield from ')
+        self.visit_expr(node.value, HIGHEST)
+        if close: self.write(')')
+
+    def visit_Await(self, node, pp):
+        close = self.open_paren(Precedence.Await, pp)
+        self.write('await ')
+        self.visit_expr(node.value, HIGHEST)
+        if close: self.write(')')
+
+    def visit_Lambda(self, node, pp):
+        p = Precedence.Lambda
+        close = self.open_paren(p, pp)
+        self.write('lambda ')
+        self.visit_arguments(node.args)
+        self.write(': ')
+        self.visit_expr(node.body, p)
+        if close: self.write(')')
+
+    def visit_ListComp(self, node, pp):
+        self.write('[')
+        self.visit_expr(node.elt, HIGHEST)
+        for generator in node.generators:
+            self.visit_comprehension(generator)
+        self.write(']')
+
+    def visit_GeneratorExp(self, node, pp):
+        # the sole argument of a call does not need parentheses
+        p = HIGHEST if pp == Precedence.call_one_arg else Precedence.GeneratorExp
+        close = self.open_paren(p, pp)
+        self.visit_expr(node.elt, COMMA)
+        for generator in node.generators:
+            self.visit_comprehension(generator)
+        if close: self.write(')')
+
+    def visit_SetComp(self, node, pp):
+        self.write('{')
+        self.visit_expr(node.elt, HIGHEST)
+        for generator in node.generators:
+            self.visit_comprehension(generator)
+        self.write('}')
+
+    def visit_DictComp(self, node, pp):
+        self.write('{')
+        self.visit_expr(node.key, HIGHEST)
+        self.write(': ')
+        self.visit_expr(node.value, HIGHEST)
+        for generator in node.generators:
+            self.visit_comprehension(generator)
+        self.write('}')
+
+    def visit_IfExp(self, node, pp):
+        p = Precedence.IfExp
+        close = self.open_paren(p, pp)
+        self.visit_expr(node.body, p + 1)
+        self.write(' if ')
+        self.visit_expr(node.test, p + 1)
+        self.write(' else ')
+        self.visit_expr(node.orelse, p)
+        if close: self.write(')')
+
+    def visit_Starred(self, node, pp):
+        self.write('*')
+        self.visit_expr(node.value, HIGHEST)
+
+
+def numeric_constant_repr(value):
+    """representation of a number, infinity is written as 1e1000 and NaN as 1e1000-1e1000"""
+    def part(p, imaginary):
+        s = 'j' if imaginary else ''
+        try:
+            if math.isinf(p):
+                if p < 0:
+                    return '-1e1000' + s
+                return '1e1000' + s
+            if math.isnan(p):
+                return '(1e1000%s-1e1000%s)' % (s, s)
+        except OverflowError:
+            # integers too large to be converted to a float
+            pass
+        return repr(p) + s
+
+    real = part(value.real if isinstance(value, complex) else value, imaginary=False)
+    if isinstance(value, complex):
+        imag = part(value.imag, imaginary=True)
+        if value.real == 0:
+            return imag
+        elif value.imag == 0:
+            return '(%s+0j)' % real
+        else:
+            return '(%s%s%s)' % (real, ['+', ''][imag.startswith('-')], imag)
+
+    return real
+
+
+_stmt_visitors = {name[len('visit_'):]: func for name, func in vars(SourceGenerator).items()
+                  if name.startswith('visit_') and name[len('visit_'):] in
+                  ('Module', 'Expression', 'Interactive', 'Assign', 'AugAssign', 'ImportFrom', 'Import', 'Expr',
+                   'FunctionDef', 'AsyncFunctionDef', 'ClassDef', 'If', 'For', 'AsyncFor', 'While', 'With',
+                   'AsyncWith', 'Pass', 'Break', 'Continue', 'Delete', 'Try', 'Assert', 'Global', 'Nonlocal',
+                   'Return', 'Raise')}
+_stmt_visitors['Interactive'] = SourceGenerator.visit_Module
+
+_expr_visitors = {name[len('visit_'):]: func for name, func in vars(SourceGenerator).items()
+                  if name.startswith('visit_') and name[len('visit_'):] in
+                  ('Attribute', 'Call', 'Name', 'Constant', 'Str', 'Bytes', 'NameConstant', 'Ellipsis', 'Num',
+                   'Tuple', 'List', 'Set', 'Dict', 'BinOp', 'BoolOp', 'Compare', 'UnaryOp', 'Subscript', 'Slice',
+                   'Index', 'ExtSlice', 'Yield', 'YieldFrom', 'Await', 'Lambda', 'ListComp', 'GeneratorExp',
+                   'SetComp', 'DictComp', 'IfExp', 'Starred')}
+
+
+def to_source(node):
+    """same as `astor.to_source(node)` with its default formatting options"""
+    try:
+        return SourceGenerator().to_source(node)
+    except UnsupportedCode:
+        return astor.to_source(node)
+
+
+if __name__ == '__main__':
+    # benchmark against astor on the statements of Python source files, e.g. the standard library
+    import ast
+    import glob
+    import os
+    import sys
+    import time
+
+    files = sys.argv[1:] or sorted(glob.glob(os.path.join(os.path.dirname(ast.__file__), '*.py')))
+    snippets = []
+    for file_path in files:
+        try:
+            tree = ast.parse(open(file_path).read())
+        except (SyntaxError, UnicodeDecodeError):
+            continue
+
+        for node in ast.walk(tree):
+            for field_name in ('body', 'orelse', 'finalbody'):
+                stmts = getattr(node, field_name, None)
+                if isinstance(stmts, list):
+                    snippets.extend(ast.Module(body=[stmt]) for stmt in stmts if isinstance(stmt, ast.stmt))
+
+    def is_supported(snippet):
+        # e.g. `match` statements (Python >= 3.10), which astor has no handler for
+        try:
+            astor.to_source(snippet)
+            to_source(snippet)
+        except Exception:
+            return False
+
+        return True
+
+    num_snippets = len(snippets)
+    snippets = [snippet for snippet in snippets if is_supported(snippet)]
+    if len(snippets) < num_snippets:
+        print('skipped %d snippets that astor or py3_codegen cannot generate' % (num_snippets - len(snippets)))
+
+    def benchmark(name, snippets):
+        begin = time.time()
+        astor_results = [astor.to_source(snippet) for snippet in snippets]
+        astor_time = time.time() - begin
+
+        begin = time.time()
+        results = [to_source(snippet) for snippet in snippets]
+        fast_time = time.time() - begin
+
+        num_mismatches = sum(x != y for x, y in zip(astor_results, results))
+        print('%s: %d snippets, %d mismatches, astor: %.1fus/snippet, py3_codegen: %.1fus/snippet' % (
+            name, len(snippets), num_mismatches,
+            astor_time / len(snippets) * 1e6, fast_time / len(snippets) * 1e6))
+
+    benchmark('all statements', snippets)
+    # CoNaLa-like snippets: one-liners short enough to not be wrapped
+    benchmark('one-line statements', [snippet for snippet in snippets
+                                      if len(astor.to_source(snippet).strip().split('\n')) == 1 and
+                                      len(astor.to_source(snippet)) <= MAX_LINE_LENGTH])
@@ -2,10 +2,9 @@
 
 import ast
 
-import astor
-
 from asdl.lang.py.py_asdl_helper import asdl_ast_to_python_ast, python_ast_to_asdl_ast
 from asdl.lang.py.py_utils import tokenize_code
+from asdl.lang.py3 import py3_codegen
 from asdl.transition_system import TransitionSystem, GenTokenAction
 
 from common.registerable import Registrable
@@ -22,7 +21,7 @@ class Python3TransitionSystem(TransitionSystem):
 
     def ast_to_surface_code(self, asdl_ast):
         py_ast = asdl_ast_to_python_ast(asdl_ast, self.grammar)
-        code = astor.to_source(py_ast).strip()
+        code = py3_codegen.to_source(py_ast).strip()
 
         if code.endswith(':'):
             code += ' pass'
@@ -35,10 +34,15 @@ class Python3TransitionSystem(TransitionSystem):
         return code
 
     def compare_ast(self, hyp_ast, ref_ast):
-        hyp_code = self.ast_to_surface_code(hyp_ast)
+        return self.compare_ast_to_reference(hyp_ast, self.get_reference(ref_ast))
+
+    def get_reference(self, ref_ast):
         ref_reformatted_code = self.ast_to_surface_code(ref_ast)
 
-        ref_code_tokens = tokenize_code(ref_reformatted_code)
+        return tokenize_code(ref_reformatted_code)
+
+    def compare_ast_to_reference(self, hyp_ast, ref_code_tokens):
+        hyp_code = self.ast_to_surface_code(hyp_ast)
         hyp_code_tokens = tokenize_code(hyp_code)
 
         return ref_code_tokens == hyp_code_tokens
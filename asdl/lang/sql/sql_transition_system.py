@@ -19,6 +19,8 @@ ctr_name2agg_idx = {v: k for k, v in agg_idx2op_name.items()}
 
 
 class WikiSqlGenTokenAction(GenTokenAction):
+    __slots__ = ('copy_idx',)
+
     def __init__(self, token, copy_idx=-1):
         super(WikiSqlGenTokenAction, self).__init__(token)
         if not self.is_stop_signal() and copy_idx == -1:
@@ -31,6 +33,8 @@ class WikiSqlGenTokenAction(GenTokenAction):
 
 
 class WikiSqlSelectColumnAction(GenTokenAction):
+    __slots__ = ()
+
     def __init__(self, column_id):
         super(WikiSqlSelectColumnAction, self).__init__(column_id)
 
@@ -102,7 +106,11 @@ class SqlTransitionSystem(TransitionSystem):
         raise NotImplementedError
 
     def surface_code_to_ast(self, code):
-        raise NotImplementedError
+        # a `Query`, or its dict
+        if isinstance(code, dict):
+            code = Query.from_dict(code)
+
+        return sql_query_to_asdl_ast(code, self.grammar)
 
     def get_valid_continuation_types(self, hyp):
         if hyp.tree:
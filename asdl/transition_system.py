@@ -1,11 +1,23 @@
 # coding=utf-8
 
+from .asdl import ASDLGrammar, ASDLCompositeType
+from .asdl_ast import AbstractSyntaxTree
+from .utils import get_slots_state, set_slots_state
+
 
 class Action(object):
-    pass
+    __slots__ = ()
+
+    def __getstate__(self):
+        return get_slots_state(self)
+
+    def __setstate__(self, state):
+        set_slots_state(self, state)
 
 
 class ApplyRuleAction(Action):
+    __slots__ = ('production',)
+
     def __init__(self, production):
         self.production = production
 
@@ -23,6 +35,8 @@ class ApplyRuleAction(Action):
 
 
 class GenTokenAction(Action):
+    __slots__ = ('token',)
+
     def __init__(self, token):
         self.token = token
 
@@ -34,54 +48,115 @@ class GenTokenAction(Action):
 
 
 class ReduceAction(Action):
-   def __repr__(self):
-       return 'Reduce'
+    __slots__ = ()
+
+    def __repr__(self):
+        return 'Reduce'
+
+
+# ReduceAction carries no state, oracle action sequences share a single instance
+reduce_action = ReduceAction()
 
 
 class TransitionSystem(object):
     def __init__(self, grammar):
         self.grammar = grammar
 
+    def __getstate__(self):
+        # the grammar is pickled as a compiled binary blob, which loads much faster than the object graph
+        state = dict(self.__dict__)
+        state['grammar'] = self.grammar.to_bytes()
+        # interned actions are rebuilt lazily
+        state.pop('_apply_rule_actions', None)
+
+        return state
+
+    def __setstate__(self, state):
+        # transition systems pickled by older versions store the grammar object itself
+        if isinstance(state['grammar'], bytes):
+            state = dict(state)
+            state['grammar'] = ASDLGrammar.from_bytes(state['grammar'])
+
+        self.__dict__.update(state)
+
+    def get_apply_rule_action(self, production):
+        """
+        get the interned `ApplyRuleAction` of a production
+        """
+        if not hasattr(self, '_apply_rule_actions'):
+            # keyed by object identity to avoid hashing productions, only the grammar's own productions are
+            # cached since they live as long as the grammar
+            self._apply_rule_actions = {id(prod): ApplyRuleAction(prod) for prod in self.grammar.productions}
+
+        action = self._apply_rule_actions.get(id(production))
+        if action is None:
+            # an equal production object that does not belong to the grammar, e.g., from an unpickled tree
+            prod_id = self.grammar.prod2id[production]
+            action = self._apply_rule_actions[id(self.grammar.id2prod[prod_id])]
+
+        return action
+
     def get_actions(self, asdl_ast):
         """
         generate action sequence given the ASDL Syntax Tree
         """
 
-        actions = []
+        return self.get_oracle(asdl_ast)[0]
 
-        parent_action = ApplyRuleAction(asdl_ast.production)
-        actions.append(parent_action)
+    def get_oracle(self, asdl_ast):
+        """
+        generate the action sequence of an ASDL Syntax Tree in a single, non-recursive pass, together with the
+        frontier each action is predicted at. ApplyRule and Reduce actions are interned.
 
-        for field in asdl_ast.fields:
-            # is a composite field
-            if self.grammar.is_composite_type(field.type):
-                if field.cardinality == 'single':
-                    field_actions = self.get_actions(field.value)
-                else:
-                    field_actions = []
+        Returns:
+            `(actions, frontiers)`, where `frontiers[t]` is a tuple `(parent_t, frontier_prod, frontier_field)`,
+            the same as the frontier information of a `Hypothesis` that applied `actions[:t]`,
+            and `(-1, None, None)` for the root action
+        """
+        actions = []
+        frontiers = []
+
+        # a stack of (item, frontier) in reverse order of expansion, an item is either a node to expand,
+        # a field to fill in, or a pending Reduce action that closes a composite field
+        stack = [(asdl_ast, (-1, None, None))]
+        while stack:
+            item, frontier = stack.pop()
+
+            if isinstance(item, AbstractSyntaxTree):
+                # the node's creation time is the time step of its ApplyRule action
+                node_t = len(actions)
+                actions.append(self.get_apply_rule_action(item.production))
+                frontiers.append(frontier)
+
+                for field in reversed(item.fields):
+                    stack.append((field, (node_t, item.production, field.field)))
+            elif item is reduce_action:
+                actions.append(reduce_action)
+                frontiers.append(frontier)
+            else:
+                field = item
+                if isinstance(field.type, ASDLCompositeType):
+                    # if an optional field is filled, then do not need Reduce action
+                    if field.cardinality == 'multiple' or field.cardinality == 'optional' and field.value is None:
+                        stack.append((reduce_action, frontier))
 
                     if field.value is not None:
                         if field.cardinality == 'multiple':
-                            for val in field.value:
-                                cur_child_actions = self.get_actions(val)
-                                field_actions.extend(cur_child_actions)
-                        elif field.cardinality == 'optional':
-                            field_actions = self.get_actions(field.value)
+                            for val in reversed(field.value):
+                                stack.append((val, frontier))
+                        else:
+                            stack.append((field.value, frontier))
+                else:  # is a primitive field
+                    field_actions = self.get_primitive_field_actions(field)
 
                     # if an optional field is filled, then do not need Reduce action
                     if field.cardinality == 'multiple' or field.cardinality == 'optional' and not field_actions:
-                        field_actions.append(ReduceAction())
-            else:  # is a primitive field
-                field_actions = self.get_primitive_field_actions(field)
+                        field_actions.append(reduce_action)
 
-                # if an optional field is filled, then do not need Reduce action
-                if field.cardinality == 'multiple' or field.cardinality == 'optional' and not field_actions:
-                    # reduce action
-                    field_actions.append(ReduceAction())
+                    actions.extend(field_actions)
+                    frontiers.extend([frontier] * len(field_actions))
 
-            actions.extend(field_actions)
-
-        return actions
+        return actions, frontiers
 
     def tokenize_code(self, code, mode):
         raise NotImplementedError
@@ -89,6 +164,16 @@ class TransitionSystem(object):
     def compare_ast(self, hyp_ast, ref_ast):
         raise NotImplementedError
 
+    def get_reference(self, ref_ast):
+        """
+        reference-side artifact of `ref_ast` used by `compare_ast_to_reference`, e.g., the tokenized
+        reference code. It only depends on the reference, and could be cached for all hypotheses of an example
+        """
+        return ref_ast
+
+    def compare_ast_to_reference(self, hyp_ast, reference):
+        return self.compare_ast(hyp_ast, reference)
+
     def ast_to_surface_code(self, asdl_ast):
         raise NotImplementedError
 
@@ -127,6 +212,16 @@ class TransitionSystem(object):
         else:
             return self.grammar[self.grammar.root_type]
 
+    def get_valid_continuating_production_ids(self, hyp):
+        """same as `get_valid_continuating_productions`, but returns production ids"""
+        if hyp.tree:
+            if self.grammar.is_composite_type(hyp.frontier_field.type):
+                return self.grammar.get_prod_ids_by_type(hyp.frontier_field.type)
+            else:
+                raise ValueError
+        else:
+            return self.grammar.get_prod_ids_by_type(self.grammar.root_type)
+
     @staticmethod
     def get_class_by_lang(lang):
         if lang == 'python':
@@ -7,3 +7,24 @@ def remove_comment(text):
     text = '\n'.join(filter(lambda x: x, text.split('\n')))
 
     return text
+
+
+def get_slots_state(obj):
+    """pickle state of an object using `__slots__`, including the `__dict__` of subclasses without slots"""
+    state = dict()
+    for cls in type(obj).__mro__:
+        for slot in getattr(cls, '__slots__', ()):
+            if hasattr(obj, slot):
+                state[slot] = getattr(obj, slot)
+
+    if hasattr(obj, '__dict__'):
+        state.update(obj.__dict__)
+
+    return state
+
+
+def set_slots_state(obj, state):
+    """restore the pickle state of an object using `__slots__`, the state could also be the
+    `__dict__` of an object pickled before `__slots__` were introduced"""
+    for key, val in state.items():
+        setattr(obj, key, val)
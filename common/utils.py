@@ -1,5 +1,6 @@
 # coding=utf-8
 import argparse
+import sys
 
 
 class cached_property(object):
@@ -21,6 +22,34 @@ class cached_property(object):
         return value
 
 
+def deep_getsizeof(obj, seen=None):
+    """approximate memory footprint (in bytes) of an object and everything it references,
+    objects whose ids are already in `seen` are not counted again"""
+    if seen is None:
+        seen = set()
+
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, val in obj.items():
+            size += deep_getsizeof(key, seen) + deep_getsizeof(val, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for val in obj:
+            size += deep_getsizeof(val, seen)
+    else:
+        if hasattr(obj, '__dict__'):
+            size += deep_getsizeof(obj.__dict__, seen)
+        for cls in type(obj).__mro__:
+            for slot in getattr(cls, '__slots__', ()):
+                if hasattr(obj, slot):
+                    size += deep_getsizeof(getattr(obj, slot), seen)
+
+    return size
+
+
 def init_arg_parser():
     arg_parser = argparse.ArgumentParser()
 
@@ -29,8 +58,12 @@ def init_arg_parser():
     arg_parser.add_argument('--cuda', action='store_true', default=False, help='Use gpu')
     arg_parser.add_argument('--lang', choices=['python', 'lambda_dcs', 'wikisql', 'prolog', 'python3'], default='python',
                             help='[Deprecated] language to parse. Deprecated, use --transition_system and --parser instead')
-    arg_parser.add_argument('--asdl_file', type=str, help='Path to ASDL grammar specification')
-    arg_parser.add_argument('--mode', choices=['train', 'test'], required=True, help='Run mode')
+    arg_parser.add_argument('--asdl_file', type=str, help='Path to ASDL grammar specification, or a compiled grammar file')
+    arg_parser.add_argument('--mode', choices=['train', 'test', 'quantize', 'compile'], required=True,
+                            help='Run mode, `quantize` exports a model with dynamic int8 quantization for CPU '
+                                 'inference to `--save_to`, and compares it with the float model on `--dev_file`, '
+                                 '`compile` saves the TorchScript encoder and decoder step of `--load_model` next to '
+                                 'it, and compares them with the eager model on `--dev_file`')
 
     #### Modularized configuration ####
     arg_parser.add_argument('--parser', type=str, default='default_parser', required=False, help='name of parser class to load')
@@ -124,18 +157,38 @@ def init_arg_parser():
     arg_parser.add_argument('--verbose', action='store_true', default=False, help='Verbose mode')
     arg_parser.add_argument('--eval_top_pred_only', action='store_true', default=False,
                             help='Only evaluate the top prediction in validation')
+    arg_parser.add_argument('--eval_num_workers', default=1, type=int,
+                            help='Number of worker processes used to check hypotheses in evaluation')
 
     #### decoding/validation/testing ####
     arg_parser.add_argument('--load_model', default=None, type=str, help='Load a pre-trained model')
     arg_parser.add_argument('--beam_size', default=5, type=int, help='Beam size for beam search')
     arg_parser.add_argument('--decode_max_time_step', default=100, type=int, help='Maximum number of time steps used '
                                                                                   'in decoding and sampling')
+    arg_parser.add_argument('--beam_recombination', choices=['none', 'max', 'logsumexp'], default='none',
+                            help='Merge beam search hypotheses that reach the same state, scoring the merged hypothesis '
+                                 'with the max or log-sum-exp of their scores')
     arg_parser.add_argument('--sample_size', default=5, type=int, help='Sample size')
     arg_parser.add_argument('--test_file', type=str, help='Path to the test file')
-    arg_parser.add_argument('--save_decode_to', default=None, type=str, help='Save decoding results to file')
+    arg_parser.add_argument('--save_decode_to', default=None, type=str,
+                            help='Save decoding results to file, appended as JSON lines while decoding')
+    arg_parser.add_argument('--resume', default=False, action='store_true',
+                            help='Keep the results already in --save_decode_to and only decode the remaining examples')
 
     #### dataset specific config ####
     arg_parser.add_argument('--sql_db_file', default=None, type=str, help='path to WikiSQL database file for evaluation (SQLite)')
+    arg_parser.add_argument('--sql_num_threads', default=1, type=int,
+                            help='Number of threads (each with its own SQLite connection) executing WikiSQL queries '
+                                 'in evaluation')
+    arg_parser.add_argument('--sql_timeout', default=0., type=float,
+                            help='Interrupt WikiSQL queries running longer than this many seconds (0 for no timeout)')
+    arg_parser.add_argument('--sql_execution_cache_size', default=100000, type=int,
+                            help='Number of WikiSQL query results kept in memory in evaluation, least recently used '
+                                 'first out (0 for no limit)')
+    arg_parser.add_argument('--sql_db_in_memory', default=False, action='store_true',
+                            help='Load the WikiSQL evaluation database into memory when the evaluator starts')
+    arg_parser.add_argument('--sql_db_mmap_size', default=0, type=int,
+                            help='Bytes of the on-disk WikiSQL evaluation database accessed with memory-mapped I/O')
 
     return arg_parser
 
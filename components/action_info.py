@@ -1,10 +1,15 @@
 # coding=utf-8
 from asdl.hypothesis import Hypothesis
 from asdl.transition_system import ApplyRuleAction, GenTokenAction
+from asdl.utils import get_slots_state, set_slots_state
 
 
 class ActionInfo(object):
     """sufficient statistics for making a prediction of an action at a time step"""
+    __slots__ = ('t', 'parent_t', 'action', 'frontier_prod', 'frontier_field',
+                 'copy_from_src', 'src_token_position',
+                 # only recorded when decoding in debug mode
+                 'action_prob', 'in_vocab', 'gen_copy_switch', 'gen_token_prob', 'copy_token_prob')
 
     def __init__(self, action=None):
         self.t = 0
@@ -17,6 +22,12 @@ class ActionInfo(object):
         self.copy_from_src = False
         self.src_token_position = -1
 
+    def __getstate__(self):
+        return get_slots_state(self)
+
+    def __setstate__(self, state):
+        set_slots_state(self, state)
+
     def __repr__(self, verbose=False):
         repr_str = '%s (t=%d, p_t=%d, frontier_field=%s)' % (repr(self.action),
                                                          self.t,
@@ -62,3 +73,37 @@ def get_action_infos(src_query, tgt_actions, force_copy=False):
         action_infos.append(action_info)
 
     return action_infos
+
+
+def get_action_infos_from_ast(src_query, tgt_ast, transition_system, force_copy=False, oracle=None):
+    """
+    same as `get_action_infos(src_query, transition_system.get_actions(tgt_ast))`, but takes the frontier
+    information from the single-pass oracle of the transition system instead of replaying the actions.
+    `oracle` is the result of `transition_system.get_oracle(tgt_ast)`, if the caller already computed it
+    """
+    tgt_actions, frontiers = oracle or transition_system.get_oracle(tgt_ast)
+
+    # position of the first occurrence of each source token
+    src_token_positions = dict()
+    for token_pos, token in enumerate(src_query):
+        src_token_positions.setdefault(token, token_pos)
+
+    action_infos = []
+    for t, (action, (parent_t, frontier_prod, frontier_field)) in enumerate(zip(tgt_actions, frontiers)):
+        action_info = ActionInfo(action)
+        action_info.t = t
+        action_info.parent_t = parent_t
+        action_info.frontier_prod = frontier_prod
+        action_info.frontier_field = frontier_field
+
+        if isinstance(action, GenTokenAction):
+            tok_src_idx = src_token_positions.get(str(action.token))
+            if tok_src_idx is not None:
+                action_info.copy_from_src = True
+                action_info.src_token_position = tok_src_idx
+            elif force_copy:
+                raise ValueError('cannot copy primitive token %s from source' % action.token)
+
+        action_infos.append(action_info)
+
+    return action_infos
@@ -11,7 +11,7 @@ except:
 from torch.autograd import Variable
 
 from asdl.transition_system import ApplyRuleAction, ReduceAction
-from common.utils import cached_property
+from common.utils import cached_property, deep_getsizeof
 
 from model import nn_utils
 
@@ -226,3 +226,21 @@ class Batch(object):
                 aggregated_primitive_tokens.setdefault(token, []).append(token_pos)
 
 
+if __name__ == '__main__':
+    # report the memory footprint of a pre-processed dataset, e.g.
+    # python -m components.dataset data/django/train.bin
+    import sys
+
+    dataset = Dataset.from_bin_file(sys.argv[1])
+
+    # productions, fields and types are shared with the grammar, only count them once
+    seen = set()
+    grammar_size = 0
+    for e in dataset.examples:
+        for action_info in e.tgt_actions:
+            for obj in (action_info.frontier_prod, action_info.frontier_field):
+                grammar_size += deep_getsizeof(obj, seen)
+
+    total_size = deep_getsizeof(dataset.examples, seen)
+    print('%d examples, %.1f bytes per example (excluding %d bytes of grammar objects)' % (
+        len(dataset), total_size / float(len(dataset)), grammar_size))
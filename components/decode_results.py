@@ -0,0 +1,150 @@
+# coding=utf-8
+"""
+Streaming decode result files. Results are appended as decoding proceeds, one JSON line per example:
+
+    {"idx": example idx, "hyps": [{"code": ..., "score": ..., "actions": [action codes]}, ...]}
+
+where the actions of a hypothesis are encoded by `ActionCodec` against the source sentence of the example
+(or null if they cannot be encoded), and a structured code (e.g. the `Query` of WikiSQL) is stored as its dict.
+A truncated last line, e.g. left by a crash, is ignored and overwritten when decoding is resumed, and a later
+record of an example supersedes an earlier one.
+"""
+
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+import six
+
+from components.decode_hypothesis import DecodeHypothesis
+
+
+def _parse_line(line):
+    """a record of a complete line, or None for a truncated or corrupted one"""
+    if not line.endswith(b'\n'):
+        return None
+
+    try:
+        return json.loads(line.decode('utf-8'))
+    except ValueError:
+        return None
+
+
+def iter_decode_results(file_path):
+    """lazily read the (example idx, list of hypothesis records) of a decode result file"""
+    with open(file_path, 'rb') as f:
+        for line in f:
+            record = _parse_line(line)
+            if record is None:
+                break
+
+            yield record['idx'], record['hyps']
+
+
+def is_restorable(hyp_record):
+    return hyp_record['actions'] is not None or hyp_record['code'] is not None
+
+
+def restore_hypotheses(hyp_records, example, action_codec):
+    """
+    rebuild decoded hypotheses from their records, with their stored `code` and `score`. `tree` is built from the
+    action codes, or parsed from the code of a hypothesis whose actions could not be encoded
+    """
+    transition_system = action_codec.transition_system
+    hyps = []
+    for hyp_record in hyp_records:
+        hyp = DecodeHypothesis()
+        code = hyp_record['code']
+        if hyp_record['actions'] is not None:
+            hyp.action_codes = np.array(hyp_record['actions'], dtype=np.int32)
+            hyp.tree = action_codec.array_to_ast(hyp.action_codes, example.src_sent)
+            hyp.actions = action_codec.decode_actions(hyp.action_codes, example.src_sent)
+            hyp.t = len(hyp.actions)
+        else:
+            hyp.tree = transition_system.surface_code_to_ast(code)
+        hyp.score = hyp_record['score']
+        # a structured code is rebuilt from the tree, which the transition system builds from its dict
+        hyp.code = code if isinstance(code, six.string_types) else transition_system.ast_to_surface_code(hyp.tree)
+        hyps.append(hyp)
+
+    return hyps
+
+
+class DecodeResultWriter(object):
+    """
+    appends the decoding results of each example to `file_path`. With `resume`, results already in the file
+    are kept, and `has_result` / `load_result` give the examples that do not need to be decoded again
+    (`load_result` gives None for a result that cannot be restored)
+    """
+
+    def __init__(self, file_path, action_codec, resume=False):
+        self.file_path = file_path
+        self.action_codec = action_codec
+
+        # example idx -> byte offset of its record in the file, for results that can be restored
+        self.saved_offsets = OrderedDict()
+
+        if resume and os.path.exists(file_path):
+            end_offset = 0
+            with open(file_path, 'rb') as f:
+                for line in iter(f.readline, b''):
+                    record = _parse_line(line)
+                    if record is None:
+                        break
+
+                    if all(is_restorable(hyp_record) for hyp_record in record['hyps']):
+                        self.saved_offsets[record['idx']] = end_offset
+                    else:
+                        self.saved_offsets.pop(record['idx'], None)
+                    end_offset += len(line)
+
+            # drop the truncated record after the last complete one
+            with open(file_path, 'r+b') as f:
+                f.truncate(end_offset)
+
+            self.f = open(file_path, 'ab')
+        else:
+            self.f = open(file_path, 'wb')
+
+    def has_result(self, example):
+        return example.idx in self.saved_offsets
+
+    def load_result(self, example):
+        with open(self.file_path, 'rb') as f:
+            f.seek(self.saved_offsets[example.idx])
+            record = _parse_line(f.readline())
+
+        try:
+            return restore_hypotheses(record['hyps'], example, self.action_codec)
+        except Exception:
+            # e.g. code that the transition system cannot parse back into a tree, the example is decoded again
+            return None
+
+    def encode_hypothesis(self, example, hyp):
+        try:
+            action_codes = self.action_codec.encode_actions(hyp.actions, example.src_sent).tolist()
+        except ValueError:
+            # e.g. tokens that are neither in the primitive vocabulary nor copied from the source
+            action_codes = None
+
+        code = hyp.code
+        if not isinstance(code, six.string_types):
+            code = code.to_dict() if hasattr(code, 'to_dict') else str(code)
+
+        return {'code': code, 'score': float(hyp.score), 'actions': action_codes}
+
+    def write(self, example, hyps):
+        record = {'idx': example.idx, 'hyps': [self.encode_hypothesis(example, hyp) for hyp in hyps]}
+        self.f.write((json.dumps(record) + '\n').encode('utf-8'))
+        # results survive a crash of the decoding process
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
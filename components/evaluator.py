@@ -1,43 +1,101 @@
 from __future__ import print_function
 
 import sys, traceback
+import gc
+import multiprocessing
 import numpy as np
+from asdl.asdl_ast import AbstractSyntaxTree
 from common.registerable import Registrable
 
 
 @Registrable.register('default_evaluator')
 class Evaluator(object):
+    # fields of a hypothesis used by `score_hyp`, only these are sent to worker processes in parallel evaluation
+    hyp_fields = ('tree', 'code')
+
     def __init__(self, transition_system=None, args=None):
         self.transition_system = transition_system
         self.default_metric = 'accuracy'
+        self.num_workers = getattr(args, 'eval_num_workers', 1)
 
-    def is_hyp_correct(self, example, hyp):
-        return self.transition_system.compare_ast(hyp.tree, example.tgt_ast)
+    def get_reference(self, example):
+        """
+        reference-side artifacts of an example used in `is_hyp_correct`. They are computed once and
+        cached on the example, so they are shared by all hypotheses and by repeated evaluations on the dev set
+        """
+        reference_cache = getattr(example, 'reference_cache', None)
+        if reference_cache is None:
+            reference_cache = example.reference_cache = dict()
 
-    def evaluate_dataset(self, examples, decode_results, fast_mode=False):
-        correct_array = []
-        oracle_array = []
-        for example, hyp_list in zip(examples, decode_results):
-            if fast_mode:
-                hyp_list = hyp_list[:1]
+        cache_key = self.__class__.__name__
+        if cache_key not in reference_cache:
+            reference_cache[cache_key] = self.compute_reference(example)
 
-            if hyp_list:
-                for hyp_id, hyp in enumerate(hyp_list):
-                    try:
-                        is_correct = self.is_hyp_correct(example, hyp)
-                    except:
-                        is_correct = False
+        return reference_cache[cache_key]
+
+    def compute_reference(self, example):
+        return self.transition_system.get_reference(example.tgt_ast)
 
-                        print('-' * 60, file=sys.stdout)
-                        print('Error in evaluating Example %s, hyp %d {{ %s }}' % (example.idx, hyp_id, hyp.code),
-                              file=sys.stdout)
+    def is_hyp_correct(self, example, hyp):
+        return self.transition_system.compare_ast_to_reference(hyp.tree, self.get_reference(example))
+
+    def score_hyp(self, example, hyp_id, hyp):
+        """evaluation results of a hypothesis, as a dict of attributes to be set on the hypothesis"""
+        try:
+            is_correct = self.is_hyp_correct(example, hyp)
+        except:
+            is_correct = False
+
+            print('-' * 60, file=sys.stdout)
+            print('Error in evaluating Example %s, hyp %d {{ %s }}' % (example.idx, hyp_id, hyp.code),
+                  file=sys.stdout)
+
+            print('example id: %s, hypothesis id: %d' % (example.idx, hyp_id), file=sys.stdout)
+            traceback.print_exc(file=sys.stdout)
+            print('-' * 60, file=sys.stdout)
+
+        return dict(is_correct=is_correct)
+
+    def init_worker(self):
+        """called when the evaluator is set up in a worker process for parallel evaluation"""
+        pass
+
+    def get_shard_state(self):
+        """
+        state updated in a worker process while scoring a shard (e.g., caches), which is sent back
+        and passed to `merge_shard_state` of the evaluator in the main process
+        """
+        return None
+
+    def merge_shard_state(self, state):
+        pass
+
+    def score_hypotheses(self, examples, decode_results):
+        """
+        call `score_hyp` on all hypotheses and set the results on them. With `num_workers > 1`, examples
+        are sharded across worker processes, which receive `CompactHypothesis` instead of full hypotheses
+        """
+        if self.num_workers > 1 and len(examples) > 1:
+            all_hyp_scores = parallel_score_hypotheses(self, examples, decode_results, self.num_workers)
+        else:
+            all_hyp_scores = [[self.score_hyp(example, hyp_id, hyp) for hyp_id, hyp in enumerate(hyp_list)]
+                              for example, hyp_list in zip(examples, decode_results)]
+
+        for hyp_list, hyp_scores in zip(decode_results, all_hyp_scores):
+            for hyp, scores in zip(hyp_list, hyp_scores):
+                for key, value in scores.items():
+                    setattr(hyp, key, value)
 
-                        print('example id: %s, hypothesis id: %d' % (example.idx, hyp_id), file=sys.stdout)
-                        traceback.print_exc(file=sys.stdout)
-                        print('-' * 60, file=sys.stdout)
+    def evaluate_dataset(self, examples, decode_results, fast_mode=False):
+        if fast_mode:
+            decode_results = [hyp_list[:1] for hyp_list in decode_results]
 
-                    hyp.is_correct = is_correct
+        self.score_hypotheses(examples, decode_results)
 
+        correct_array = []
+        oracle_array = []
+        for hyp_list in decode_results:
+            if hyp_list:
                 correct_array.append(hyp_list[0].is_correct)
                 oracle_array.append(any(hyp.is_correct for hyp in hyp_list))
             else:
@@ -53,6 +111,101 @@ class Evaluator(object):
         return eval_results
 
 
+class CompactHypothesis(object):
+    """
+    stand-in of a hypothesis sent to evaluation workers, which only keeps the fields read by the evaluator.
+    The tree is stored as `AbstractSyntaxTree.to_tuple`, and rebuilt in the worker by `restore`
+    """
+
+    def __init__(self, hyp, fields, grammar=None):
+        for field in fields:
+            if hasattr(hyp, field):
+                value = getattr(hyp, field)
+                if field == 'tree' and value is not None:
+                    value = value.to_tuple(grammar)
+
+                setattr(self, field, value)
+
+    def restore(self, grammar=None):
+        if getattr(self, 'tree', None) is not None:
+            self.tree = AbstractSyntaxTree.from_tuple(grammar, self.tree)
+
+        return self
+
+
+# evaluator and examples of an evaluation worker process, set by `_init_eval_worker`
+_worker_evaluator = None
+_worker_examples = None
+
+
+def _init_eval_worker(evaluator, examples):
+    global _worker_evaluator, _worker_examples
+
+    _worker_evaluator = evaluator
+    _worker_examples = examples
+    _worker_evaluator.init_worker()
+
+    # automatic garbage collections would repeatedly traverse (and copy on write) the objects inherited from
+    # the main process, garbage of each shard is collected in `_score_shard` instead
+    gc.disable()
+
+
+def _score_shard(shard):
+    grammar = _worker_evaluator.transition_system.grammar if 'tree' in _worker_evaluator.hyp_fields else None
+
+    results = []
+    for example_idx, hyp_list in shard:
+        example = _worker_examples[example_idx]
+        hyp_list = [hyp.restore(grammar) for hyp in hyp_list]
+        hyp_scores = [_worker_evaluator.score_hyp(example, hyp_id, hyp) for hyp_id, hyp in enumerate(hyp_list)]
+
+        # send back reference artifacts computed in the worker, so they are cached in the main process
+        results.append((example_idx, hyp_scores, getattr(example, 'reference_cache', None)))
+
+    # only objects allocated since the last collection are in the youngest generation
+    gc.collect(0)
+
+    return results, _worker_evaluator.get_shard_state()
+
+
+def parallel_score_hypotheses(evaluator, examples, decode_results, num_workers, shards_per_worker=4):
+    """
+    `Evaluator.score_hypotheses` over a process pool. Examples and the evaluator are passed to the workers
+    once when the pool starts (inherited without copying under `fork`), and each task is a shard of
+    (example index, compact hypotheses). Scores are returned in the order of `decode_results`
+    """
+    grammar = evaluator.transition_system.grammar if 'tree' in evaluator.hyp_fields else None
+    shard_size = max(1, int(np.ceil(len(examples) / float(num_workers * shards_per_worker))))
+    shards = []
+    for begin in range(0, len(examples), shard_size):
+        shard = []
+        for example_idx in range(begin, min(begin + shard_size, len(examples))):
+            hyp_list = [CompactHypothesis(hyp, evaluator.hyp_fields, grammar) for hyp in decode_results[example_idx]]
+            shard.append((example_idx, hyp_list))
+        shards.append(shard)
+
+    all_hyp_scores = [None] * len(examples)
+    pool = multiprocessing.Pool(num_workers, initializer=_init_eval_worker, initargs=(evaluator, examples))
+    try:
+        for shard_results, shard_state in pool.imap(_score_shard, shards):
+            if shard_state is not None:
+                evaluator.merge_shard_state(shard_state)
+
+            for example_idx, hyp_scores, reference_cache in shard_results:
+                all_hyp_scores[example_idx] = hyp_scores
+
+                if reference_cache:
+                    example = examples[example_idx]
+                    if getattr(example, 'reference_cache', None) is None:
+                        example.reference_cache = dict()
+                    example.reference_cache.update(reference_cache)
+    finally:
+        pool.close()
+        pool.join()
+
+    return all_hyp_scores
+
+
 @Registrable.register('cached_evaluator')
 class CachedExactMatchEvaluator(Evaluator):
     def is_hyp_correct(self, example, hyp):
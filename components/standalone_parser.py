@@ -1,6 +1,8 @@
 from __future__ import print_function
 import argparse
+import os
 import sys
+import time
 import six
 import torch
 from model import parser
@@ -22,30 +24,142 @@ class StandaloneParser(object):
     purposes
     """
 
-    def __init__(self, parser_name, model_path, example_processor_name, beam_size=5, cuda=False):
+    def __init__(self, parser_name, model_path, example_processor_name, beam_size=5, cuda=False, verbose=False,
+                 torchscript=True, grammar=None, recombination='none'):
         print('load parser from [%s]' % model_path, file=sys.stderr)
 
-        self.parser = parser = Registrable.by_name(parser_name).load(model_path, cuda=cuda).eval()
+        # `grammar` is the grammar the model must have been trained with, see `Parser.load`
+        self.parser = parser = Registrable.by_name(parser_name).load(model_path, cuda=cuda, grammar=grammar).eval()
+        if torchscript:
+            self.load_torchscript(model_path)
         self.example_processor = Registrable.by_name(example_processor_name)(parser.transition_system)
         self.beam_size = beam_size
+        # recombination of completed hypotheses with the same AST, see `Parser.parse`
+        self.recombination = recombination
+        # print the processed utterance and the hypotheses of each parse
+        self.verbose = verbose
 
-    def parse(self, utterance, debug=False):
-        utterance = utterance.strip()
-        processed_utterance_tokens, utterance_meta = self.example_processor.pre_process_utterance(utterance)
-        print(processed_utterance_tokens)
-        hypotheses = self.parser.parse(processed_utterance_tokens, beam_size=self.beam_size, debug=debug)
+    def load_torchscript(self, model_path):
+        """
+        decode with the TorchScript module compiled from the checkpoint (`exp.py --mode compile`) if there is one next
+        to it, and if its outputs match the ones of the eager parser
+        """
+        from model.torchscript import get_compiled_model_path, load_compiled_parser
 
-        valid_hypotheses = list(filter(lambda hyp: self.parser.transition_system.is_valid_hypothesis(hyp), hypotheses))
+        compiled_model_path = get_compiled_model_path(model_path)
+        if not os.path.exists(compiled_model_path):
+            return
 
-        for hyp in valid_hypotheses:
-            self.example_processor.post_process_hypothesis(hyp, utterance_meta)
+        try:
+            load_compiled_parser(self.parser, compiled_model_path)
+            print('load compiled parser from [%s]' % compiled_model_path, file=sys.stderr)
+        except (RuntimeError, ValueError) as e:
+            print('decode with the eager parser, as [%s] cannot be used: %s' % (compiled_model_path, e),
+                  file=sys.stderr)
 
-        for hyp_id, hyp in enumerate(valid_hypotheses):
-            print('------------------ Hypothesis %d ------------------' % hyp_id)
-            print(hyp.code)
-            print(hyp.tree.to_string())
-            print('Actions:')
-            for action_t in hyp.action_infos:
-                print(action_t.action)
+    def parse(self, utterance, debug=False, beam_size=None, stats=None, deadline=None, timed_out=None):
+        return self.parse_batch([utterance], debug=debug, beam_size=beam_size, stats=stats,
+                                deadlines=[deadline] if deadline else None, timed_out=timed_out)[0]
 
-        return valid_hypotheses
+    def parse_batch(self, utterances, debug=False, beam_size=None, stats=None, deadlines=None, timed_out=None,
+                    errors=None):
+        """
+        parse a batch of utterances, which are encoded and searched together, see `Parser.parse_batch`. The latencies
+        of the `pre_process_utterance`, `is_valid_hypothesis` and `post_process_hypothesis` stages of each utterance are
+        appended to the optional dict `stats`, along with the decoding statistics of `Parser.parse`.
+        The beam search of an utterance stops at its optional deadline, and whether it did is appended to the
+        optional list `timed_out`, see `Parser.parse_batch`. If the optional list `errors` is given, it is extended
+        with the exception raised when parsing each utterance (or `None`), and an utterance that fails gets no
+        hypotheses instead of failing the batch
+        """
+        beam_size = beam_size or self.beam_size
+        if stats is None:
+            stats = dict()
+
+        utterance_errors = [None] * len(utterances)
+
+        def run(utterance_id, func):
+            try:
+                return func()
+            except Exception as e:
+                if errors is None:
+                    raise
+                utterance_errors[utterance_id] = e
+
+        processed_utterances = [None] * len(utterances)
+        utterance_metas = [None] * len(utterances)
+        for utterance_id, utterance in enumerate(utterances):
+            begin = time.time()
+            processed = run(utterance_id, lambda: self.example_processor.pre_process_utterance(utterance.strip()))
+            stats.setdefault('pre_process_utterance', []).append(time.time() - begin)
+            if processed is None:
+                continue
+            if self.verbose:
+                print(processed[0])
+
+            processed_utterances[utterance_id], utterance_metas[utterance_id] = processed
+
+        hypotheses_batch = [[] for _ in utterances]
+        search_timed_out = [False] * len(utterances)
+        decode_ids = [utterance_id for utterance_id, error in enumerate(utterance_errors) if error is None]
+        get_deadlines = lambda ids: [deadlines[utterance_id] for utterance_id in ids] if deadlines else None
+        if decode_ids:
+            try:
+                batch_timed_out = []
+                decoded_batch = self.parser.parse_batch([processed_utterances[i] for i in decode_ids],
+                                                        beam_size=beam_size, debug=debug, stats=stats,
+                                                        deadlines=get_deadlines(decode_ids),
+                                                        timed_out=batch_timed_out,
+                                                        recombination=self.recombination)
+                for utterance_id, hypotheses, utterance_timed_out in zip(decode_ids, decoded_batch, batch_timed_out):
+                    hypotheses_batch[utterance_id] = hypotheses
+                    search_timed_out[utterance_id] = utterance_timed_out
+            except Exception:
+                if errors is None:
+                    raise
+
+                # the utterance that failed the batch is not known, the utterances are decoded one by one
+                for utterance_id in decode_ids:
+                    utterance_timed_out = []
+                    hypotheses = run(utterance_id, lambda: self.parser.parse_batch(
+                        [processed_utterances[utterance_id]], beam_size=beam_size, debug=debug, stats=stats,
+                        deadlines=get_deadlines([utterance_id]), timed_out=utterance_timed_out,
+                        recombination=self.recombination)[0])
+                    if hypotheses is not None:
+                        hypotheses_batch[utterance_id] = hypotheses
+                        search_timed_out[utterance_id] = utterance_timed_out[0]
+
+        valid_hypotheses_batch = []
+        for utterance_id, (hypotheses, utterance_meta) in enumerate(zip(hypotheses_batch, utterance_metas)):
+            if utterance_errors[utterance_id] is not None:
+                valid_hypotheses_batch.append([])
+                continue
+
+            begin = time.time()
+            valid_hypotheses = run(utterance_id, lambda: list(filter(
+                lambda hyp: self.parser.transition_system.is_valid_hypothesis(hyp), hypotheses))) or []
+            stats.setdefault('is_valid_hypothesis', []).append(time.time() - begin)
+
+            begin = time.time()
+            if run(utterance_id, lambda: [self.example_processor.post_process_hypothesis(hyp, utterance_meta)
+                                          for hyp in valid_hypotheses]) is None:
+                valid_hypotheses = []
+            stats.setdefault('post_process_hypothesis', []).append(time.time() - begin)
+
+            if self.verbose:
+                for hyp_id, hyp in enumerate(valid_hypotheses):
+                    print('------------------ Hypothesis %d ------------------' % hyp_id)
+                    print(hyp.code)
+                    print(hyp.tree.to_string())
+                    print('Actions:')
+                    for action_t in hyp.action_infos:
+                        print(action_t.action)
+
+            valid_hypotheses_batch.append(valid_hypotheses)
+
+        if timed_out is not None:
+            timed_out.extend(search_timed_out)
+        if errors is not None:
+            errors.extend(utterance_errors)
+
+        return valid_hypotheses_batch
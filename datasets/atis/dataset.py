@@ -7,7 +7,7 @@ try: import cPickle as pickle
 except: import pickle
 
 from asdl.hypothesis import Hypothesis
-from components.action_info import get_action_infos
+from components.action_info import get_action_infos_from_ast
 from asdl.transition_system import *
 from components.dataset import Example
 from components.vocab import VocabEntry, Vocab
@@ -36,7 +36,8 @@ def load_dataset(transition_system, dataset_file, reorder_predicates=True):
         reconstructed_lf = ast_to_logical_form(tgt_ast)
         assert lf == reconstructed_lf
 
-        tgt_actions = transition_system.get_actions(tgt_ast)
+        oracle = transition_system.get_oracle(tgt_ast)
+        tgt_actions = oracle[0]
 
         print(idx)
         print('Utterance: %s' % src_query)
@@ -56,7 +57,7 @@ def load_dataset(transition_system, dataset_file, reorder_predicates=True):
         src_from_hyp = transition_system.ast_to_surface_code(hyp.tree)
         assert src_from_hyp == gold_source
 
-        tgt_action_infos = get_action_infos(src_query_tokens, tgt_actions)
+        tgt_action_infos = get_action_infos_from_ast(src_query_tokens, tgt_ast, transition_system, oracle=oracle)
 
         # print(' '.join(src_query_tokens))
         print('***')
@@ -30,6 +30,7 @@ class ATISExampleProcessor(ExampleProcessor):
                         slot_name = field.value
                         if slot_name in slot2entity_map:
                             field.value = slot2entity_map[slot_name]
+                            root.reset_digest()
                     else:
                         for val in field.as_value_list:
                             _travel(val)
@@ -0,0 +1,184 @@
+# coding=utf-8
+"""
+BLEU of many hypotheses against a fixed list of tokenized references, one reference per example.
+
+N-grams of the references are counted once into sorted arrays of integer n-gram ids. An n-gram of order n
+has the id `dense(its (n-1)-gram prefix) * (vocab_size + 1) + id of its last token`, where `dense` maps the
+ids of the (n-1)-grams in the references to [0, number of distinct (n-1)-grams), so ids are exact and fit
+in int64. Hypotheses are scored in batches with numpy: an n-gram of a hypothesis can only match if all its
+prefixes occur in the references, and clipped counts are looked up with `np.searchsorted`.
+
+`get_ngram_stats` gives the per-hypothesis n-gram matches and lengths, from which both `sentence_bleu`
+(same as nltk's `sentence_bleu` with `SmoothingFunction().method3`) and `corpus_bleu` of any selection of
+hypotheses (same as `bleu_score.compute_bleu`) are computed.
+"""
+
+import math
+
+import numpy as np
+
+
+class BleuReferences(object):
+    def __init__(self, references, max_order=4):
+        self.max_order = max_order
+        self.num_references = len(references)
+
+        # token id 0 is reserved for tokens not in any reference
+        self.token2id = dict()
+        for reference in references:
+            for token in reference:
+                if token not in self.token2id:
+                    self.token2id[token] = len(self.token2id) + 1
+        self.vocab_size = len(self.token2id)
+
+        self.ref_lens = np.array([len(reference) for reference in references], dtype=np.int64)
+
+        token_ids, seq_ids, positions = self._flatten(references, self.ref_lens, self.token2id)
+
+        # per order: sorted distinct n-gram ids of the references, and sorted (reference index, dense n-gram id)
+        # pairs with their counts
+        self.ngram_ids = []
+        self.ref_ngram_keys = []
+        self.ref_ngram_counts = []
+
+        prefix_dense_ids = None
+        for order in range(1, max_order + 1):
+            valid, ngram_ids = self._get_ngram_ids(token_ids, seq_ids, positions, self.ref_lens, order,
+                                                   prefix_dense_ids)
+            distinct_ngram_ids, dense_ids = np.unique(ngram_ids[valid], return_inverse=True)
+
+            keys, counts = np.unique(seq_ids[valid] * len(distinct_ngram_ids) + dense_ids, return_counts=True)
+
+            self.ngram_ids.append(distinct_ngram_ids)
+            self.ref_ngram_keys.append(keys)
+            self.ref_ngram_counts.append(counts)
+
+            prefix_dense_ids = np.full(len(token_ids), -1, dtype=np.int64)
+            prefix_dense_ids[valid] = dense_ids
+
+    @staticmethod
+    def _flatten(sequences, seq_lens, token2id):
+        token_ids = np.array([token2id.get(token, 0) for sequence in sequences for token in sequence], dtype=np.int64)
+        seq_ids = np.repeat(np.arange(len(sequences), dtype=np.int64), seq_lens)
+        seq_starts = np.cumsum(seq_lens) - seq_lens
+        positions = np.arange(len(token_ids), dtype=np.int64) - np.repeat(seq_starts, seq_lens)
+
+        return token_ids, seq_ids, positions
+
+    def _get_ngram_ids(self, token_ids, seq_ids, positions, seq_lens, order, prefix_dense_ids):
+        """ids of the n-grams starting at each token, and whether they are within their sequences"""
+        valid = positions + order <= seq_lens[seq_ids]
+        if order == 1:
+            return valid, token_ids
+
+        last_token_ids = np.zeros(len(token_ids), dtype=np.int64)
+        last_token_ids[:len(token_ids) - order + 1] = token_ids[order - 1:]
+
+        # n-grams whose prefix does not occur in the references get negative ids
+        return valid, prefix_dense_ids * (self.vocab_size + 1) + last_token_ids
+
+    def get_ngram_stats(self, ref_indices, hypotheses):
+        """
+        n-gram statistics of tokenized hypotheses, where `ref_indices[i]` is the index of the reference of
+        `hypotheses[i]`. Returns clipped matches and the number of n-grams of each order, both arrays of shape
+        (number of hypotheses, max_order), and the lengths of the hypotheses and of their references
+        """
+        ref_indices = np.asarray(ref_indices, dtype=np.int64)
+        hyp_lens = np.array([len(hyp) for hyp in hypotheses], dtype=np.int64)
+        token_ids, seq_ids, positions = self._flatten(hypotheses, hyp_lens, self.token2id)
+
+        matches = np.zeros((len(hypotheses), self.max_order), dtype=np.int64)
+        totals = np.zeros((len(hypotheses), self.max_order), dtype=np.int64)
+
+        prefix_dense_ids = None
+        for order in range(1, self.max_order + 1):
+            totals[:, order - 1] = np.maximum(hyp_lens - order + 1, 0)
+
+            valid, ngram_ids = self._get_ngram_ids(token_ids, seq_ids, positions, hyp_lens, order, prefix_dense_ids)
+
+            # dense ids of the n-grams occurring in the references
+            distinct_ngram_ids = self.ngram_ids[order - 1]
+            dense_ids = np.searchsorted(distinct_ngram_ids, ngram_ids)
+            found = valid & (dense_ids < len(distinct_ngram_ids))
+            found[found] = distinct_ngram_ids[dense_ids[found]] == ngram_ids[found]
+
+            # counts of each distinct n-gram in each hypothesis, clipped by its count in the reference
+            hyp_keys, hyp_counts = np.unique(seq_ids[found] * len(distinct_ngram_ids) + dense_ids[found],
+                                             return_counts=True)
+            hyp_ids = hyp_keys // max(len(distinct_ngram_ids), 1)
+            ref_keys = ref_indices[hyp_ids] * len(distinct_ngram_ids) + hyp_keys % max(len(distinct_ngram_ids), 1)
+
+            keys = self.ref_ngram_keys[order - 1]
+            key_positions = np.minimum(np.searchsorted(keys, ref_keys), max(len(keys) - 1, 0))
+            ref_counts = np.where(keys[key_positions] == ref_keys, self.ref_ngram_counts[order - 1][key_positions], 0) \
+                if len(keys) else np.zeros(len(ref_keys), dtype=np.int64)
+
+            matches[:, order - 1] = np.bincount(hyp_ids, weights=np.minimum(hyp_counts, ref_counts),
+                                                minlength=len(hypotheses))
+
+            prefix_dense_ids = np.full(len(token_ids), -1, dtype=np.int64)
+            prefix_dense_ids[found] = dense_ids[found]
+
+        return matches, totals, hyp_lens, self.ref_lens[ref_indices]
+
+    def sentence_bleu(self, ngram_stats):
+        """sentence BLEU of each hypothesis, same as nltk's `sentence_bleu` with `SmoothingFunction().method3`"""
+        matches, totals, hyp_lens, ref_lens = ngram_stats
+        if len(hyp_lens) == 0:
+            return np.zeros(0)
+
+        matches = matches.astype(np.float64)
+        denominators = np.maximum(totals, 1).astype(np.float64)
+
+        # NIST geometric smoothing: the k-th precision with no match is 1 / (2^k * denominator)
+        no_match = matches == 0
+        smoothing_exponents = np.cumsum(no_match, axis=1)
+        precisions = np.where(no_match, 1. / (2. ** smoothing_exponents * denominators), matches / denominators)
+
+        brevity_penalty = np.where(hyp_lens > ref_lens, 1.,
+                                   np.where(hyp_lens == 0, 0., np.exp(1. - ref_lens / np.maximum(hyp_lens, 1.))))
+
+        scores = brevity_penalty * np.exp(np.sum(np.log(precisions) / self.max_order, axis=1))
+
+        return np.where(matches[:, 0] == 0, 0., scores)
+
+    def corpus_bleu(self, ngram_stats, selection):
+        """
+        corpus BLEU of the hypotheses at `selection`, one per reference and -1 for an empty translation.
+        Same as `compute_bleu` over all the references (without smoothing), with the same return values
+        """
+        matches, totals, hyp_lens, ref_lens = ngram_stats
+        selection = np.asarray(selection, dtype=np.int64)
+        selected = selection[selection >= 0]
+
+        matches_by_order = matches[selected].sum(axis=0)
+        possible_matches_by_order = totals[selected].sum(axis=0)
+        reference_length = int(self.ref_lens.sum())
+        translation_length = int(hyp_lens[selected].sum())
+
+        precisions = [0] * self.max_order
+        for i in range(0, self.max_order):
+            if possible_matches_by_order[i] > 0:
+                precisions[i] = float(matches_by_order[i]) / possible_matches_by_order[i]
+            else:
+                precisions[i] = 0.0
+
+        if min(precisions) > 0:
+            p_log_sum = sum((1. / self.max_order) * math.log(p) for p in precisions)
+            geo_mean = math.exp(p_log_sum)
+        else:
+            geo_mean = 0
+
+        ratio = float(translation_length) / reference_length
+
+        if ratio > 1.0:
+            bp = 1.
+        else:
+            if ratio == 0.:
+                bp = 0.
+            else:
+                bp = math.exp(1 - 1. / ratio)
+
+        bleu = geo_mean * bp
+
+        return bleu, precisions, bp, ratio, translation_length, reference_length
@@ -3,7 +3,7 @@ import sys
 import numpy as np
 import pickle
 
-from components.action_info import get_action_infos
+from components.action_info import get_action_infos_from_ast
 from datasets.conala.util import *
 from asdl.lang.py3.py3_transition_system import python_ast_to_asdl_ast, asdl_ast_to_python_ast, Python3TransitionSystem
 
@@ -94,7 +94,8 @@ def preprocess_dataset(file_path, transition_system, name='train'):
         python_ast = ast.parse(example_dict['canonical_snippet'])
         canonical_code = astor.to_source(python_ast).strip()
         tgt_ast = python_ast_to_asdl_ast(python_ast, transition_system.grammar)
-        tgt_actions = transition_system.get_actions(tgt_ast)
+        oracle = transition_system.get_oracle(tgt_ast)
+        tgt_actions = oracle[0]
 
         # sanity check
         hyp = Hypothesis()
@@ -121,7 +122,8 @@ def preprocess_dataset(file_path, transition_system, name='train'):
         assert transition_system.compare_ast(transition_system.surface_code_to_ast(decanonicalized_code_from_hyp),
                                              transition_system.surface_code_to_ast(example_json['snippet']))
 
-        tgt_action_infos = get_action_infos(example_dict['intent_tokens'], tgt_actions)
+        tgt_action_infos = get_action_infos_from_ast(example_dict['intent_tokens'], tgt_ast, transition_system,
+                                                     oracle=oracle)
 
         example = Example(idx=f'{i}-{example_json["question_id"]}',
                           src_sent=example_dict['intent_tokens'],
@@ -3,26 +3,30 @@ from common.registerable import Registrable
 from components.dataset import Dataset
 from .util import decanonicalize_code
 from .conala_eval import tokenize_for_bleu_eval
-from .bleu_score import compute_bleu
+from .bleu_engine import BleuReferences
 from nltk.translate.bleu_score import sentence_bleu, SmoothingFunction
 import numpy as np
 import ast
-import astor
+from asdl.lang.py3 import py3_codegen
 
 
 @Registrable.register('conala_evaluator')
 class ConalaEvaluator(Evaluator):
+    hyp_fields = ('code',)
+
     def __init__(self, transition_system=None, args=None):
-        super(ConalaEvaluator, self).__init__()
-        self.transition_system = transition_system
+        super(ConalaEvaluator, self).__init__(transition_system=transition_system, args=args)
         self.default_metric = 'corpus_bleu'
 
-    def is_hyp_correct(self, example, hyp):
+    def compute_reference(self, example):
         ref_code = example.tgt_code
         ref_py_ast = ast.parse(ref_code)
-        ref_reformatted_code = astor.to_source(ref_py_ast).strip()
+        ref_reformatted_code = py3_codegen.to_source(ref_py_ast).strip()
+
+        return self.transition_system.tokenize_code(ref_reformatted_code)
 
-        ref_code_tokens = self.transition_system.tokenize_code(ref_reformatted_code)
+    def is_hyp_correct(self, example, hyp):
+        ref_code_tokens = self.get_reference(example)
         hyp_code_tokens = self.transition_system.tokenize_code(hyp.code)
 
         return ref_code_tokens == hyp_code_tokens
@@ -32,6 +36,16 @@ class ConalaEvaluator(Evaluator):
                              tokenize_for_bleu_eval(hyp.decanonical_code),
                              smoothing_function=SmoothingFunction().method3)
 
+    def get_bleu_references(self, examples):
+        """n-gram counts of the reference snippets, computed once per list of examples"""
+        cached = getattr(self, '_bleu_references', None)
+        if cached is None or len(cached[0]) != len(examples) or \
+                any(cached_example is not example for cached_example, example in zip(cached[0], examples)):
+            cached = (list(examples), BleuReferences([e.reference_code_tokens for e in examples]))
+            self._bleu_references = cached
+
+        return cached[1]
+
     def evaluate_dataset(self, dataset, decode_results, fast_mode=False):
         examples = dataset.examples if isinstance(dataset, Dataset) else dataset
         assert len(examples) == len(decode_results)
@@ -58,62 +72,71 @@ class ConalaEvaluator(Evaluator):
 
                 decode_results[i] = filtered_hyp_list
 
+        bleu_references = self.get_bleu_references(examples)
+
         if fast_mode:
-            references = [e.reference_code_tokens for e in examples]
-            hypotheses = [hyp_list[0].decanonical_code_tokens if hyp_list else [] for hyp_list in decode_results]
+            top_hyp_lists = [hyp_list[:1] for hyp_list in decode_results]
+        else:
+            top_hyp_lists = decode_results
+
+        # n-gram statistics of all the hypotheses in one batch, from which sentence and corpus BLEU are computed
+        hyp_offsets = np.cumsum([0] + [len(hyp_list) for hyp_list in top_hyp_lists])
+        ngram_stats = bleu_references.get_ngram_stats(
+            [example_idx for example_idx, hyp_list in enumerate(top_hyp_lists) for hyp in hyp_list],
+            [hyp.decanonical_code_tokens for hyp_list in top_hyp_lists for hyp in hyp_list])
 
-            bleu_tup = compute_bleu([[x] for x in references], hypotheses, smooth=False)
+        # index of the top hypothesis of each example, -1 if there is none
+        top_hyp_ids = [hyp_offsets[i] if hyp_list else -1 for i, hyp_list in enumerate(top_hyp_lists)]
+
+        if fast_mode:
+            bleu_tup = bleu_references.corpus_bleu(ngram_stats, top_hyp_ids)
             bleu = bleu_tup[0]
 
             return bleu
         else:
-            tokenized_ref_snippets = []
-            hyp_code_tokens = []
-            best_hyp_code_tokens = []
-            sm_func = SmoothingFunction().method3
             sent_bleu_scores = []
             oracle_bleu_scores = []
             oracle_exact_match = []
-            for example, hyp_list in zip(examples, decode_results):
-                tokenized_ref_snippets.append(example.reference_code_tokens)
-                example_hyp_bleu_scores = []
-                if hyp_list:
-                    for i, hyp in enumerate(hyp_list):
-                        hyp.bleu_score = sentence_bleu([example.reference_code_tokens],
-                                                       hyp.decanonical_code_tokens,
-                                                       smoothing_function=sm_func)
-                        hyp.is_correct = self.is_hyp_correct(example, hyp)
+            best_hyp_ids = []
+            exact = 0
+
+            self.score_hypotheses(examples, decode_results)
 
-                        example_hyp_bleu_scores.append(hyp.bleu_score)
+            hyp_bleu_scores = bleu_references.sentence_bleu(ngram_stats)
 
-                    top_decanonical_code_tokens = hyp_list[0].decanonical_code_tokens
+            for example_idx, (example, hyp_list) in enumerate(zip(examples, decode_results)):
+                example_hyp_bleu_scores = hyp_bleu_scores[hyp_offsets[example_idx]:hyp_offsets[example_idx + 1]]
+                for hyp, bleu_score in zip(hyp_list, example_hyp_bleu_scores):
+                    hyp.bleu_score = float(bleu_score)
+
+                if hyp_list:
                     sent_bleu_score = hyp_list[0].bleu_score
 
                     best_hyp_idx = np.argmax(example_hyp_bleu_scores)
-                    oracle_sent_bleu = example_hyp_bleu_scores[best_hyp_idx]
-                    _best_hyp_code_tokens = hyp_list[best_hyp_idx].decanonical_code_tokens
+                    oracle_sent_bleu = hyp_list[best_hyp_idx].bleu_score
+                    best_hyp_ids.append(hyp_offsets[example_idx] + best_hyp_idx)
+
+                    exact += hyp_list[0].decanonical_code_tokens == example.reference_code_tokens
                 else:
-                    top_decanonical_code_tokens = []
                     sent_bleu_score = 0.
                     oracle_sent_bleu = 0.
-                    _best_hyp_code_tokens = []
+                    best_hyp_ids.append(-1)
+
+                    exact += not example.reference_code_tokens
 
                 oracle_exact_match.append(any(hyp.is_correct for hyp in hyp_list))
-                hyp_code_tokens.append(top_decanonical_code_tokens)
                 sent_bleu_scores.append(sent_bleu_score)
                 oracle_bleu_scores.append(oracle_sent_bleu)
-                best_hyp_code_tokens.append(_best_hyp_code_tokens)
 
-            bleu_tup = compute_bleu([[x] for x in tokenized_ref_snippets], hyp_code_tokens, smooth=False)
+            bleu_tup = bleu_references.corpus_bleu(ngram_stats, top_hyp_ids)
             corpus_bleu = bleu_tup[0]
 
-            bleu_tup = compute_bleu([[x] for x in tokenized_ref_snippets], best_hyp_code_tokens, smooth=False)
+            bleu_tup = bleu_references.corpus_bleu(ngram_stats, best_hyp_ids)
             oracle_corpus_bleu = bleu_tup[0]
 
             avg_sent_bleu = np.average(sent_bleu_scores)
             oracle_avg_sent_bleu = np.average(oracle_bleu_scores)
-            exact = sum([1 if h == r else 0 for h, r in zip(hyp_code_tokens, tokenized_ref_snippets)]) / float(
-                len(examples))
+            exact = exact / float(len(examples))
             oracle_exact_match = np.average(oracle_exact_match)
 
             return {'corpus_bleu': corpus_bleu,
@@ -1,4 +1,4 @@
-import astor
+from asdl.lang.py3 import py3_codegen
 
 from common.registerable import Registrable
 from datasets.utils import ExampleProcessor
@@ -19,5 +19,5 @@ class ConalaExampleProcessor(ExampleProcessor):
     def post_process_hypothesis(self, hyp, meta_info, utterance=None):
         """traverse the AST and replace slot ids with original strings"""
         hyp_ast = asdl_ast_to_python_ast(hyp.tree, self.transition_system.grammar)
-        code_from_hyp = astor.to_source(hyp_ast).strip()
+        code_from_hyp = py3_codegen.to_source(hyp_ast).strip()
         hyp.code = decanonicalize_code(code_from_hyp, meta_info)
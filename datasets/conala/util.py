@@ -5,7 +5,7 @@ from __future__ import print_function
 import itertools
 import re
 import ast
-import astor
+from asdl.lang.py3 import py3_codegen
 import nltk
 
 
@@ -117,7 +117,7 @@ def canonicalize_code(code, slot_map):
 
     py_ast = ast.parse(code)
     replace_identifiers_in_ast(py_ast, string2slot)
-    canonical_code = astor.to_source(py_ast).strip()
+    canonical_code = py3_codegen.to_source(py_ast).strip()
 
     # the following code handles the special case that
     # a list/dict/set mentioned in the intent, like
@@ -149,7 +149,7 @@ def decanonicalize_code(code, slot_map):
     slot2string = {x[0]: x[1]['value'] for x in list(slot_map.items())}
     py_ast = ast.parse(code)
     replace_identifiers_in_ast(py_ast, slot2string)
-    raw_code = astor.to_source(py_ast).strip()
+    raw_code = py3_codegen.to_source(py_ast).strip()
     # for slot_name, slot_info in slot_map.items():
     #     raw_code = raw_code.replace(slot_name, slot_info['value'])
 
@@ -17,7 +17,7 @@ from asdl.lang.py.py_transition_system import PythonTransitionSystem
 from asdl.hypothesis import *
 from asdl.lang.py.py_utils import tokenize_code
 
-from components.action_info import ActionInfo, get_action_infos
+from components.action_info import ActionInfo, get_action_infos_from_ast
 
 p_elif = re.compile(r'^elif\s?')
 p_else = re.compile(r'^else\s?')
@@ -204,7 +204,8 @@ class Django(object):
             python_ast = ast.parse(tgt_canonical_code).body[0]
             gold_source = astor.to_source(python_ast).strip()
             tgt_ast = python_ast_to_asdl_ast(python_ast, grammar)
-            tgt_actions = transition_system.get_actions(tgt_ast)
+            oracle = transition_system.get_oracle(tgt_ast)
+            tgt_actions = oracle[0]
 
             # print('+' * 60)
             # print('Example: %d' % idx)
@@ -243,6 +244,7 @@ class Django(object):
                                     'tgt_canonical_code': gold_source,
                                     'tgt_ast': tgt_ast,
                                     'tgt_actions': tgt_actions,
+                                    'tgt_oracle': oracle,
                                     'raw_code': tgt_code, 'str_map': str_map})
 
             # print('first pass, processed %d' % idx, file=sys.stderr)
@@ -256,7 +258,8 @@ class Django(object):
         for idx, e in enumerate(loaded_examples):
             src_query_tokens = e['src_query_tokens'][:max_query_len]
             tgt_actions = e['tgt_actions']
-            tgt_action_infos = get_action_infos(src_query_tokens, tgt_actions)
+            tgt_action_infos = get_action_infos_from_ast(src_query_tokens, e['tgt_ast'], transition_system,
+                                                         oracle=e['tgt_oracle'])
 
             example = Example(idx=idx,
                               src_sent=src_query_tokens,
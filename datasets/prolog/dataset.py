@@ -5,7 +5,7 @@ import sys
 from asdl.hypothesis import Hypothesis, ApplyRuleAction
 from asdl.lang.prolog.prolog_transition_system import *
 from asdl.asdl import ASDLGrammar
-from components.action_info import get_action_infos
+from components.action_info import get_action_infos_from_ast
 from components.dataset import Example
 from components.vocab import VocabEntry, Vocab
 
@@ -26,7 +26,8 @@ def load_dataset(transition_system, dataset_file):
         reconstructed_prolog_expr = ast_to_prolog_expr(tgt_ast)
         assert tgt_code == reconstructed_prolog_expr
 
-        tgt_actions = transition_system.get_actions(tgt_ast)
+        oracle = transition_system.get_oracle(tgt_ast)
+        tgt_actions = oracle[0]
 
         # sanity check
         hyp = Hypothesis()
@@ -43,7 +44,7 @@ def load_dataset(transition_system, dataset_file):
         expr_from_hyp = transition_system.ast_to_surface_code(hyp.tree)
         assert expr_from_hyp == tgt_code
 
-        tgt_action_infos = get_action_infos(src_query_tokens, tgt_actions)
+        tgt_action_infos = get_action_infos_from_ast(src_query_tokens, tgt_ast, transition_system, oracle=oracle)
 
         print(idx)
         example = Example(idx=idx,
@@ -1,37 +1,165 @@
 import sys
+import time
 import traceback
+from collections import OrderedDict
 
 from components.evaluator import Evaluator
 from common.registerable import Registrable
 from datasets.wikisql.lib.query import Query
-from datasets.wikisql.lib.dbengine import DBEngine
+from datasets.wikisql.lib.dbengine import DBEngine, DBExecutionPool, QueryTimeout
 from datasets.wikisql.utils import detokenize_query
 from asdl.lang.sql.sql_transition_system import asdl_ast_to_sql_query
 
 
+class ExecutionError(object):
+    """the error of a failed query, cached in place of its result, from which a new exception is raised on each hit"""
+
+    __slots__ = ('error_type', 'args')
+
+    def __init__(self, error_type, args):
+        self.error_type = error_type
+        self.args = args
+
+    def to_exception(self):
+        return self.error_type(*self.args)
+
+
 @Registrable.register('wikisql_evaluator')
 class WikiSQLEvaluator(Evaluator):
     def __init__(self, transition_system, args):
-        super(WikiSQLEvaluator, self).__init__(transition_system=transition_system)
+        super(WikiSQLEvaluator, self).__init__(transition_system=transition_system, args=args)
 
         print(f'load evaluation database {args.sql_db_file}', file=sys.stderr)
-        self.execution_engine = DBEngine(args.sql_db_file)
+        self.execution_engine = DBEngine(args.sql_db_file, timeout=args.sql_timeout or None,
+                                         in_memory=args.sql_db_in_memory, mmap_size=args.sql_db_mmap_size)
+        if args.sql_db_in_memory:
+            begin = time.time()
+            self.execution_engine.load_into_memory()
+            print('loaded evaluation database into memory in %.2fs' % (time.time() - begin), file=sys.stderr)
         self.answer_prune = args.answer_prune
 
+        self.execution_pool = None
+        if args.sql_num_threads > 1:
+            self.execution_pool = DBExecutionPool(self.execution_engine, num_threads=args.sql_num_threads)
+
+        # execution results (or errors) of detokenized queries, shared by answer pruning, correctness checks
+        # and repeated evaluations, so that each distinct query is executed once. Queries that time out are not
+        # cached, and the least recently used results are evicted beyond `--sql_execution_cache_size`
+        self.execution_cache = OrderedDict()
+        self.execution_cache_size = args.sql_execution_cache_size
+        self.execution_cache_hits = 0
+        self.execution_cache_misses = 0
+        self._shard_keys = None
+
+    @staticmethod
+    def get_execution_key(table_id, query):
+        # values are lower-cased as in `DBEngine.execute`, and typed since `3` and `3.0` differ on text columns
+        conditions = tuple((col_idx, op_idx, type(val).__name__, val.lower() if isinstance(val, str) else val)
+                           for col_idx, op_idx, val in query.conditions)
+
+        return table_id, query.sel_index, query.agg_index, conditions
+
+    def cache_execution(self, key, result):
+        """cache the result of a query, or its error, which is an exception or an `ExecutionError`"""
+        if isinstance(result, QueryTimeout):
+            return
+
+        if isinstance(result, Exception):
+            result = ExecutionError(type(result), result.args)
+
+        self.execution_cache[key] = result
+        if self.execution_cache_size:
+            while len(self.execution_cache) > self.execution_cache_size:
+                self.execution_cache.popitem(last=False)
+        if self._shard_keys is not None:
+            self._shard_keys.append(key)
+
+    def execute_query(self, table_id, query):
+        key = self.get_execution_key(table_id, query)
+        if key in self.execution_cache:
+            self.execution_cache_hits += 1
+            self.execution_cache.move_to_end(key)
+            result = self.execution_cache[key]
+        else:
+            self.execution_cache_misses += 1
+            try:
+                result = self.execution_engine.execute_query(table_id, query, lower=True)
+            except Exception as e:
+                self.cache_execution(key, e)
+                raise
+            self.cache_execution(key, result)
+
+        if isinstance(result, ExecutionError):
+            raise result.to_exception()
+
+        return result
+
+    def prefetch_executions(self, examples, decode_results, fast_mode=False):
+        """execute the reference and hypothesis queries not in the execution cache concurrently with the pool"""
+        jobs = OrderedDict()
+        for example, hyp_list in zip(examples, decode_results):
+            table_id = example.meta['table_id']
+            queries = [Query.from_tokenized_dict(example.meta['query'])]
+            # answer pruning executes all hypotheses, otherwise only the checked ones are executed
+            for hyp in (hyp_list[:1] if fast_mode and not self.answer_prune else hyp_list):
+                try:
+                    queries.append(detokenize_query(hyp.code, example.meta, example.table))
+                except:
+                    # reported when the hypothesis is evaluated
+                    pass
+
+            for query in queries:
+                key = self.get_execution_key(table_id, query)
+                if key not in self.execution_cache and key not in jobs:
+                    jobs[key] = (table_id, query)
+
+        results = self.execution_pool.execute_queries(list(jobs.values()))
+        for key, result in zip(jobs, results):
+            self.cache_execution(key, result)
+        self.execution_cache_misses += len(jobs)
+
+    def init_worker(self):
+        # keys of the results cached by a worker since its last shard
+        self._shard_keys = []
+        self._shard_begin = (self.execution_cache_hits, self.execution_cache_misses)
+
+    def get_shard_state(self):
+        hits, misses = self._shard_begin
+        new_results = [(key, self.execution_cache[key]) for key in OrderedDict.fromkeys(self._shard_keys)
+                       if key in self.execution_cache]
+        self.init_worker()
+
+        return new_results, self.execution_cache_hits - hits, self.execution_cache_misses - misses
+
+    def merge_shard_state(self, state):
+        new_results, hits, misses = state
+        for key, result in new_results:
+            self.cache_execution(key, result)
+        self.execution_cache_hits += hits
+        self.execution_cache_misses += misses
+
+    def compute_reference(self, example):
+        ref_query = Query.from_tokenized_dict(example.meta['query'])
+        ref_answer = self.execute_query(example.meta['table_id'], ref_query)
+
+        return ref_answer
+
     def is_hyp_correct(self, example, hyp):
         hyp_query = asdl_ast_to_sql_query(hyp.tree)
         detokenized_hyp_query = detokenize_query(hyp_query, example.meta, example.table)
 
-        hyp_answer = self.execution_engine.execute_query(example.meta['table_id'], detokenized_hyp_query, lower=True)
+        hyp_answer = self.execute_query(example.meta['table_id'], detokenized_hyp_query)
 
-        ref_query = Query.from_tokenized_dict(example.meta['query'])
-        ref_answer = self.execution_engine.execute_query(example.meta['table_id'], ref_query, lower=True)
+        ref_answer = self.get_reference(example)
 
         result = ref_answer == hyp_answer
 
         return result
 
     def evaluate_dataset(self, examples, decode_results, fast_mode=False):
+        if self.execution_pool is not None:
+            self.prefetch_executions(examples, decode_results, fast_mode)
+
         if self.answer_prune:
             filtered_decode_results = []
             for example, hyp_list in zip(examples, decode_results):
@@ -41,8 +169,7 @@ class WikiSQLEvaluator(Evaluator):
                         try:
                             # check if it is executable
                             detokenized_hyp_query = detokenize_query(hyp.code, example.meta, example.table)
-                            hyp_answer = self.execution_engine.execute_query(example.meta['table_id'],
-                                                                             detokenized_hyp_query, lower=True)
+                            hyp_answer = self.execute_query(example.meta['table_id'], detokenized_hyp_query)
                             if len(hyp_answer) == 0:
                                 continue
 
@@ -69,4 +196,8 @@ class WikiSQLEvaluator(Evaluator):
 
         eval_results = Evaluator.evaluate_dataset(self, examples, decode_results, fast_mode)
 
+        print('execution cache: %d hits, %d misses (distinct queries executed)' % (self.execution_cache_hits,
+                                                                                  self.execution_cache_misses),
+              file=sys.stderr)
+
         return eval_results
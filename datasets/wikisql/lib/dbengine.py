@@ -1,17 +1,144 @@
-import records
+import os
 import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from babel.numbers import parse_decimal, NumberFormatError
 from .query import Query
 
+try:
+    from urllib.request import pathname2url
+except ImportError:
+    from urllib import pathname2url
+
 
 schema_re = re.compile(r'\((.+)\)')
 num_re = re.compile(r'[-+]?\d*\.\d+|\d+')
 
 
+class QueryTimeout(Exception):
+    """a query interrupted after running longer than the timeout of the engine"""
+
+
 class DBEngine:
 
-    def __init__(self, fdb):
-        self.db = records.Database('sqlite:///{}'.format(fdb))
+    def __init__(self, fdb, timeout=None, in_memory=False, mmap_size=0):
+        self.fdb = fdb
+        # queries running longer than `timeout` seconds are interrupted with `QueryTimeout`
+        self.timeout = timeout
+        # query a copy of the database in memory, loaded by `load_into_memory`
+        self.in_memory = in_memory
+        # size of memory-mapped I/O on the database file, not used in memory
+        self.mmap_size = mmap_size
+
+        # connections are per thread (and per process)
+        self._local = threading.local()
+        # (process id, URI, connection) of the in-memory database, which lives as long as the connection
+        self._memory_db = None
+        self._memory_db_lock = threading.Lock()
+
+        # table name -> {column name: column type}
+        self.schemas = dict()
+        # (table name, select index, aggregation index, ((column index, operator index), ...)) -> SQL statement
+        self.statements = dict()
+
+    @property
+    def conn(self):
+        local = self._local
+        # a sqlite connection cannot be shared with forked processes, which open their own
+        if getattr(local, 'conn', None) is None or local.pid != os.getpid():
+            if self.in_memory:
+                uri = self.load_into_memory()
+            else:
+                uri = self.file_uri
+
+            # statements are compiled once and kept in the connection's statement cache
+            local.conn = sqlite3.connect(uri, uri=True, cached_statements=1024)
+            local.pid = os.getpid()
+            local.deadline = None
+
+            if self.in_memory:
+                local.conn.execute('PRAGMA query_only = 1')
+            elif self.mmap_size:
+                local.conn.execute('PRAGMA mmap_size = {:d}'.format(self.mmap_size))
+
+            if self.timeout:
+                # a non-zero return value of the progress handler interrupts the running query
+                local.conn.set_progress_handler(lambda: local.deadline is not None and time.time() > local.deadline,
+                                                1000)
+
+        return local.conn
+
+    @property
+    def file_uri(self):
+        return 'file:{}?mode=ro'.format(pathname2url(os.path.abspath(self.fdb)))
+
+    def load_into_memory(self):
+        """
+        copy the database file into a shared-cache in-memory database with the sqlite backup API, once per process.
+        Returns its URI, which connections of all threads open
+        """
+        with self._memory_db_lock:
+            if self._memory_db is None or self._memory_db[0] != os.getpid():
+                uri = 'file:wikisql_{}_{}?mode=memory&cache=shared'.format(os.getpid(), id(self))
+                memory_conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+
+                file_conn = sqlite3.connect(self.file_uri, uri=True)
+                if hasattr(file_conn, 'backup'):
+                    file_conn.backup(memory_conn)
+                else:
+                    # the backup API is only exposed since Python 3.7
+                    memory_conn.executescript('\n'.join(file_conn.iterdump()))
+                file_conn.close()
+
+                self._memory_db = (os.getpid(), uri, memory_conn)
+
+            return self._memory_db[1]
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_local'], state['_memory_db_lock']
+        state['_memory_db'] = None
+
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+        self._memory_db_lock = threading.Lock()
+
+    def get_schema(self, table_id):
+        schema = self.schemas.get(table_id)
+        if schema is None:
+            table_info = self.conn.execute('SELECT sql from sqlite_master WHERE tbl_name = ?', (table_id,)).fetchall()[0][0]
+            schema_str = schema_re.findall(table_info)[0]
+            schema = {}
+            for tup in schema_str.split(', '):
+                c, t = tup.split()
+                schema[c] = t
+            self.schemas[table_id] = schema
+
+        return schema
+
+    def get_statement(self, table_id, select_index, aggregation_index, conditions):
+        key = (table_id, select_index, aggregation_index, tuple((col_index, op) for col_index, op, val in conditions))
+        statement = self.statements.get(key)
+        if statement is None:
+            select = 'col{}'.format(select_index)
+            agg = Query.agg_ops[aggregation_index]
+            if agg:
+                select = '{}({})'.format(agg, select)
+            where_clause = []
+            for col_index, op, val in conditions:
+                where_clause.append('col{} {} :col{}'.format(col_index, Query.cond_ops[op], col_index))
+            where_str = ''
+            if where_clause:
+                where_str = 'WHERE ' + ' AND '.join(where_clause)
+            statement = 'SELECT {} AS result FROM {} {}'.format(select, table_id, where_str)
+            self.statements[key] = statement
+
+        return statement
 
     def execute_query(self, table_id, query, *args, **kwargs):
         return self.execute(table_id, query.sel_index, query.agg_index, query.conditions, *args, **kwargs)
@@ -19,17 +146,7 @@ class DBEngine:
     def execute(self, table_id, select_index, aggregation_index, conditions, lower=True):
         if not table_id.startswith('table'):
             table_id = 'table_{}'.format(table_id.replace('-', '_'))
-        table_info = self.db.query('SELECT sql from sqlite_master WHERE tbl_name = :name', name=table_id).all()[0].sql
-        schema_str = schema_re.findall(table_info)[0]
-        schema = {}
-        for tup in schema_str.split(', '):
-            c, t = tup.split()
-            schema[c] = t
-        select = 'col{}'.format(select_index)
-        agg = Query.agg_ops[aggregation_index]
-        if agg:
-            select = '{}({})'.format(agg, select)
-        where_clause = []
+        schema = self.get_schema(table_id)
         where_map = {}
         for col_index, op, val in conditions:
             if lower and isinstance(val, str):
@@ -39,11 +156,43 @@ class DBEngine:
                     val = float(parse_decimal(val))
                 except NumberFormatError as e:
                     val = float(num_re.findall(val)[0])
-            where_clause.append('col{} {} :col{}'.format(col_index, Query.cond_ops[op], col_index))
             where_map['col{}'.format(col_index)] = val
-        where_str = ''
-        if where_clause:
-            where_str = 'WHERE ' + ' AND '.join(where_clause)
-        query = 'SELECT {} AS result FROM {} {}'.format(select, table_id, where_str)
-        out = self.db.query(query, **where_map)
-        return [o.result for o in out]
+        statement = self.get_statement(table_id, select_index, aggregation_index, conditions)
+        conn = self.conn
+        if self.timeout:
+            self._local.deadline = time.time() + self.timeout
+        try:
+            cursor = conn.execute(statement, where_map)
+            return [o[0] for o in cursor]
+        except sqlite3.OperationalError as e:
+            # raised by sqlite when the progress handler interrupts the query
+            if self.timeout and str(e) == 'interrupted':
+                raise QueryTimeout('query on {} interrupted after {:g}s'.format(table_id, self.timeout))
+            raise
+        finally:
+            self._local.deadline = None
+
+
+class DBExecutionPool:
+    """
+    executes batches of (table_id, query) jobs concurrently with a pool of threads, each with its own read-only
+    connection of `engine`. sqlite releases the GIL while running a query
+    """
+
+    def __init__(self, engine, num_threads=4):
+        self.engine = engine
+        self.executor = ThreadPoolExecutor(max_workers=num_threads)
+
+    def _execute_job(self, job):
+        table_id, query = job
+        try:
+            return self.engine.execute_query(table_id, query, lower=True)
+        except Exception as e:
+            return e
+
+    def execute_queries(self, jobs):
+        """results of the jobs in order, the result of a failed (or timed out) query is its exception"""
+        return list(self.executor.map(self._execute_job, jobs))
+
+    def close(self):
+        self.executor.shutdown()
@@ -6,7 +6,7 @@ import traceback
 from tqdm import tqdm
 
 
-def decode(examples, model, args, verbose=False, **kwargs):
+def decode(examples, model, args, verbose=False, decode_result_writer=None, **kwargs):
     ## TODO: create decoder for each dataset
 
     if verbose:
@@ -20,10 +20,19 @@ def decode(examples, model, args, verbose=False, **kwargs):
     decode_results = []
     count = 0
     for example in tqdm(examples, desc='Decoding', file=sys.stdout, total=len(examples)):
+        # results saved by an interrupted run
+        if decode_result_writer is not None and decode_result_writer.has_result(example):
+            saved_hyps = decode_result_writer.load_result(example)
+            if saved_hyps is not None:
+                decode_results.append(saved_hyps)
+                continue
+
         if is_wikisql:
-            hyps = model.parse(example.src_sent, context=example.table, beam_size=args.beam_size)
+            hyps = model.parse(example.src_sent, context=example.table, beam_size=args.beam_size,
+                               recombination=args.beam_recombination)
         else:
-            hyps = model.parse(example.src_sent, context=None, beam_size=args.beam_size)
+            hyps = model.parse(example.src_sent, context=None, beam_size=args.beam_size,
+                               recombination=args.beam_recombination)
         decoded_hyps = []
         for hyp_id, hyp in enumerate(hyps):
             got_code = False
@@ -49,14 +58,17 @@ def decode(examples, model, args, verbose=False, **kwargs):
         count += 1
 
         decode_results.append(decoded_hyps)
+        if decode_result_writer is not None:
+            decode_result_writer.write(example, decoded_hyps)
 
     if was_training: model.train()
 
     return decode_results
 
 
-def evaluate(examples, parser, evaluator, args, verbose=False, return_decode_result=False, eval_top_pred_only=False):
-    decode_results = decode(examples, parser, args, verbose=verbose)
+def evaluate(examples, parser, evaluator, args, verbose=False, return_decode_result=False, eval_top_pred_only=False,
+             decode_result_writer=None):
+    decode_results = decode(examples, parser, args, verbose=verbose, decode_result_writer=decode_result_writer)
 
     eval_result = evaluator.evaluate_dataset(examples, decode_results, fast_mode=eval_top_pred_only)
 
@@ -20,8 +20,10 @@ from torch.autograd import Variable
 import evaluation
 from asdl import *
 from asdl.asdl import ASDLGrammar
+from asdl.action_encoding import ActionCodec
 from common.registerable import Registrable
 from components.dataset import Dataset, Example
+from components.decode_results import DecodeResultWriter
 from common.utils import update_args, init_arg_parser
 from datasets import *
 from model import nn_utils, utils
@@ -60,7 +62,7 @@ def train(args):
 
     vocab = pickle.load(open(args.vocab, 'rb'))
 
-    grammar = ASDLGrammar.from_text(open(args.asdl_file).read())
+    grammar = ASDLGrammar.from_file(args.asdl_file)
     transition_system = Registrable.by_name(args.transition_system)(grammar)
 
     parser_cls = Registrable.by_name(args.parser)  # TODO: add arg
@@ -233,14 +235,102 @@ def test(args):
     args.lang = saved_args.lang
 
     parser_cls = Registrable.by_name(args.parser)
-    parser = parser_cls.load(model_path=args.load_model, cuda=args.cuda)
+    parser = parser_cls.load(model_path=args.load_model, cuda=args.cuda, grammar=args.asdl_file)
     parser.eval()
     evaluator = Registrable.by_name(args.evaluator)(transition_system, args=args)
+
+    # decoding results are saved as they are produced
+    decode_result_writer = None
+    if args.save_decode_to:
+        action_codec = ActionCodec(transition_system, parser.vocab.primitive)
+        decode_result_writer = DecodeResultWriter(args.save_decode_to, action_codec, resume=args.resume)
+        if decode_result_writer.saved_offsets:
+            print('resume decoding, %d examples already decoded in [%s]' % (len(decode_result_writer.saved_offsets),
+                                                                           args.save_decode_to), file=sys.stderr)
+
     eval_results, decode_results = evaluation.evaluate(test_set.examples, parser, evaluator, args,
-                                                       verbose=args.verbose, return_decode_result=True)
+                                                       verbose=args.verbose, return_decode_result=True,
+                                                       decode_result_writer=decode_result_writer)
+    if decode_result_writer is not None:
+        decode_result_writer.close()
     print(eval_results, file=sys.stderr)
-    if args.save_decode_to:
-        pickle.dump(decode_results, open(args.save_decode_to, 'wb'))
+
+
+def quantize(args):
+    """
+    export a model that is loaded with dynamic int8 quantization for CPU inference, and report the accuracy and
+    decoding latency of the float and quantized models on the dev set
+    """
+    assert args.load_model
+
+    parser_cls = Registrable.by_name(args.parser)
+    parser = parser_cls.load(model_path=args.load_model, cuda=False, grammar=args.asdl_file)
+    model_file = args.save_to + '.bin'
+    print('save quantized model to [%s]' % model_file, file=sys.stderr)
+    parser.save(model_file, quantization='dynamic_int8')
+
+    if not args.dev_file:
+        return
+
+    dev_set = Dataset.from_bin_file(args.dev_file)
+    print_decode_report(args, dev_set, [('float32', parser_cls.load(model_path=args.load_model, cuda=False)),
+                                        ('int8', parser_cls.load(model_path=model_file, cuda=False))])
+
+
+def compile_model(args):
+    """
+    compile the encoder and the decoder step of a model with TorchScript, save them next to the checkpoint, verify
+    their outputs against the eager model (on the utterances of the dev set if any), and report the accuracy and
+    decoding latency of the eager and compiled models on the dev set
+    """
+    from model.torchscript import compile_parser, load_compiled_parser, save_compiled_parser, verify_compiled_parser
+
+    assert args.load_model
+
+    parser_cls = Registrable.by_name(args.parser)
+    parser = parser_cls.load(model_path=args.load_model, cuda=args.cuda, grammar=args.asdl_file)
+    compiled_model_file = save_compiled_parser(compile_parser(parser), args.load_model)
+    print('save compiled model to [%s]' % compiled_model_file, file=sys.stderr)
+
+    dev_set = Dataset.from_bin_file(args.dev_file) if args.dev_file else None
+    compiled_parser = parser_cls.load(model_path=args.load_model, cuda=args.cuda)
+    load_compiled_parser(compiled_parser, compiled_model_file, verify=False)
+    try:
+        max_diff = verify_compiled_parser(parser, compiled_parser.torchscript,
+                                          [e.src_sent for e in dev_set.examples] if dev_set else None)
+    except ValueError:
+        os.remove(compiled_model_file)
+        raise
+    print('maximal difference between the outputs of the eager and compiled models: %g' % max_diff, file=sys.stderr)
+
+    if dev_set:
+        print_decode_report(args, dev_set, [('eager', parser), ('compiled', compiled_parser)])
+
+
+def print_decode_report(args, dev_set, models):
+    """print the accuracy and decoding latency on `dev_set` of a list of (model name, parser), relative to the first"""
+    evaluator = Registrable.by_name(args.evaluator)(models[0][1].transition_system, args=args)
+
+    report = []
+    for model_name, parser in models:
+        begin = time.time()
+        decode_results = evaluation.decode(dev_set.examples, parser, args)
+        decode_time = time.time() - begin
+
+        # not `--eval_top_pred_only`, with which some evaluators only return the accuracy instead of a dict of metrics
+        eval_results = evaluator.evaluate_dataset(dev_set.examples, decode_results, fast_mode=False)
+        report.append((model_name, eval_results, decode_time))
+
+    base_time = report[0][2]
+    print('%d dev examples, beam size %d' % (len(dev_set), args.beam_size), file=sys.stderr)
+    print('%-8s %12s %12s %14s %8s' % ('model', evaluator.default_metric, 'decode (s)', 'ms / example', 'speedup'),
+          file=sys.stderr)
+    for model_name, eval_results, decode_time in report:
+        print('%-8s %12.4f %12.2f %14.2f %7.2fx' % (model_name, eval_results[evaluator.default_metric], decode_time,
+                                                   decode_time * 1000. / len(dev_set), base_time / decode_time),
+              file=sys.stderr)
+    for model_name, eval_results, decode_time in report:
+        print('%s: %s' % (model_name, eval_results), file=sys.stderr)
 
 
 if __name__ == '__main__':
@@ -251,5 +341,9 @@ if __name__ == '__main__':
         train(args)
     elif args.mode == 'test':
         test(args)
+    elif args.mode == 'quantize':
+        quantize(args)
+    elif args.mode == 'compile':
+        compile_model(args)
     else:
         raise RuntimeError('unknown mode')
@@ -2,6 +2,7 @@
 from __future__ import print_function
 
 import os
+import time
 from six.moves import xrange as range
 import math
 from collections import OrderedDict
@@ -14,6 +15,7 @@ from torch.autograd import Variable
 import torch.nn.functional as F
 from torch.nn.utils.rnn import pad_packed_sequence, pack_padded_sequence
 
+from asdl.asdl import ASDLGrammar
 from asdl.hypothesis import Hypothesis, GenTokenAction
 from asdl.transition_system import ApplyRuleAction, ReduceAction, Action
 from common.registerable import Registrable
@@ -22,11 +24,38 @@ from components.action_info import ActionInfo
 from components.dataset import Batch
 from common.utils import update_args, init_arg_parser
 from model import nn_utils
+from model.utils import add_completed_hypothesis
 from model.attention_util import AttentionUtil
 from model.nn_utils import LabelSmoothing
 from model.pointer_net import PointerNet
 
 
+# a compiled grammar next to a checkpoint, against which its grammar is checked on load
+GRAMMAR_FILE_SUFFIX = '.grammar'
+
+
+class UtteranceBeam(object):
+    """the state of the beam search of an utterance in `Parser.beam_search_batch`"""
+
+    def __init__(self, src_sent, deadline=None):
+        self.src_sent = src_sent
+        self.deadline = deadline
+
+        # For computing copy probabilities, we marginalize over tokens with the same surface form
+        # `aggregated_primitive_tokens` stores the position of occurrence of each source token
+        self.aggregated_primitive_tokens = OrderedDict()
+        for token_pos, token in enumerate(src_sent):
+            self.aggregated_primitive_tokens.setdefault(token, []).append(token_pos)
+
+        self.hypotheses = [DecodeHypothesis()]
+        self.hyp_states = [[]]
+        self.completed_hypotheses = []
+        self.num_steps = self.num_expanded = 0
+        self.stopped_at_deadline = False
+        # seconds from the start of the search to its end
+        self.search_time = None
+
+
 @Registrable.register('default_parser')
 class Parser(nn.Module):
     """Implementation of a semantic parser
@@ -470,70 +499,289 @@ class Parser(nn.Module):
             return att_vecs, att_probs
         else: return att_vecs
 
-    def parse(self, src_sent, context=None, beam_size=5, debug=False):
-        """Perform beam search to infer the target AST given a source utterance
+    def parse(self, src_sent, context=None, beam_size=5, debug=False, stats=None, deadline=None, timed_out=None,
+              recombination='none'):
+        """Perform beam search to infer the target AST given a source utterance. The encoder and the decoder steps
+        run in the compiled `torchscript` module of the parser when one is loaded, see `model.torchscript`
 
         Args:
             src_sent: list of source utterance tokens
             context: other context used for prediction
             beam_size: beam size
+            stats: optional dict, to which the latencies of the `encode` and `beam_search` stages (in seconds),
+                and the `beam_steps` and `hypotheses_expanded` of the beam search are appended
+            deadline: optional `time.time()` after which the beam search stops at the next step, and returns the
+                hypotheses completed so far
+            timed_out: optional list, to which whether the beam search stopped at its deadline is appended
+            recombination: how completed hypotheses with the same AST are recombined (`--beam_recombination`)
 
         Returns:
             A list of `DecodeHypothesis`, each representing an AST
         """
 
+        begin = time.time()
+        src_sent_var = nn_utils.to_input_variable([src_sent], self.vocab.source, cuda=self.args.cuda, training=False)
+
+        # Variable(1, src_sent_len, hidden_size * 2)
+        if getattr(self, 'torchscript', None) is not None:
+            src_encodings, last_state, last_cell = self.torchscript(src_sent_var, torch.LongTensor([len(src_sent)]))
+        else:
+            src_encodings, (last_state, last_cell) = self.encode(src_sent_var, [len(src_sent)])
+        if stats is not None:
+            stats.setdefault('encode', []).append(time.time() - begin)
+
+        return self.beam_search(src_sent, src_encodings, last_state, last_cell, beam_size=beam_size, debug=debug,
+                                stats=stats, deadline=deadline, timed_out=timed_out, recombination=recombination)
+
+    def parse_batch(self, src_sents, contexts=None, beam_size=5, debug=False, stats=None, deadlines=None,
+                    timed_out=None, recombination='none'):
+        """Perform beam search for a batch of source utterances, which are encoded in one batch, and whose beam
+        searches run together, see `beam_search_batch`. With a compiled `torchscript` module, whose decoder step
+        attends to the encodings of one utterance, the utterances are searched one by one
+
+        Args:
+            src_sents: list of source utterances, each a list of tokens
+            contexts: other contexts used for prediction, one per utterance
+            beam_size: beam size
+            stats: optional dict of decoding statistics, see `parse`. The batch is encoded in one `encode` stage
+            deadlines: optional deadline of each utterance, see `parse`
+            timed_out: optional list, extended with whether the beam search of each utterance stopped at its deadline
+            recombination: recombination of completed hypotheses, see `parse`
+
+        Returns:
+            A list of lists of `DecodeHypothesis`, one list per utterance
+        """
+
+        # the encoder takes utterances sorted by descending length
+        sorted_ids = sorted(range(len(src_sents)), key=lambda i: -len(src_sents[i]))
+        sorted_src_sents = [src_sents[i] for i in sorted_ids]
+
+        begin = time.time()
+        src_sents_var = nn_utils.to_input_variable(sorted_src_sents, self.vocab.source, cuda=self.args.cuda,
+                                                   training=False)
+
+        # Variable(batch_size, max_src_sent_len, hidden_size * 2)
+        src_sents_len = [len(src_sent) for src_sent in sorted_src_sents]
+        if getattr(self, 'torchscript', None) is not None:
+            src_encodings, last_state, last_cell = self.torchscript(src_sents_var, torch.LongTensor(src_sents_len))
+        else:
+            src_encodings, (last_state, last_cell) = self.encode(src_sents_var, src_sents_len)
+        if stats is not None:
+            stats.setdefault('encode', []).append(time.time() - begin)
+
+        sorted_deadlines = [deadlines[sent_id] for sent_id in sorted_ids] if deadlines else None
+        sorted_timed_out = []
+        if getattr(self, 'torchscript', None) is not None:
+            sorted_hypotheses = []
+            for batch_id, src_sent in enumerate(sorted_src_sents):
+                sorted_hypotheses.append(self.beam_search(src_sent,
+                                                          src_encodings[batch_id:batch_id + 1, :len(src_sent)],
+                                                          last_state[batch_id:batch_id + 1],
+                                                          last_cell[batch_id:batch_id + 1],
+                                                          beam_size=beam_size, debug=debug, stats=stats,
+                                                          deadline=sorted_deadlines[batch_id] if deadlines else None,
+                                                          timed_out=sorted_timed_out, recombination=recombination))
+        else:
+            sorted_hypotheses = self.beam_search_batch(sorted_src_sents, src_encodings, last_state, last_cell,
+                                                       beam_size=beam_size, debug=debug, stats=stats,
+                                                       deadlines=sorted_deadlines, timed_out=sorted_timed_out,
+                                                       recombination=recombination)
+
+        hypotheses = [None] * len(src_sents)
+        search_timed_out = [None] * len(src_sents)
+        for batch_id, sent_id in enumerate(sorted_ids):
+            hypotheses[sent_id] = sorted_hypotheses[batch_id]
+            search_timed_out[sent_id] = sorted_timed_out[batch_id]
+
+        if timed_out is not None:
+            timed_out.extend(search_timed_out)
+
+        return hypotheses
+
+    def beam_step(self, x, h_tm1, src_encodings, src_encodings_att_linear, src_encodings_ptr_linear=None,
+                  src_token_mask=None):
+        """Perform a decoder step of the hypotheses of the beam search, and compute their action probabilities
+
+        Args:
+            x: variable of shape (hyp_num, input_size), input of the decoder LSTM
+            h_tm1: previous hidden and cell states of the hypotheses, see `step`
+            src_encodings: source encodings of shape (1, src_sent_len, hidden_size * 2), shared by the hypotheses,
+                or of shape (hyp_num, src_sent_len, hidden_size * 2), the encodings of the utterance of each hypothesis
+            src_encodings_att_linear: linearly transformed source encodings of shape (1 or hyp_num, src_sent_len,
+                hidden_size)
+            src_encodings_ptr_linear: optional source encodings as compared by the pointer net (see
+                `PointerNet.project`) of shape (1 or hyp_num, src_sent_len, att_vec_size)
+            src_token_mask: optional mask of shape (hyp_num, src_sent_len) over the padding of the source encodings
+
+        Returns:
+            The new LSTM hidden state and cell state, the attentional vectors, the log probabilities of
+            ApplyRule (and Reduce) actions, the probabilities of generating primitive tokens from the vocabulary, and
+            the probabilities of generating or copying a token and of copying each source token (None without copying)
+        """
+
+        hyp_num = x.size(0)
+        # (hyp_num, src_sent_len, hidden_size * 2)
+        exp_src_encodings = src_encodings.expand(hyp_num, src_encodings.size(1), src_encodings.size(2))
+        # (hyp_num, src_sent_len, hidden_size)
+        exp_src_encodings_att_linear = src_encodings_att_linear.expand(hyp_num, src_encodings_att_linear.size(1), src_encodings_att_linear.size(2))
+
+        (h_t, cell_t), att_t = self.step(x, h_tm1, exp_src_encodings,
+                                         exp_src_encodings_att_linear,
+                                         src_token_mask=src_token_mask)
+
+        # Variable(batch_size, grammar_size)
+        # apply_rule_log_prob = torch.log(F.softmax(self.production_readout(att_t), dim=-1))
+        apply_rule_log_prob = F.log_softmax(self.production_readout(att_t), dim=-1)
+
+        # Variable(batch_size, primitive_vocab_size)
+        gen_from_vocab_prob = F.softmax(self.tgt_token_readout(att_t), dim=-1)
+
+        primitive_predictor_prob = primitive_copy_prob = None
+        if self.args.no_copy is False:
+            # Variable(batch_size, src_sent_len)
+            primitive_copy_prob = self.src_pointer_net(src_encodings, src_token_mask, att_t.unsqueeze(0),
+                                                       src_encodings_linear=src_encodings_ptr_linear).squeeze(0)
+
+            # Variable(batch_size, 2)
+            primitive_predictor_prob = F.softmax(self.primitive_predictor(att_t), dim=-1)
+
+        return (h_t, cell_t), att_t, apply_rule_log_prob, gen_from_vocab_prob, primitive_predictor_prob, \
+            primitive_copy_prob
+
+    def beam_search(self, src_sent, src_encodings, last_state, last_cell, beam_size=5, debug=False, stats=None,
+                    deadline=None, timed_out=None, recombination='none'):
+        """Perform beam search given the encodings of a source utterance
+
+        Args:
+            src_sent: list of source utterance tokens
+            src_encodings: source encodings of shape (1, src_sent_len, hidden_size * 2)
+            last_state, last_cell: the last hidden state and cell state of the encoder, of shape (1, hidden_size * 2)
+            beam_size: beam size
+            stats: optional dict of decoding statistics, see `parse`
+            deadline: optional deadline of the search, see `parse`
+            timed_out: optional list, see `parse`
+            recombination: recombination of completed hypotheses, see `parse`
+
+        Returns:
+            A list of `DecodeHypothesis`, each representing an AST
+        """
+
+        return self.beam_search_batch([src_sent], src_encodings, last_state, last_cell, beam_size=beam_size,
+                                      debug=debug, stats=stats, deadlines=[deadline] if deadline else None,
+                                      timed_out=timed_out, recombination=recombination)[0]
+
+    def beam_search_batch(self, src_sents, src_encodings, last_state, last_cell, beam_size=5, debug=False,
+                          stats=None, deadlines=None, timed_out=None, recombination='none'):
+        """Perform the beam searches of a batch of source utterances together: each decoder step runs once for the
+        live hypotheses of all the utterances, each hypothesis attending to the encodings of its own utterance, while
+        the hypotheses of an utterance are ranked in its own beam, as `beam_search` would
+
+        Args:
+            src_sents: list of source utterances, each a list of tokens
+            src_encodings: source encodings of shape (batch_size, max_src_sent_len, hidden_size * 2), padded after
+                the end of each utterance
+            last_state, last_cell: the last hidden state and cell state of the encoder, of shape
+                (batch_size, hidden_size * 2)
+            beam_size: beam size
+            stats: optional dict of decoding statistics, see `parse`. The `beam_search` latency of an utterance is
+                the time until its search ended
+            deadlines: optional deadline of the search of each utterance, see `parse`
+            timed_out: optional list, extended with whether the search of each utterance stopped at its deadline
+            recombination: recombination of completed hypotheses, see `parse`
+
+        Returns:
+            A list of lists of `DecodeHypothesis`, one list per utterance
+        """
+
+        begin = time.time()
         args = self.args
         primitive_vocab = self.vocab.primitive
         T = torch.cuda if args.cuda else torch
+        batch_size = len(src_sents)
+        # copy and generation probabilities of the same token are already marginalized in `primitive_prob`,
+        # so expansions at a step are distinct, and only completed duplicates need to be recombined
+
+        torchscript = getattr(self, 'torchscript', None)
+        src_encodings_ptr_linear = src_token_mask = None
+        if torchscript is not None:
+            # the compiled decoder step attends to the encodings of a single utterance
+            if batch_size > 1:
+                raise ValueError('the compiled parser searches one utterance at a time')
+
+            # (src_sent_len, hidden_size)
+            src_encodings_att_linear, src_encodings_ptr_linear, h_0, c_0 = \
+                torchscript.init_decoder_state(src_encodings[0], last_cell)
+            dec_init_vec = (h_0, c_0)
+        else:
+            # (batch_size, src_sent_len, hidden_size)
+            src_encodings_att_linear = self.att_src_linear(src_encodings)
+            if args.no_copy is False:
+                src_encodings_ptr_linear = self.src_pointer_net.project(src_encodings)
+            if batch_size > 1:
+                # (batch_size, src_sent_len), the padding after each utterance is masked to one
+                src_token_mask = nn_utils.length_array_to_mask_tensor([len(src_sent) for src_sent in src_sents],
+                                                                      cuda=args.cuda)
+            dec_init_vec = self.init_decoder_state(last_state, last_cell)
 
-        src_sent_var = nn_utils.to_input_variable([src_sent], self.vocab.source, cuda=args.cuda, training=False)
-
-        # Variable(1, src_sent_len, hidden_size * 2)
-        src_encodings, (last_state, last_cell) = self.encode(src_sent_var, [len(src_sent)])
-        # (1, src_sent_len, hidden_size)
-        src_encodings_att_linear = self.att_src_linear(src_encodings)
-
-        dec_init_vec = self.init_decoder_state(last_state, last_cell)
         if args.lstm == 'parent_feed':
             h_tm1 = dec_init_vec[0], dec_init_vec[1], \
-                    Variable(self.new_tensor(args.hidden_size).zero_()), \
-                    Variable(self.new_tensor(args.hidden_size).zero_())
+                    Variable(self.new_tensor(batch_size, args.hidden_size).zero_()), \
+                    Variable(self.new_tensor(batch_size, args.hidden_size).zero_())
         else:
             h_tm1 = dec_init_vec
 
         zero_action_embed = Variable(self.new_tensor(args.action_embed_size).zero_())
 
-        hyp_scores = Variable(self.new_tensor([0.]), volatile=True)
-
-        # For computing copy probabilities, we marginalize over tokens with the same surface form
-        # `aggregated_primitive_tokens` stores the position of occurrence of each source token
-        aggregated_primitive_tokens = OrderedDict()
-        for token_pos, token in enumerate(src_sent):
-            aggregated_primitive_tokens.setdefault(token, []).append(token_pos)
+        searches = [UtteranceBeam(src_sent, deadline=deadlines[sent_id] if deadlines else None)
+                    for sent_id, src_sent in enumerate(src_sents)]
 
         t = 0
-        hypotheses = [DecodeHypothesis()]
-        hyp_states = [[]]
-        completed_hypotheses = []
+        # the searches in progress, and the utterance of each row of `h_tm1` and `att_tm1`, which are the hypotheses
+        # of these searches in order
+        live_sent_ids = list(range(batch_size))
+        row_sent_ids = list(range(batch_size))
+
+        while live_sent_ids:
+            step_sent_ids = []
+            for sent_id in live_sent_ids:
+                search = searches[sent_id]
+                if len(search.completed_hypotheses) >= beam_size or t >= args.decode_max_time_step:
+                    search.search_time = time.time() - begin
+                # the search is cancelled between steps
+                elif search.deadline is not None and time.time() > search.deadline:
+                    search.stopped_at_deadline = True
+                    search.search_time = time.time() - begin
+                else:
+                    step_sent_ids.append(sent_id)
 
-        while len(completed_hypotheses) < beam_size and t < args.decode_max_time_step:
-            hyp_num = len(hypotheses)
+            if not step_sent_ids:
+                break
+
+            if len(step_sent_ids) < len(live_sent_ids):
+                step_rows = [row for row, sent_id in enumerate(row_sent_ids) if sent_id in step_sent_ids]
+                h_tm1 = tuple(h[step_rows] for h in h_tm1)
+                if t > 0:
+                    att_tm1 = att_tm1[step_rows]
+                row_sent_ids = [row_sent_ids[row] for row in step_rows]
 
-            # (hyp_num, src_sent_len, hidden_size * 2)
-            exp_src_encodings = src_encodings.expand(hyp_num, src_encodings.size(1), src_encodings.size(2))
-            # (hyp_num, src_sent_len, hidden_size)
-            exp_src_encodings_att_linear = src_encodings_att_linear.expand(hyp_num, src_encodings_att_linear.size(1), src_encodings_att_linear.size(2))
+            hypotheses = [hyp for sent_id in step_sent_ids for hyp in searches[sent_id].hypotheses]
+            hyp_states = [states for sent_id in step_sent_ids for states in searches[sent_id].hyp_states]
+            hyp_scores = Variable(self.new_tensor([hyp.score for hyp in hypotheses]))
+            hyp_num = len(hypotheses)
+            for sent_id in step_sent_ids:
+                searches[sent_id].num_steps += 1
+                searches[sent_id].num_expanded += len(searches[sent_id].hypotheses)
 
             if t == 0:
-                x = Variable(self.new_tensor(1, self.decoder_lstm.input_size).zero_(), volatile=True)
+                x = Variable(self.new_tensor(hyp_num, self.decoder_lstm.input_size).zero_(), volatile=True)
                 if args.no_parent_field_type_embed is False:
                     offset = args.action_embed_size  # prev_action
                     offset += args.att_vec_size * (not args.no_input_feed)
                     offset += args.action_embed_size * (not args.no_parent_production_embed)
                     offset += args.field_embed_size * (not args.no_parent_field_embed)
 
-                    x[0, offset: offset + args.type_embed_size] = \
-                        self.type_embed.weight[self.grammar.type2id[self.grammar.root_type]]
+                    x[:, offset: offset + args.type_embed_size] = self.type_embed(Variable(self.new_long_tensor(
+                        [self.grammar.type2id[self.grammar.root_type]] * hyp_num)))
             else:
                 actions_tm1 = [hyp.actions[-1] for hyp in hypotheses]
 
@@ -588,202 +836,227 @@ class Parser(nn.Module):
 
                 x = torch.cat(inputs, dim=-1)
 
-            (h_t, cell_t), att_t = self.step(x, h_tm1, exp_src_encodings,
-                                             exp_src_encodings_att_linear,
-                                             src_token_mask=None)
-
-            # Variable(batch_size, grammar_size)
-            # apply_rule_log_prob = torch.log(F.softmax(self.production_readout(att_t), dim=-1))
-            apply_rule_log_prob = F.log_softmax(self.production_readout(att_t), dim=-1)
-
-            # Variable(batch_size, primitive_vocab_size)
-            gen_from_vocab_prob = F.softmax(self.tgt_token_readout(att_t), dim=-1)
+            if torchscript is not None:
+                h_t, cell_t, att_t, apply_rule_log_prob, gen_from_vocab_prob, primitive_predictor_prob, \
+                    primitive_copy_prob = torchscript.step(x, h_tm1[0], h_tm1[1], src_encodings[0],
+                                                           src_encodings_att_linear, src_encodings_ptr_linear)
+            elif batch_size == 1:
+                (h_t, cell_t), att_t, apply_rule_log_prob, gen_from_vocab_prob, primitive_predictor_prob, \
+                    primitive_copy_prob = self.beam_step(x, h_tm1, src_encodings, src_encodings_att_linear,
+                                                         src_encodings_ptr_linear)
+            else:
+                # the encodings of the utterance of each hypothesis
+                row_ids = Variable(self.new_long_tensor(row_sent_ids))
+                (h_t, cell_t), att_t, apply_rule_log_prob, gen_from_vocab_prob, primitive_predictor_prob, \
+                    primitive_copy_prob = self.beam_step(
+                        x, h_tm1, src_encodings.index_select(0, row_ids),
+                        src_encodings_att_linear.index_select(0, row_ids),
+                        src_encodings_ptr_linear.index_select(0, row_ids) if args.no_copy is False else None,
+                        src_token_mask.index_select(0, row_ids.data))
 
             if args.no_copy:
                 primitive_prob = gen_from_vocab_prob
             else:
-                # Variable(batch_size, src_sent_len)
-                primitive_copy_prob = self.src_pointer_net(src_encodings, None, att_t.unsqueeze(0)).squeeze(0)
-
-                # Variable(batch_size, 2)
-                primitive_predictor_prob = F.softmax(self.primitive_predictor(att_t), dim=-1)
-
                 # Variable(batch_size, primitive_vocab_size)
                 primitive_prob = primitive_predictor_prob[:, 0].unsqueeze(1) * gen_from_vocab_prob
 
                 # if src_unk_pos_list:
                 #     primitive_prob[:, primitive_vocab.unk_id] = 1.e-10
 
-            gentoken_prev_hyp_ids = []
-            gentoken_new_hyp_unks = []
-            applyrule_new_hyp_scores = []
-            applyrule_new_hyp_prod_ids = []
-            applyrule_prev_hyp_ids = []
-
-            for hyp_id, hyp in enumerate(hypotheses):
-                # generate new continuations
-                action_types = self.transition_system.get_valid_continuation_types(hyp)
-
-                for action_type in action_types:
-                    if action_type == ApplyRuleAction:
-                        productions = self.transition_system.get_valid_continuating_productions(hyp)
-                        for production in productions:
-                            prod_id = self.grammar.prod2id[production]
-                            prod_score = apply_rule_log_prob[hyp_id, prod_id].data[0]
-                            new_hyp_score = hyp.score + prod_score
+            # the continuations of the hypotheses of each search, whose ids are rows of the step
+            search_candidates = []
+            hyp_offset = 0
+            for sent_id in step_sent_ids:
+                search = searches[sent_id]
+                aggregated_primitive_tokens = search.aggregated_primitive_tokens
+
+                gentoken_prev_hyp_ids = []
+                gentoken_new_hyp_unks = []
+                applyrule_new_hyp_scores = []
+                applyrule_new_hyp_prod_ids = []
+                applyrule_prev_hyp_ids = []
+
+                for hyp_id in range(hyp_offset, hyp_offset + len(search.hypotheses)):
+                    hyp = hypotheses[hyp_id]
+                    # generate new continuations
+                    action_types = self.transition_system.get_valid_continuation_types(hyp)
+
+                    for action_type in action_types:
+                        if action_type == ApplyRuleAction:
+                            prod_ids = self.transition_system.get_valid_continuating_production_ids(hyp)
+                            for prod_id in prod_ids:
+                                prod_score = apply_rule_log_prob[hyp_id, prod_id].data[0]
+                                new_hyp_score = hyp.score + prod_score
+
+                                applyrule_new_hyp_scores.append(new_hyp_score)
+                                applyrule_new_hyp_prod_ids.append(prod_id)
+                                applyrule_prev_hyp_ids.append(hyp_id)
+                        elif action_type == ReduceAction:
+                            action_score = apply_rule_log_prob[hyp_id, len(self.grammar)].data[0]
+                            new_hyp_score = hyp.score + action_score
 
                             applyrule_new_hyp_scores.append(new_hyp_score)
-                            applyrule_new_hyp_prod_ids.append(prod_id)
+                            applyrule_new_hyp_prod_ids.append(len(self.grammar))
                             applyrule_prev_hyp_ids.append(hyp_id)
-                    elif action_type == ReduceAction:
-                        action_score = apply_rule_log_prob[hyp_id, len(self.grammar)].data[0]
-                        new_hyp_score = hyp.score + action_score
-
-                        applyrule_new_hyp_scores.append(new_hyp_score)
-                        applyrule_new_hyp_prod_ids.append(len(self.grammar))
-                        applyrule_prev_hyp_ids.append(hyp_id)
-                    else:
-                        # GenToken action
-                        gentoken_prev_hyp_ids.append(hyp_id)
-                        hyp_copy_info = dict()  # of (token_pos, copy_prob)
-                        hyp_unk_copy_info = []
-
-                        if args.no_copy is False:
-                            for token, token_pos_list in aggregated_primitive_tokens.items():
-                                sum_copy_prob = torch.gather(primitive_copy_prob[hyp_id], 0, Variable(T.LongTensor(token_pos_list))).sum()
-                                gated_copy_prob = primitive_predictor_prob[hyp_id, 1] * sum_copy_prob
-
-                                if token in primitive_vocab:
-                                    token_id = primitive_vocab[token]
-                                    primitive_prob[hyp_id, token_id] = primitive_prob[hyp_id, token_id] + gated_copy_prob
-
-                                    hyp_copy_info[token] = (token_pos_list, gated_copy_prob.data[0])
-                                else:
-                                    hyp_unk_copy_info.append({'token': token, 'token_pos_list': token_pos_list,
-                                                              'copy_prob': gated_copy_prob.data[0]})
-
-                        if args.no_copy is False and len(hyp_unk_copy_info) > 0:
-                            unk_i = np.array([x['copy_prob'] for x in hyp_unk_copy_info]).argmax()
-                            token = hyp_unk_copy_info[unk_i]['token']
-                            primitive_prob[hyp_id, primitive_vocab.unk_id] = hyp_unk_copy_info[unk_i]['copy_prob']
-                            gentoken_new_hyp_unks.append(token)
-
-                            hyp_copy_info[token] = (hyp_unk_copy_info[unk_i]['token_pos_list'], hyp_unk_copy_info[unk_i]['copy_prob'])
-
-            new_hyp_scores = None
-            if applyrule_new_hyp_scores:
-                new_hyp_scores = Variable(self.new_tensor(applyrule_new_hyp_scores))
-            if gentoken_prev_hyp_ids:
+                        else:
+                            # GenToken action
+                            gentoken_prev_hyp_ids.append(hyp_id)
+                            hyp_copy_info = dict()  # of (token_pos, copy_prob)
+                            hyp_unk_copy_info = []
+
+                            if args.no_copy is False:
+                                for token, token_pos_list in aggregated_primitive_tokens.items():
+                                    sum_copy_prob = torch.gather(primitive_copy_prob[hyp_id], 0, Variable(T.LongTensor(token_pos_list))).sum()
+                                    gated_copy_prob = primitive_predictor_prob[hyp_id, 1] * sum_copy_prob
+
+                                    if token in primitive_vocab:
+                                        token_id = primitive_vocab[token]
+                                        primitive_prob[hyp_id, token_id] = primitive_prob[hyp_id, token_id] + gated_copy_prob
+
+                                        hyp_copy_info[token] = (token_pos_list, gated_copy_prob.data[0])
+                                    else:
+                                        hyp_unk_copy_info.append({'token': token, 'token_pos_list': token_pos_list,
+                                                                  'copy_prob': gated_copy_prob.data[0]})
+
+                            if args.no_copy is False and len(hyp_unk_copy_info) > 0:
+                                unk_i = np.array([x['copy_prob'] for x in hyp_unk_copy_info]).argmax()
+                                token = hyp_unk_copy_info[unk_i]['token']
+                                primitive_prob[hyp_id, primitive_vocab.unk_id] = hyp_unk_copy_info[unk_i]['copy_prob']
+                                gentoken_new_hyp_unks.append(token)
+
+                                hyp_copy_info[token] = (hyp_unk_copy_info[unk_i]['token_pos_list'], hyp_unk_copy_info[unk_i]['copy_prob'])
+
+                search_candidates.append((gentoken_prev_hyp_ids, gentoken_new_hyp_unks, applyrule_new_hyp_scores,
+                                          applyrule_new_hyp_prod_ids, applyrule_prev_hyp_ids))
+                hyp_offset += len(search.hypotheses)
+
+            if any(candidates[0] for candidates in search_candidates):
                 primitive_log_prob = torch.log(primitive_prob)
-                gen_token_new_hyp_scores = (hyp_scores[gentoken_prev_hyp_ids].unsqueeze(1) + primitive_log_prob[gentoken_prev_hyp_ids, :]).view(-1)
-
-                if new_hyp_scores is None: new_hyp_scores = gen_token_new_hyp_scores
-                else: new_hyp_scores = torch.cat([new_hyp_scores, gen_token_new_hyp_scores])
-
-            top_new_hyp_scores, top_new_hyp_pos = torch.topk(new_hyp_scores,
-                                                             k=min(new_hyp_scores.size(0), beam_size - len(completed_hypotheses)))
 
             live_hyp_ids = []
-            new_hypotheses = []
-            for new_hyp_score, new_hyp_pos in zip(top_new_hyp_scores.data.cpu(), top_new_hyp_pos.data.cpu()):
-                action_info = ActionInfo()
-                if new_hyp_pos < len(applyrule_new_hyp_scores):
-                    # it's an ApplyRule or Reduce action
-                    prev_hyp_id = applyrule_prev_hyp_ids[new_hyp_pos]
-                    prev_hyp = hypotheses[prev_hyp_id]
-
-                    prod_id = applyrule_new_hyp_prod_ids[new_hyp_pos]
-                    # ApplyRule action
-                    if prod_id < len(self.grammar):
-                        production = self.grammar.id2prod[prod_id]
-                        action = ApplyRuleAction(production)
-                    # Reduce action
-                    else:
-                        action = ReduceAction()
-                else:
-                    # it's a GenToken action
-                    token_id = (new_hyp_pos - len(applyrule_new_hyp_scores)) % primitive_prob.size(1)
-
-                    k = (new_hyp_pos - len(applyrule_new_hyp_scores)) // primitive_prob.size(1)
-                    # try:
-                    # copy_info = gentoken_copy_infos[k]
-                    prev_hyp_id = gentoken_prev_hyp_ids[k]
-                    prev_hyp = hypotheses[prev_hyp_id]
-                    # except:
-                    #     print('k=%d' % k, file=sys.stderr)
-                    #     print('primitive_prob.size(1)=%d' % primitive_prob.size(1), file=sys.stderr)
-                    #     print('len copy_info=%d' % len(gentoken_copy_infos), file=sys.stderr)
-                    #     print('prev_hyp_id=%s' % ', '.join(str(i) for i in gentoken_prev_hyp_ids), file=sys.stderr)
-                    #     print('len applyrule_new_hyp_scores=%d' % len(applyrule_new_hyp_scores), file=sys.stderr)
-                    #     print('len gentoken_prev_hyp_ids=%d' % len(gentoken_prev_hyp_ids), file=sys.stderr)
-                    #     print('top_new_hyp_pos=%s' % top_new_hyp_pos, file=sys.stderr)
-                    #     print('applyrule_new_hyp_scores=%s' % applyrule_new_hyp_scores, file=sys.stderr)
-                    #     print('new_hyp_scores=%s' % new_hyp_scores, file=sys.stderr)
-                    #     print('top_new_hyp_scores=%s' % top_new_hyp_scores, file=sys.stderr)
-                    #
-                    #     torch.save((applyrule_new_hyp_scores, primitive_prob), 'data.bin')
-                    #
-                    #     # exit(-1)
-                    #     raise ValueError()
-
-                    if token_id == primitive_vocab.unk_id:
-                        if gentoken_new_hyp_unks:
-                            token = gentoken_new_hyp_unks[k]
+            live_row_sent_ids = []
+            for sent_id, (gentoken_prev_hyp_ids, gentoken_new_hyp_unks, applyrule_new_hyp_scores,
+                          applyrule_new_hyp_prod_ids, applyrule_prev_hyp_ids) in zip(step_sent_ids, search_candidates):
+                search = searches[sent_id]
+                aggregated_primitive_tokens = search.aggregated_primitive_tokens
+                completed_hypotheses = search.completed_hypotheses
+
+                new_hyp_scores = None
+                if applyrule_new_hyp_scores:
+                    new_hyp_scores = Variable(self.new_tensor(applyrule_new_hyp_scores))
+                if gentoken_prev_hyp_ids:
+                    gen_token_new_hyp_scores = (hyp_scores[gentoken_prev_hyp_ids].unsqueeze(1) + primitive_log_prob[gentoken_prev_hyp_ids, :]).view(-1)
+
+                    if new_hyp_scores is None: new_hyp_scores = gen_token_new_hyp_scores
+                    else: new_hyp_scores = torch.cat([new_hyp_scores, gen_token_new_hyp_scores])
+
+                top_new_hyp_scores, top_new_hyp_pos = torch.topk(new_hyp_scores,
+                                                                 k=min(new_hyp_scores.size(0), beam_size - len(completed_hypotheses)))
+
+                new_hypotheses = []
+                new_hyp_states = []
+                for new_hyp_score, new_hyp_pos in zip(top_new_hyp_scores.data.cpu(), top_new_hyp_pos.data.cpu()):
+                    action_info = ActionInfo()
+                    if new_hyp_pos < len(applyrule_new_hyp_scores):
+                        # it's an ApplyRule or Reduce action
+                        prev_hyp_id = applyrule_prev_hyp_ids[new_hyp_pos]
+                        prev_hyp = hypotheses[prev_hyp_id]
+
+                        prod_id = applyrule_new_hyp_prod_ids[new_hyp_pos]
+                        # ApplyRule action
+                        if prod_id < len(self.grammar):
+                            production = self.grammar.id2prod[prod_id]
+                            action = ApplyRuleAction(production)
+                        # Reduce action
                         else:
-                            token = primitive_vocab.id2word[primitive_vocab.unk_id]
+                            action = ReduceAction()
                     else:
-                        token = primitive_vocab.id2word[token_id]
-
-                    action = GenTokenAction(token)
-
-                    if token in aggregated_primitive_tokens:
-                        action_info.copy_from_src = True
-                        action_info.src_token_position = aggregated_primitive_tokens[token]
+                        # it's a GenToken action
+                        token_id = (new_hyp_pos - len(applyrule_new_hyp_scores)) % primitive_prob.size(1)
+
+                        k = (new_hyp_pos - len(applyrule_new_hyp_scores)) // primitive_prob.size(1)
+                        prev_hyp_id = gentoken_prev_hyp_ids[k]
+                        prev_hyp = hypotheses[prev_hyp_id]
+
+                        if token_id == primitive_vocab.unk_id:
+                            if gentoken_new_hyp_unks:
+                                token = gentoken_new_hyp_unks[k]
+                            else:
+                                token = primitive_vocab.id2word[primitive_vocab.unk_id]
+                        else:
+                            token = primitive_vocab.id2word[token_id]
+
+                        action = GenTokenAction(token)
+
+                        if token in aggregated_primitive_tokens:
+                            action_info.copy_from_src = True
+                            action_info.src_token_position = aggregated_primitive_tokens[token]
+
+                        if debug:
+                            action_info.gen_copy_switch = 'n/a' if args.no_copy else primitive_predictor_prob[prev_hyp_id, :].log().cpu().data.numpy()
+                            action_info.in_vocab = token in primitive_vocab
+                            action_info.gen_token_prob = gen_from_vocab_prob[prev_hyp_id, token_id].log().cpu().data[0] \
+                                if token in primitive_vocab else 'n/a'
+                            action_info.copy_token_prob = torch.gather(primitive_copy_prob[prev_hyp_id],
+                                                                       0,
+                                                                       Variable(T.LongTensor(action_info.src_token_position))).sum().log().cpu().data[0] \
+                                if args.no_copy is False and action_info.copy_from_src else 'n/a'
+
+                    action_info.action = action
+                    action_info.t = t
+                    if t > 0:
+                        action_info.parent_t = prev_hyp.frontier_node.created_time
+                        action_info.frontier_prod = prev_hyp.frontier_node.production
+                        action_info.frontier_field = prev_hyp.frontier_field.field
 
                     if debug:
-                        action_info.gen_copy_switch = 'n/a' if args.no_copy else primitive_predictor_prob[prev_hyp_id, :].log().cpu().data.numpy()
-                        action_info.in_vocab = token in primitive_vocab
-                        action_info.gen_token_prob = gen_from_vocab_prob[prev_hyp_id, token_id].log().cpu().data[0] \
-                            if token in primitive_vocab else 'n/a'
-                        action_info.copy_token_prob = torch.gather(primitive_copy_prob[prev_hyp_id],
-                                                                   0,
-                                                                   Variable(T.LongTensor(action_info.src_token_position))).sum().log().cpu().data[0] \
-                            if args.no_copy is False and action_info.copy_from_src else 'n/a'
-
-                action_info.action = action
-                action_info.t = t
-                if t > 0:
-                    action_info.parent_t = prev_hyp.frontier_node.created_time
-                    action_info.frontier_prod = prev_hyp.frontier_node.production
-                    action_info.frontier_field = prev_hyp.frontier_field.field
+                        action_info.action_prob = new_hyp_score - prev_hyp.score
 
-                if debug:
-                    action_info.action_prob = new_hyp_score - prev_hyp.score
+                    new_hyp = prev_hyp.clone_and_apply_action_info(action_info)
+                    new_hyp.score = new_hyp_score
 
-                new_hyp = prev_hyp.clone_and_apply_action_info(action_info)
-                new_hyp.score = new_hyp_score
+                    if new_hyp.completed:
+                        add_completed_hypothesis(completed_hypotheses, new_hyp, recombination)
+                    else:
+                        new_hypotheses.append(new_hyp)
+                        new_hyp_states.append(hyp_states[prev_hyp_id] + [(h_t[prev_hyp_id], cell_t[prev_hyp_id])])
+                        live_hyp_ids.append(prev_hyp_id)
+                        live_row_sent_ids.append(sent_id)
 
-                if new_hyp.completed:
-                    completed_hypotheses.append(new_hyp)
-                else:
-                    new_hypotheses.append(new_hyp)
-                    live_hyp_ids.append(prev_hyp_id)
+                search.hypotheses = new_hypotheses
+                search.hyp_states = new_hyp_states
+                if not new_hypotheses:
+                    search.search_time = time.time() - begin
 
             if live_hyp_ids:
-                hyp_states = [hyp_states[i] + [(h_t[i], cell_t[i])] for i in live_hyp_ids]
                 h_tm1 = (h_t[live_hyp_ids], cell_t[live_hyp_ids])
                 att_tm1 = att_t[live_hyp_ids]
-                hypotheses = new_hypotheses
-                hyp_scores = Variable(self.new_tensor([hyp.score for hyp in hypotheses]))
+                live_sent_ids = [sent_id for sent_id in step_sent_ids if searches[sent_id].hypotheses]
+                row_sent_ids = live_row_sent_ids
                 t += 1
             else:
                 break
 
-        completed_hypotheses.sort(key=lambda hyp: -hyp.score)
+        for search in searches:
+            search.completed_hypotheses.sort(key=lambda hyp: -hyp.score)
 
-        return completed_hypotheses
+        if stats is not None:
+            for search in searches:
+                stats.setdefault('beam_search', []).append(search.search_time)
+                stats.setdefault('beam_steps', []).append(search.num_steps)
+                stats.setdefault('hypotheses_expanded', []).append(search.num_expanded)
+        if timed_out is not None:
+            timed_out.extend(search.stopped_at_deadline for search in searches)
+
+        return [search.completed_hypotheses for search in searches]
+
+    def save(self, path, quantization=None):
+        """save the parser, which `load` quantizes if `quantization` is 'dynamic_int8'"""
+        if getattr(self, 'quantized', False):
+            raise ValueError('save the float parser with quantization=\'dynamic_int8\' instead of a quantized one')
+        if getattr(self, 'torchscript', None) is not None:
+            raise ValueError('save the parser before loading its compiled TorchScript module')
 
-    def save(self, path):
         dir_name = os.path.dirname(path)
         if not os.path.exists(dir_name):
             os.makedirs(dir_name)
@@ -791,16 +1064,42 @@ class Parser(nn.Module):
         params = {
             'args': self.args,
             'transition_system': self.transition_system,
+            'grammar_digest': self.grammar.digest,
             'vocab': self.vocab,
-            'state_dict': self.state_dict()
+            'state_dict': self.state_dict(),
+            'quantization': quantization
         }
         torch.save(params, path)
 
+    @staticmethod
+    def check_grammar(model_path, params, grammar=None):
+        """
+        check that the grammar of the checkpoint `params` is `grammar` (an `ASDLGrammar`, or the path of a textual
+        or compiled grammar), or the compiled grammar next to the checkpoint if there is one.
+        Raises `ValueError` if it is not
+        """
+        checkpoint_digest = params['transition_system'].grammar.digest
+        if 'grammar_digest' in params and params['grammar_digest'] != checkpoint_digest:
+            raise ValueError('the grammar in [%s] does not match the one the model was trained with' % model_path)
+
+        if grammar is None and os.path.exists(model_path + GRAMMAR_FILE_SUFFIX):
+            grammar = model_path + GRAMMAR_FILE_SUFFIX
+        if grammar is None:
+            return
+
+        grammar_path = None if isinstance(grammar, ASDLGrammar) else grammar
+        if grammar_path:
+            grammar = ASDLGrammar.from_file(grammar_path)
+        if grammar.digest != checkpoint_digest:
+            raise ValueError('the model [%s] was trained with another grammar than %s' %
+                             (model_path, '[%s]' % grammar_path if grammar_path else 'the given one'))
+
     @classmethod
-    def load(cls, model_path, cuda=False):
+    def load(cls, model_path, cuda=False, grammar=None):
         params = torch.load(model_path, map_location=lambda storage, loc: storage)
         vocab = params['vocab']
         transition_system = params['transition_system']
+        cls.check_grammar(model_path, params, grammar)
         saved_args = params['args']
         # update saved args
         update_args(saved_args, init_arg_parser())
@@ -811,6 +1110,12 @@ class Parser(nn.Module):
 
         parser.load_state_dict(saved_state)
 
+        # the weights are quantized at load time, as quantized LSTM weights are not saved in state dicts
+        # on all PyTorch versions
+        if params.get('quantization') == 'dynamic_int8':
+            from model.quantization import quantize_parser
+            quantize_parser(parser)
+
         if cuda: parser = parser.cuda()
         parser.eval()
 
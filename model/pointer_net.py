@@ -18,18 +18,26 @@ class PointerNet(nn.Module):
 
         self.attention_type = attention_type
 
-    def forward(self, src_encodings, src_token_mask, query_vec):
+    def project(self, src_encodings):
+        """the source encodings as compared with the query vectors, which decoding computes once per utterance"""
+        if self.attention_type == 'affine':
+            return self.src_encoding_linear(src_encodings)
+
+        return src_encodings
+
+    def forward(self, src_encodings, src_token_mask, query_vec, src_encodings_linear=None):
         """
         :param src_encodings: Variable(batch_size, src_sent_len, hidden_size * 2)
         :param src_token_mask: Variable(batch_size, src_sent_len)
         :param query_vec: Variable(tgt_action_num, batch_size, query_vec_size)
+        :param src_encodings_linear: optional `project(src_encodings)`, which `src_encodings` is then not used for
         :return: Variable(tgt_action_num, batch_size, src_sent_len)
         """
 
         # (batch_size, 1, src_sent_len, query_vec_size)
-        if self.attention_type == 'affine':
-            src_encodings = self.src_encoding_linear(src_encodings)
-        src_encodings = src_encodings.unsqueeze(1)
+        if src_encodings_linear is None:
+            src_encodings_linear = self.project(src_encodings)
+        src_encodings = src_encodings_linear.unsqueeze(1)
 
         # (batch_size, tgt_action_num, query_vec_size, 1)
         q = query_vec.permute(1, 0, 2).unsqueeze(3)
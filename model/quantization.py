@@ -0,0 +1,100 @@
+# coding=utf-8
+"""
+Dynamic int8 quantization of a trained `Parser` for CPU inference (PyTorch >= 1.3). Weights are quantized once,
+activations are quantized on the fly at each matrix multiplication.
+"""
+
+from __future__ import print_function
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+# submodules of `Parser` whose linear and LSTM layers are quantized
+QUANTIZED_MODULES = ('encoder_lstm', 'decoder_lstm', 'att_vec_linear', 'query_vec_to_action_embed',
+                     'query_vec_to_primitive_embed', 'production_readout_linear', 'tgt_token_readout_linear',
+                     'src_pointer_net')
+
+
+class QuantizableLSTMCell(nn.Module):
+    """
+    an `nn.LSTMCell` computed with two linear layers, which dynamic quantization supports on all PyTorch versions
+    """
+
+    def __init__(self, input_size, hidden_size):
+        super(QuantizableLSTMCell, self).__init__()
+        self.input_size = input_size
+        self.hidden_size = hidden_size
+        self.ih = nn.Linear(input_size, 4 * hidden_size)
+        self.hh = nn.Linear(hidden_size, 4 * hidden_size)
+
+    @classmethod
+    def from_lstm_cell(cls, cell):
+        quantizable_cell = cls(cell.input_size, cell.hidden_size)
+        quantizable_cell.ih.weight.data.copy_(cell.weight_ih.data)
+        quantizable_cell.ih.bias.data.copy_(cell.bias_ih.data)
+        quantizable_cell.hh.weight.data.copy_(cell.weight_hh.data)
+        quantizable_cell.hh.bias.data.copy_(cell.bias_hh.data)
+
+        return quantizable_cell
+
+    def forward(self, x, h_tm1):
+        h, c = h_tm1
+        # gates in the order of `nn.LSTMCell`: input, forget, cell, output
+        i, f, g, o = (self.ih(x) + self.hh(h)).chunk(4, 1)
+        c_t = F.sigmoid(f) * c + F.sigmoid(i) * F.tanh(g)
+        h_t = F.sigmoid(o) * F.tanh(c_t)
+
+        return h_t, c_t
+
+
+def _readout_linear(embed, bias):
+    """a linear layer computing the dot products with the rows of an embedding table, plus a bias"""
+    linear = nn.Linear(embed.embedding_dim, embed.num_embeddings)
+    linear.weight.data.copy_(embed.weight.data)
+    linear.bias.data.copy_(bias.data)
+
+    return linear
+
+
+def quantize_parser(parser):
+    """
+    quantize the encoder and decoder LSTMs, the attentional vector layer, the action readouts and the pointer net
+    of a `Parser` in place. The readouts share their weights with the action embeddings, so they get quantized
+    copies of the embedding tables. The parent-feeding decoder LSTM is not quantized
+    """
+    if not hasattr(torch, 'quantization'):
+        raise RuntimeError('dynamic quantization requires PyTorch >= 1.3')
+    if parser.args.cuda:
+        raise ValueError('quantized parsers run on CPU only')
+
+    parser.eval()
+
+    if type(parser.decoder_lstm) is nn.LSTMCell:
+        parser.decoder_lstm = QuantizableLSTMCell.from_lstm_cell(parser.decoder_lstm)
+
+    parser.production_readout_linear = _readout_linear(parser.production_embed, parser.production_readout_b)
+    parser.tgt_token_readout_linear = _readout_linear(parser.primitive_embed, parser.tgt_token_readout_b)
+
+    shared_query_vec_to_embed = getattr(parser, 'query_vec_to_primitive_embed', None) is \
+        getattr(parser, 'query_vec_to_action_embed', None)
+
+    torch.quantization.quantize_dynamic(parser, set(name for name in QUANTIZED_MODULES if hasattr(parser, name)),
+                                        dtype=torch.qint8, inplace=True)
+
+    if shared_query_vec_to_embed and hasattr(parser, 'query_vec_to_action_embed'):
+        # a module shared by two names is only quantized under the first one
+        parser.query_vec_to_primitive_embed = parser.query_vec_to_action_embed
+
+    if parser.args.no_query_vec_to_action_map:
+        parser.production_readout = lambda q: parser.production_readout_linear(q)
+        parser.tgt_token_readout = lambda q: parser.tgt_token_readout_linear(q)
+    else:
+        parser.production_readout = lambda q: parser.production_readout_linear(
+            parser.read_out_act(parser.query_vec_to_action_embed(q)))
+        parser.tgt_token_readout = lambda q: parser.tgt_token_readout_linear(
+            parser.read_out_act(parser.query_vec_to_primitive_embed(q)))
+
+    parser.quantized = True
+
+    return parser
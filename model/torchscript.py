@@ -0,0 +1,249 @@
+# coding=utf-8
+"""
+TorchScript compilation of the encoder and of a fused decoder step of a `Parser` (PyTorch >= 1.4). The compiled
+module is saved next to the checkpoint, and used by `Parser.parse` and `Parser.parse_batch` instead of the eager
+modules. The bookkeeping of the beam search stays in Python.
+"""
+
+from __future__ import print_function
+
+import os
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.nn.utils.rnn import pack_padded_sequence, pad_packed_sequence
+
+from model import nn_utils
+from model.parser import Parser
+
+COMPILED_MODEL_SUFFIX = '.jit'
+
+
+def get_compiled_model_path(model_path):
+    return model_path + COMPILED_MODEL_SUFFIX
+
+
+class TorchScriptParser(nn.Module):
+    """
+    the tensor computations of the beam search of a `Parser`: `forward` encodes a batch of utterances,
+    `init_decoder_state` prepares the decoding of an utterance, and `step` runs the decoder LSTM cell, the attention,
+    the attentional vector, the action readouts and the pointer net of all hypotheses in one call
+    """
+
+    def __init__(self, parser):
+        super(TorchScriptParser, self).__init__()
+        args = parser.args
+
+        self.src_embed = parser.src_embed
+        self.encoder_lstm = parser.encoder_lstm
+        self.decoder_cell_init = parser.decoder_cell_init
+        self.att_src_linear = parser.att_src_linear
+        self.decoder_lstm = parser.decoder_lstm
+        self.att_vec_linear = parser.att_vec_linear
+
+        self.production_embed = parser.production_embed
+        self.primitive_embed = parser.primitive_embed
+        self.production_readout_b = parser.production_readout_b
+        self.tgt_token_readout_b = parser.tgt_token_readout_b
+        if args.no_query_vec_to_action_map:
+            self.query_vec_to_action_embed = nn.Identity()
+            self.query_vec_to_primitive_embed = nn.Identity()
+        else:
+            self.query_vec_to_action_embed = parser.query_vec_to_action_embed
+            self.query_vec_to_primitive_embed = parser.query_vec_to_primitive_embed
+        self.non_linear_readout = not args.no_query_vec_to_action_map and args.readout == 'non_linear'
+
+        # script modules cannot miss the modules of the branches they do not take
+        self.copy = not args.no_copy
+        if self.copy:
+            self.src_pointer_linear = parser.src_pointer_net.src_encoding_linear
+            self.primitive_predictor = parser.primitive_predictor
+        else:
+            self.src_pointer_linear = nn.Identity()
+            self.primitive_predictor = nn.Identity()
+
+    def forward(self, src_sents_var, src_sents_len):
+        """
+        :param src_sents_var: (src_sent_len, batch_size) word ids, of utterances sorted by descending length
+        :param src_sents_len: (batch_size) lengths of the utterances
+        :return: src_encodings (batch_size, src_sent_len, hidden_size), last_state and last_cell (batch_size,
+            hidden_size), as in `Parser.encode`
+        """
+        src_token_embed = self.src_embed(src_sents_var)
+        packed_src_token_embed = pack_padded_sequence(src_token_embed, src_sents_len)
+
+        src_encodings, (last_state, last_cell) = self.encoder_lstm(packed_src_token_embed)
+        src_encodings, _ = pad_packed_sequence(src_encodings)
+        src_encodings = src_encodings.permute(1, 0, 2)
+
+        last_state = torch.cat([last_state[0], last_state[1]], 1)
+        last_cell = torch.cat([last_cell[0], last_cell[1]], 1)
+
+        return src_encodings, last_state, last_cell
+
+    @torch.jit.export
+    def init_decoder_state(self, src_encodings, last_cell):
+        """
+        :param src_encodings: (src_sent_len, hidden_size) encodings of an utterance
+        :param last_cell: (1, hidden_size) last cell state of the encoder
+        :return: the projections of `src_encodings` for the attention and the pointer net, and the initial decoder
+            hidden state and cell state
+        """
+        src_encodings_att_linear = self.att_src_linear(src_encodings)
+        if self.copy:
+            src_encodings_ptr_linear = self.src_pointer_linear(src_encodings)
+        else:
+            src_encodings_ptr_linear = torch.zeros(0)
+
+        h_0 = torch.tanh(self.decoder_cell_init(last_cell))
+
+        return src_encodings_att_linear, src_encodings_ptr_linear, h_0, torch.zeros_like(h_0)
+
+    @torch.jit.export
+    def step(self, x, h_tm1, c_tm1, src_encodings, src_encodings_att_linear, src_encodings_ptr_linear):
+        """
+        a decoder step of `hyp_num` hypotheses of an utterance, see `Parser.beam_step`. Without copying,
+        `primitive_predictor_prob` and `primitive_copy_prob` are empty
+        """
+        h_t, cell_t = self.decoder_lstm(x, (h_tm1, c_tm1))
+
+        # (hyp_num, src_sent_len)
+        att_weight = F.softmax(torch.matmul(h_t, src_encodings_att_linear.t()), dim=-1)
+        ctx_t = torch.matmul(att_weight, src_encodings)
+        att_t = torch.tanh(self.att_vec_linear(torch.cat([h_t, ctx_t], 1)))
+
+        action_query = self.query_vec_to_action_embed(att_t)
+        primitive_query = self.query_vec_to_primitive_embed(att_t)
+        if self.non_linear_readout:
+            action_query = torch.tanh(action_query)
+            primitive_query = torch.tanh(primitive_query)
+
+        apply_rule_log_prob = F.log_softmax(F.linear(action_query, self.production_embed.weight,
+                                                     self.production_readout_b), dim=-1)
+        gen_from_vocab_prob = F.softmax(F.linear(primitive_query, self.primitive_embed.weight,
+                                                 self.tgt_token_readout_b), dim=-1)
+
+        if self.copy:
+            primitive_predictor_prob = F.softmax(self.primitive_predictor(att_t), dim=-1)
+            primitive_copy_prob = F.softmax(torch.matmul(att_t, src_encodings_ptr_linear.t()), dim=-1)
+        else:
+            primitive_predictor_prob = torch.zeros(0)
+            primitive_copy_prob = torch.zeros(0)
+
+        return h_t, cell_t, att_t, apply_rule_log_prob, gen_from_vocab_prob, primitive_predictor_prob, \
+            primitive_copy_prob
+
+
+def compile_parser(parser):
+    """compile the encoder and the decoder step of a float `Parser` with a standard LSTM decoder"""
+    if not hasattr(torch.jit, 'script'):
+        raise RuntimeError('TorchScript compilation requires PyTorch >= 1.4')
+    if type(parser) is not Parser:
+        raise ValueError('only the default parser can be compiled, not [%s]' % type(parser).__name__)
+    if parser.args.lstm != 'lstm':
+        raise ValueError('only parsers with a standard LSTM decoder can be compiled, not [%s]' % parser.args.lstm)
+    if getattr(parser, 'quantized', False):
+        raise ValueError('compile the float parser instead of a quantized one')
+
+    parser.eval()
+
+    return torch.jit.script(TorchScriptParser(parser))
+
+
+def get_verification_sents(vocab):
+    """utterances of source words, on which a compiled parser is compared with the eager one"""
+    words = [vocab.source.id2word[word_id] for word_id in range(4, min(len(vocab.source), 12))] or ['<unk>']
+
+    return [words, words[:1]]
+
+
+def verify_compiled_parser(parser, compiled_parser, src_sents=None, tolerance=1e-4):
+    """
+    compare the encodings and the outputs of a decoder step of `compiled_parser` and of the eager `parser` on
+    `src_sents`, returns the maximal absolute difference and raises `ValueError` if an output differs by more
+    than `tolerance` (also relative to the eager value)
+    """
+    if src_sents is None:
+        src_sents = get_verification_sents(parser.vocab)
+
+    args = parser.args
+    generator = torch.Generator().manual_seed(0)
+    max_diff = 0.
+    with torch.no_grad():
+        for src_sent in src_sents:
+            src_sents_var = nn_utils.to_input_variable([src_sent], parser.vocab.source, cuda=args.cuda,
+                                                       training=False)
+            src_encodings, (last_state, last_cell) = parser.encode(src_sents_var, [len(src_sent)])
+            (h_0, c_0) = parser.init_decoder_state(last_state, last_cell)
+            src_encodings_att_linear = parser.att_src_linear(src_encodings)
+
+            x = torch.randn(3, parser.decoder_lstm.input_size, generator=generator).type_as(src_encodings)
+            h_tm1 = h_0.expand(3, h_0.size(1))
+            c_tm1 = (c_0 + torch.randn(3, c_0.size(1), generator=generator).type_as(c_0)).contiguous()
+            (h_t, cell_t), att_t, apply_rule_log_prob, gen_from_vocab_prob, primitive_predictor_prob, \
+                primitive_copy_prob = parser.beam_step(x, (h_tm1, c_tm1), src_encodings, src_encodings_att_linear)
+            eager_outputs = [src_encodings, last_state, last_cell, h_0, c_0,
+                             h_t, cell_t, att_t, apply_rule_log_prob, gen_from_vocab_prob]
+            if not args.no_copy:
+                eager_outputs += [primitive_predictor_prob, primitive_copy_prob]
+
+            try:
+                compiled_src_encodings, compiled_last_state, compiled_last_cell = compiled_parser(
+                    src_sents_var, torch.LongTensor([len(src_sent)]))
+                compiled_src_encodings_att_linear, compiled_src_encodings_ptr_linear, compiled_h_0, compiled_c_0 = \
+                    compiled_parser.init_decoder_state(compiled_src_encodings[0], compiled_last_cell)
+                compiled_step_outputs = compiled_parser.step(x, h_tm1, c_tm1, compiled_src_encodings[0],
+                                                             compiled_src_encodings_att_linear,
+                                                             compiled_src_encodings_ptr_linear)
+            except (RuntimeError, getattr(torch.jit, 'Error', RuntimeError)) as e:
+                # e.g. the compiled parser has layers of other sizes
+                raise ValueError('the compiled parser fails on the inputs of the parser: %s' % str(e).split('\n')[0])
+            compiled_outputs = [compiled_src_encodings, compiled_last_state, compiled_last_cell, compiled_h_0,
+                                compiled_c_0] + list(compiled_step_outputs[:len(eager_outputs) - 5])
+
+            for eager_output, compiled_output in zip(eager_outputs, compiled_outputs):
+                if eager_output.size() != compiled_output.size():
+                    raise ValueError('the compiled parser outputs a tensor of size %s instead of %s' %
+                                     (tuple(compiled_output.size()), tuple(eager_output.size())))
+
+                diff = (eager_output - compiled_output).abs()
+                max_diff = max(max_diff, diff.max().item())
+                if (diff > tolerance * (1. + eager_output.abs())).any():
+                    raise ValueError('the outputs of the compiled parser differ from the eager ones by up to %g' %
+                                     diff.max().item())
+
+    return max_diff
+
+
+def save_compiled_parser(compiled_parser, model_path):
+    """save a compiled parser next to the checkpoint `model_path`"""
+    compiled_model_path = get_compiled_model_path(model_path)
+    dir_name = os.path.dirname(compiled_model_path)
+    if dir_name and not os.path.exists(dir_name):
+        os.makedirs(dir_name)
+
+    torch.jit.save(compiled_parser, compiled_model_path)
+
+    return compiled_model_path
+
+
+def load_compiled_parser(parser, compiled_model_path, verify=True):
+    """
+    load a compiled parser, which decodes for `parser` once it passes `verify_compiled_parser`.
+    Raises `ValueError` if it does not (e.g. if it was compiled from another checkpoint)
+    """
+    if not hasattr(torch.jit, 'script'):
+        raise RuntimeError('TorchScript compilation requires PyTorch >= 1.4')
+
+    compiled_parser = torch.jit.load(compiled_model_path, map_location='cuda' if parser.args.cuda else 'cpu')
+    # the compiled parser only infers, without recording gradients
+    for param in compiled_parser.parameters():
+        param.requires_grad_(False)
+
+    if verify:
+        verify_compiled_parser(parser, compiled_parser)
+
+    parser.torchscript = compiled_parser
+
+    return compiled_parser
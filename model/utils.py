@@ -64,6 +64,38 @@ def batch_iter(examples, batch_size, shuffle=False):
         yield batch_examples
 
 
+def recombine_scores(scores, mode):
+    """merge the log-scores of hypotheses that are recombined into one, `mode` is either `max` or `logsumexp`"""
+    if mode == 'max':
+        return max(scores)
+    elif mode == 'logsumexp':
+        return float(np.logaddexp.reduce(scores))
+    else:
+        raise ValueError('unknown recombination mode %s' % mode)
+
+
+def add_completed_hypothesis(completed_hypotheses, new_hyp, recombination='none'):
+    """
+    add a finished hypothesis to `completed_hypotheses`. With recombination, a hypothesis whose tree
+    is structurally identical to an already completed one is merged into it instead of taking a new beam slot.
+    Returns whether `new_hyp` was added as a new entry.
+    """
+    if recombination != 'none':
+        digest = new_hyp.tree.structural_digest()
+        for i, hyp in enumerate(completed_hypotheses):
+            if hyp.tree.structural_digest() == digest:
+                merged_score = recombine_scores([hyp.score, new_hyp.score], recombination)
+                if new_hyp.score > hyp.score:
+                    completed_hypotheses[i] = new_hyp
+                completed_hypotheses[i].score = merged_score
+
+                return False
+
+    completed_hypotheses.append(new_hyp)
+
+    return True
+
+
 def get_parser_class(lang):
     if lang in ['python', 'lambda_dcs', 'prolog', 'python3']:
         from model.parser import Parser
@@ -1,7 +1,9 @@
 # coding=utf-8
 from __future__ import print_function
 
+import time
 from itertools import chain
+from collections import OrderedDict
 
 from asdl.hypothesis import Hypothesis
 from asdl.lang.sql.sql_transition_system import WikiSqlSelectColumnAction
@@ -10,6 +12,7 @@ from components.action_info import ActionInfo
 from components.decode_hypothesis import DecodeHypothesis
 from model import nn_utils
 from model.parser import Parser
+from model.utils import add_completed_hypothesis
 
 import torch
 import torch.nn as nn
@@ -248,7 +251,22 @@ class WikiSqlParser(Parser):
 
         return [action_prob_var]   # TODO: supervised attention not implemented yet!
 
-    def parse(self, question, context, beam_size=5):
+    def parse_batch(self, src_sents, contexts=None, beam_size=5, debug=False, stats=None, deadlines=None,
+                    timed_out=None, recombination='none'):
+        # the table header of each question is encoded along with the question, so questions are parsed one by one
+        hypotheses = []
+        for i, (question, context) in enumerate(zip(src_sents, contexts)):
+            begin = time.time()
+            hypotheses.append(self.parse(question, context, beam_size=beam_size,
+                                         deadline=deadlines[i] if deadlines else None, timed_out=timed_out,
+                                         recombination=recombination))
+            if stats is not None:
+                # includes the encoding of the question and its table
+                stats.setdefault('beam_search', []).append(time.time() - begin)
+
+        return hypotheses
+
+    def parse(self, question, context, beam_size=5, deadline=None, timed_out=None, recombination='none'):
         table = context
         args = self.args
         src_sent_var = nn_utils.to_input_variable([question], self.vocab.source,
@@ -269,8 +287,14 @@ class WikiSqlParser(Parser):
         hypotheses = [DecodeHypothesis()]
         hyp_states = [[]]
         completed_hypotheses = []
+        stopped_at_deadline = False
 
         while len(completed_hypotheses) < beam_size and t < self.args.decode_max_time_step:
+            # the search is cancelled between steps
+            if deadline is not None and time.time() > deadline:
+                stopped_at_deadline = True
+                break
+
             hyp_num = len(hypotheses)
 
             # (hyp_num, src_sent_len, hidden_size * 2)
@@ -383,9 +407,8 @@ class WikiSqlParser(Parser):
 
                 for action_type in action_types:
                     if action_type == ApplyRuleAction:
-                        productions = self.transition_system.get_valid_continuating_productions(hyp)
-                        for production in productions:
-                            prod_id = self.grammar.prod2id[production]
+                        prod_ids = self.transition_system.get_valid_continuating_production_ids(hyp)
+                        for prod_id in prod_ids:
                             prod_score = apply_rule_log_prob[hyp_id, prod_id]
                             new_hyp_score = hyp.score + prod_score
 
@@ -456,6 +479,9 @@ class WikiSqlParser(Parser):
 
             if not new_hyp_meta: break
 
+            if recombination != 'none':
+                new_hyp_meta = self.recombine_hyp_meta(new_hyp_meta, hypotheses, recombination)
+
             new_hyp_scores = torch.cat([x['new_hyp_score'] for x in new_hyp_meta])
             top_new_hyp_scores, meta_ids = torch.topk(new_hyp_scores,
                                                       k=min(new_hyp_scores.size(0),
@@ -499,7 +525,7 @@ class WikiSqlParser(Parser):
                 new_hyp.score = new_hyp_score
 
                 if new_hyp.completed:
-                    completed_hypotheses.append(new_hyp)
+                    add_completed_hypothesis(completed_hypotheses, new_hyp, recombination)
                 else:
                     new_hypotheses.append(new_hyp)
                     live_hyp_ids.append(prev_hyp_id)
@@ -513,5 +539,54 @@ class WikiSqlParser(Parser):
             else: break
 
         completed_hypotheses.sort(key=lambda hyp: -hyp.score)
+        if timed_out is not None:
+            timed_out.append(stopped_at_deadline)
 
         return completed_hypotheses
+
+    @staticmethod
+    def get_action_prefix_key(hyp):
+        """
+        the actions of a hypothesis without the source positions of its copied tokens. Hypotheses with the same
+        key have the same decoder state, and only differ in where their earlier values were copied from
+        """
+        action_keys = []
+        for action in hyp.actions:
+            if isinstance(action, ApplyRuleAction):
+                action_keys.append(('apply_rule', action.production))
+            elif isinstance(action, ReduceAction):
+                action_keys.append(('reduce', None))
+            elif isinstance(action, WikiSqlSelectColumnAction):
+                action_keys.append(('sel_col', action.column_id))
+            else:
+                action_keys.append(('gen_token', action.token))
+
+        return tuple(action_keys)
+
+    @staticmethod
+    def recombine_hyp_meta(new_hyp_meta, hypotheses, mode):
+        """
+        merge candidates that reach the same decoder state along different paths, e.g., hypotheses that copied an
+        earlier value from different occurrences of a token, and are now extended with the same action. A copy
+        is only merged with copies from the same source position, since the next copy must follow that position.
+        The merged candidate keeps the path with the highest score.
+        """
+        prefix_keys = [WikiSqlParser.get_action_prefix_key(hyp) for hyp in hypotheses]
+
+        grouped_meta = OrderedDict()
+        for entry in new_hyp_meta:
+            action_key = entry.get('prod_id', entry.get('col_id', entry.get('token')))
+            candidate_key = (prefix_keys[entry['prev_hyp_id']], entry['action_type'], action_key,
+                             entry.get('token_pos'))
+            grouped_meta.setdefault(candidate_key, []).append(entry)
+
+        recombined_meta = []
+        for entries in grouped_meta.values():
+            best_entry = max(entries, key=lambda x: x['new_hyp_score'].data[0])
+            if len(entries) > 1 and mode == 'logsumexp':
+                best_entry = dict(best_entry)
+                best_entry['new_hyp_score'] = nn_utils.log_sum_exp(torch.cat([x['new_hyp_score'] for x in entries]),
+                                                                   keepdim=True)
+            recombined_meta.append(best_entry)
+
+        return recombined_meta
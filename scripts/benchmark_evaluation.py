@@ -0,0 +1,95 @@
+# coding=utf-8
+"""
+benchmark `Evaluator.evaluate_dataset` with 1, 2, 4 and all CPUs worth of workers (`--eval_num_workers`), on the
+statements of Python source files (by default the standard library). The hypotheses of an example are its own
+reference and the references of other examples, and each run is checked against the serial evaluation.
+
+    python scripts/benchmark_evaluation.py [file.py ...]
+"""
+
+from __future__ import print_function
+
+import ast
+import glob
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from asdl.asdl import ASDLGrammar
+from asdl.hypothesis import Hypothesis
+from asdl.lang.py.py_asdl_helper import python_ast_to_asdl_ast
+from asdl.lang.py3.py3_transition_system import Python3TransitionSystem
+from components.dataset import Example
+from components.evaluator import Evaluator
+
+
+def load_examples(files, transition_system):
+    grammar = transition_system.grammar
+    examples = []
+    for file_path in files:
+        try:
+            tree = ast.parse(open(file_path).read())
+        except (SyntaxError, UnicodeDecodeError):
+            continue
+
+        for stmt in tree.body:
+            try:
+                tgt_ast = python_ast_to_asdl_ast(ast.Module(body=[stmt]), grammar)
+                tgt_code = transition_system.ast_to_surface_code(tgt_ast)
+            except Exception:
+                continue
+
+            examples.append(Example(src_sent=[], tgt_actions=None, tgt_code=tgt_code, tgt_ast=tgt_ast,
+                                    idx=len(examples)))
+
+    return examples
+
+
+def get_decode_results(examples, transition_system):
+    decode_results = []
+    for i, example in enumerate(examples):
+        hyp_list = []
+        for j in range(5):
+            hyp = Hypothesis()
+            hyp.tree = examples[(i + j * (i % 3)) % len(examples)].tgt_ast.copy()
+            hyp.code = transition_system.ast_to_surface_code(hyp.tree)
+            hyp_list.append(hyp)
+        decode_results.append(hyp_list)
+
+    return decode_results
+
+
+def main():
+    grammar_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'asdl', 'lang', 'py3',
+                                'py3_asdl.simplified.txt')
+    transition_system = Python3TransitionSystem(ASDLGrammar.from_text(open(grammar_path).read()))
+
+    files = sys.argv[1:] or sorted(glob.glob(os.path.join(os.path.dirname(ast.__file__), '*.py')))
+    examples = load_examples(files, transition_system)
+
+    serial_results = None
+    for num_workers in sorted({1, 2, 4, multiprocessing.cpu_count()}):
+        for example in examples:
+            example.reference_cache = None
+
+        evaluator = Evaluator(transition_system)
+        evaluator.num_workers = num_workers
+        decode_results = get_decode_results(examples, transition_system)
+
+        begin = time.time()
+        eval_results = evaluator.evaluate_dataset(examples, decode_results)
+        elapsed = time.time() - begin
+
+        results = (eval_results, [[hyp.is_correct for hyp in hyp_list] for hyp_list in decode_results])
+        if serial_results is None:
+            serial_results = results
+
+        print('%d examples, %d workers: %.2fs, identical to serial evaluation: %s' % (
+            len(examples), num_workers, elapsed, results == serial_results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+# coding=utf-8
+"""
+Admission control of the parse server: per-model limits of the requests waiting to be decoded, per-request
+deadlines, and a degraded mode that lowers the beam size when the queue of a model is deep.
+"""
+
+from __future__ import division
+
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Overloaded(Exception):
+    """the queue of a model is full, the client should retry after `retry_after` seconds"""
+
+    def __init__(self, model_id, retry_after):
+        super(Overloaded, self).__init__('too many requests queued for [%s]' % model_id)
+        self.retry_after = retry_after
+
+
+class DecodeTimeout(Exception):
+    pass
+
+
+class AdmissionController(object):
+    """
+    Args:
+        configs: dict of model id to model config, whose `max_queue_size` and `max_concurrency` override the
+            server defaults for the model
+        max_queue_size: number of utterances that may wait to be decoded by a model (0 for no limit)
+        max_concurrency: number of batches a model decodes at a time
+        request_timeout: seconds after which the decoding of a request is cancelled (0 for no limit), requests
+            may ask for a shorter timeout
+        retry_after: seconds a rejected client is asked to wait
+        degraded_queue_depth: queue depth from which utterances are decoded with at most `degraded_beam_size`
+            (0 to disable)
+    """
+
+    def __init__(self, configs, max_queue_size=0, max_concurrency=1, request_timeout=0., retry_after=1.,
+                 degraded_queue_depth=0, degraded_beam_size=1):
+        self.configs = configs
+        self.max_queue_size = max_queue_size
+        self.max_concurrency = max_concurrency
+        self.request_timeout = request_timeout
+        self.retry_after = retry_after
+        self.degraded_queue_depth = degraded_queue_depth
+        self.degraded_beam_size = degraded_beam_size
+
+    def get_max_queue_size(self, model_id):
+        return self.configs[model_id].get('max_queue_size', self.max_queue_size)
+
+    def get_max_concurrency(self, model_id):
+        return self.configs[model_id].get('max_concurrency', self.max_concurrency)
+
+    def check_room(self, model_id, queue_size, num_utterances=1):
+        max_queue_size = self.get_max_queue_size(model_id)
+        if max_queue_size and queue_size + num_utterances > max_queue_size:
+            raise Overloaded(model_id, self.retry_after)
+
+    def get_beam_size(self, model_id, queue_size, beam_size=None):
+        """the beam size of an utterance admitted when `queue_size` utterances are waiting, and if it was lowered"""
+        beam_size = beam_size or self.configs[model_id].get('beam_size', 5)
+        if self.degraded_queue_depth and queue_size >= self.degraded_queue_depth and \
+                beam_size > self.degraded_beam_size:
+            return self.degraded_beam_size, True
+
+        return beam_size, False
+
+    def get_timeout(self, timeout=None):
+        """the timeout in seconds of a request that asks for `timeout`, None for no timeout"""
+        if timeout and self.request_timeout:
+            return min(timeout, self.request_timeout)
+
+        return timeout or self.request_timeout or None
+
+    def get_deadline(self, timeout=None):
+        timeout = self.get_timeout(timeout)
+
+        return time.time() + timeout if timeout else None
+
+    def get_retry_after_header(self, e):
+        return {'Retry-After': str(int(math.ceil(e.retry_after)))}
+
+
+class ConcurrencyLimiter(object):
+    """
+    admission of the requests of a threaded server, which decode in the request threads: at most `max_concurrency`
+    requests of a model decode at a time, and at most `max_queue_size` wait for their turn
+    """
+
+    def __init__(self, admission):
+        self.admission = admission
+        self.condition = threading.Condition()
+        # model id -> number of requests waiting / decoding
+        self.waiting = {model_id: 0 for model_id in admission.configs}
+        self.running = {model_id: 0 for model_id in admission.configs}
+
+    @contextmanager
+    def slot(self, model_id, deadline=None):
+        """
+        wait for a decoding slot of the model, raises `Overloaded` if too many requests are waiting and
+        `DecodeTimeout` at the deadline. Yields the number of requests that were waiting when the request arrived
+        """
+        with self.condition:
+            queue_size = self.waiting[model_id]
+            self.admission.check_room(model_id, queue_size)
+
+            self.waiting[model_id] += 1
+            try:
+                while self.running[model_id] >= self.admission.get_max_concurrency(model_id):
+                    timeout = deadline - time.time() if deadline else None
+                    if timeout is not None and timeout <= 0:
+                        raise DecodeTimeout('parsing timed out')
+                    self.condition.wait(timeout)
+            finally:
+                self.waiting[model_id] -= 1
+            self.running[model_id] += 1
+
+        try:
+            yield queue_size
+        finally:
+            with self.condition:
+                self.running[model_id] -= 1
+                self.condition.notify_all()
@@ -2,13 +2,18 @@ from __future__ import print_function
 import six
 import argparse
 import sys
-from flask import Flask, url_for, jsonify, render_template
+import time
+from flask import Flask, url_for, jsonify, render_template, abort, request, Response
 import json
 
-from components.standalone_parser import StandaloneParser
+from server.admission import AdmissionController, ConcurrencyLimiter, DecodeTimeout, Overloaded
+from server.metrics import CONTENT_TYPE, ServingMetrics
+from server.model_registry import ModelRegistry
 
 app = Flask(__name__)
-parsers = dict()
+registry = None
+metrics = None
+limiter = None
 
 
 def init_arg_parser():
@@ -19,6 +24,53 @@ def init_arg_parser():
     arg_parser.add_argument('--config_file', type=str, required=True,
                             help='Config file that specifies model to load, see online doc for an example')
     arg_parser.add_argument('--port', type=int, required=False, default=8081)
+    arg_parser.add_argument('--verbose', action='store_true', default=False,
+                            help='Print the processed utterance and hypotheses of each request')
+
+    #### Model loading ####
+    arg_parser.add_argument('--preload', action='store_true', default=False,
+                            help='Load all models at startup, instead of loading each model at its first request')
+    arg_parser.add_argument('--model_memory_budget_mb', type=float, default=0.,
+                            help='Evict the least recently used models when the parameters of the loaded models '
+                                 'exceed this many MB (0 for no limit)')
+    arg_parser.add_argument('--model_idle_timeout', type=float, default=0.,
+                            help='Evict models not used for this many seconds (0 to keep them loaded)')
+    arg_parser.add_argument('--watch_models', type=float, default=0.,
+                            help='Check the checkpoints of the loaded models every this many seconds, and swap in '
+                                 'the ones that were overwritten (0 to disable)')
+
+    #### Admission control ####
+    arg_parser.add_argument('--max_queue_size', type=int, default=0,
+                            help='Maximum number of utterances waiting to be decoded by a model, further requests are '
+                                 'rejected with 503 (0 for no limit, `max_queue_size` in a model config overrides it)')
+    arg_parser.add_argument('--max_concurrency', type=int, default=0,
+                            help='Number of requests (batches in the production mode) a model decodes at a time '
+                                 '(0 for one, or one per worker with --num_workers, `max_concurrency` in a model '
+                                 'config overrides it)')
+    arg_parser.add_argument('--request_timeout', type=float, default=0.,
+                            help='Cancel the decoding of a request after this many seconds, and return 504 '
+                                 '(0 for no limit, requests may ask for a shorter `timeout`)')
+    arg_parser.add_argument('--retry_after', type=float, default=1.,
+                            help='Seconds a client whose request is rejected is asked to wait (Retry-After)')
+    arg_parser.add_argument('--degraded_queue_depth', type=int, default=0,
+                            help='Decode with at most --degraded_beam_size when this many utterances are waiting '
+                                 'for a model (0 to disable)')
+    arg_parser.add_argument('--degraded_beam_size', type=int, default=1,
+                            help='Beam size of the utterances decoded in the degraded mode')
+
+    #### Production serving ####
+    arg_parser.add_argument('--production', action='store_true', default=False,
+                            help='Serve with an asyncio front end that decodes concurrent requests in micro-batches, '
+                                 'instead of the Flask development server (Python 3 only)')
+    arg_parser.add_argument('--max_batch_size', type=int, default=16,
+                            help='Maximum number of utterances of the same parser decoded in one batch')
+    arg_parser.add_argument('--max_batch_wait_ms', type=float, default=5.,
+                            help='Maximum time a request waits for other requests to join its batch')
+    arg_parser.add_argument('--num_workers', type=int, default=0,
+                            help='Number of pre-forked decoding processes sharing one copy of the model weights '
+                                 '(0 to decode in the server process)')
+    arg_parser.add_argument('--worker_threads', type=int, default=1,
+                            help='Number of PyTorch threads of each decoding process')
 
     return arg_parser
 
@@ -30,21 +82,46 @@ def default():
 
 @app.route('/parse/<dataset>/<utterance>', methods=['GET'])
 def parse(utterance, dataset):
-
-    parser = parsers[dataset]
+    if dataset not in registry:
+        abort(404)
 
     if six.PY2:
         utterance = utterance.encode('utf-8', 'ignore')
 
-    hypotheses = parser.parse(utterance, debug=True)
+    begin = time.time()
+    deadline = limiter.admission.get_deadline(request.args.get('timeout', type=float))
+    headers = dict()
+    try:
+        with limiter.slot(dataset, deadline) as queue_size:
+            beam_size, degraded = limiter.admission.get_beam_size(dataset, queue_size)
+            if degraded:
+                metrics.degraded_requests.inc(dataset=dataset)
+                headers['X-Degraded-Beam-Size'] = str(beam_size)
+
+            registry.evict_idle()
+            stats = dict()
+            timed_out = []
+            with registry.use(dataset) as parser:
+                hypotheses = parser.parse(utterance, debug=True, beam_size=beam_size, stats=stats, deadline=deadline,
+                                          timed_out=timed_out)
+            metrics.observe_parse(dataset, stats)
+        if timed_out[0]:
+            # the beam search was cancelled, its hypotheses are incomplete
+            raise DecodeTimeout('parsing timed out')
+    except Overloaded as e:
+        metrics.observe_request(dataset, 503, time.time() - begin)
+        return jsonify(error=str(e)), 503, limiter.admission.get_retry_after_header(e)
+    except DecodeTimeout as e:
+        metrics.observe_request(dataset, 504, time.time() - begin)
+        return jsonify(error=str(e)), 504
+    except Exception:
+        metrics.observe_request(dataset, 500, time.time() - begin)
+        raise
 
     responses = dict()
     responses['hypotheses'] = []
 
     for hyp_id, hyp in enumerate(hypotheses):
-        print('------------------ Hypothesis %d ------------------' % hyp_id)
-        print(hyp.code)
-        print(hyp.tree.to_string())
         # print('Actions:')
         # for action_t in hyp.action_infos:
         #     print(action_t)
@@ -59,20 +136,67 @@ def parse(utterance, dataset):
 
         responses['hypotheses'].append(hyp_entry)
 
-    return jsonify(responses)
+    metrics.observe_request(dataset, 200, time.time() - begin)
+
+    return jsonify(responses), 200, headers
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), content_type=CONTENT_TYPE)
+
+
+@app.route('/models/<dataset>/swap', methods=['POST'])
+def swap(dataset):
+    if dataset not in registry:
+        abort(404)
+
+    options = request.get_json(force=True, silent=True) or dict()
+    try:
+        latencies = registry.swap(dataset, model_path=options.get('model_path'),
+                                  warmup_utterances=options.get('warmup_utterances'))
+    except RuntimeError as e:
+        return jsonify(error=str(e)), 409
+
+    return jsonify(latencies)
 
 
 if __name__ == '__main__':
     args = init_arg_parser().parse_args()
     config_dict = json.load(open(args.config_file))
 
-    for parser_id, config in config_dict.items():
-        parser = StandaloneParser(parser_name=config['parser'],
-                                  model_path=config['model_path'],
-                                  example_processor_name=config['example_processor'],
-                                  beam_size=config['beam_size'],
-                                  cuda=args.cuda)
-
-        parsers[parser_id] = parser
-
-    app.run(host='0.0.0.0', port=args.port, debug=True)
+    registry = ModelRegistry(config_dict, cuda=args.cuda, verbose=args.verbose,
+                             max_memory=int(args.model_memory_budget_mb * 1024 * 1024),
+                             idle_timeout=args.model_idle_timeout)
+    if args.preload:
+        registry.preload()
+    if args.watch_models:
+        assert not (args.production and args.num_workers > 0), 'models cannot be swapped in the pre-forked workers'
+        registry.watch_model_files(args.watch_models)
+
+    max_concurrency = args.max_concurrency or (args.num_workers if args.production and args.num_workers > 0 else 1)
+    admission = AdmissionController(config_dict, max_queue_size=args.max_queue_size, max_concurrency=max_concurrency,
+                                    request_timeout=args.request_timeout, retry_after=args.retry_after,
+                                    degraded_queue_depth=args.degraded_queue_depth,
+                                    degraded_beam_size=args.degraded_beam_size)
+
+    if args.production:
+        from server.production import ParsingService, parse_jobs_with_stats
+
+        worker_pool = None
+        if args.num_workers > 0:
+            from server.workers import PreforkWorkerPool
+
+            assert not args.cuda, 'CUDA models cannot be shared with forked workers'
+            # models shared by forked workers are loaded before forking, and stay loaded
+            worker_pool = PreforkWorkerPool(registry.preload(), parse_jobs_with_stats, num_workers=args.num_workers,
+                                            num_threads=args.worker_threads)
+
+        service = ParsingService(registry, max_batch_size=args.max_batch_size,
+                                 max_batch_wait=args.max_batch_wait_ms / 1000., worker_pool=worker_pool,
+                                 admission=admission)
+        service.serve(port=args.port)
+    else:
+        limiter = ConcurrencyLimiter(admission)
+        metrics = ServingMetrics(registry, queue_depth=lambda: dict(limiter.waiting))
+        app.run(host='0.0.0.0', port=args.port, debug=True)
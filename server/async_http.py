@@ -0,0 +1,197 @@
+# coding=utf-8
+"""
+A small HTTP/1.1 server on asyncio streams for the JSON API of the production serving mode (Python 3 only).
+It supports keep-alive connections, request bodies with Content-Length and chunked streaming responses.
+"""
+
+from __future__ import print_function
+
+import asyncio
+import json
+import re
+import sys
+import traceback
+from urllib.parse import parse_qs, unquote, urlsplit
+
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 409: 'Conflict',
+                413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable',
+                504: 'Gateway Timeout'}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message=None, headers=None):
+        super(HTTPError, self).__init__(message or HTTP_REASONS.get(status, ''))
+        self.status = status
+        self.message = message or HTTP_REASONS.get(status, '')
+        self.headers = headers or dict()
+
+
+class Request(object):
+    def __init__(self, method, target, headers, body, version='HTTP/1.1'):
+        self.method = method
+        self.version = version
+        url = urlsplit(target)
+        self.path = url.path
+        self.query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        # header names are lower-cased
+        self.headers = headers
+        self.body = body
+        # URL-decoded values of the `<name>` parts of the route
+        self.match_info = dict()
+
+    def json(self):
+        try:
+            return json.loads(self.body.decode('utf-8'))
+        except ValueError:
+            raise HTTPError(400, 'request body is not valid JSON')
+
+
+class Response(object):
+    def __init__(self, body=b'', status=200, content_type='text/plain; charset=utf-8', headers=None):
+        self.body = body.encode('utf-8') if isinstance(body, str) else body
+        self.status = status
+        self.content_type = content_type
+        self.headers = headers or dict()
+
+
+class StreamResponse(object):
+    """a response sent with chunked transfer encoding, whose body is an async iterator of bytes"""
+
+    def __init__(self, chunks, status=200, content_type='application/x-ndjson', headers=None):
+        self.chunks = chunks
+        self.status = status
+        self.content_type = content_type
+        self.headers = headers or dict()
+
+
+def json_response(obj, status=200, headers=None):
+    return Response(json.dumps(obj), status=status, content_type='application/json', headers=headers)
+
+
+class HTTPServer(object):
+    def __init__(self, max_body_size=16 * 1024 * 1024):
+        self.max_body_size = max_body_size
+        # list of (method, compiled path pattern, handler)
+        self.routes = []
+
+    def add_route(self, method, path, handler):
+        """
+        register an async handler of a `Request`. `path` is a Flask-style rule, e.g. `/parse/<dataset>/<utterance>`,
+        where each `<name>` matches a path segment
+        """
+        pattern = re.sub(r'<(\w+)>', r'(?P<\1>[^/]+)', path)
+        self.routes.append((method, re.compile('^%s$' % pattern), handler))
+
+    def route(self, path, methods=('GET',)):
+        def decorator(handler):
+            for method in methods:
+                self.add_route(method, path, handler)
+            return handler
+
+        return decorator
+
+    async def dispatch(self, request):
+        allowed_methods = []
+        for method, pattern, handler in self.routes:
+            m = pattern.match(request.path)
+            if m is None:
+                continue
+            if method != request.method:
+                allowed_methods.append(method)
+                continue
+
+            request.match_info = {name: unquote(value) for name, value in m.groupdict().items()}
+            try:
+                return await handler(request)
+            except HTTPError as e:
+                return json_response({'error': e.message}, status=e.status, headers=e.headers)
+            except Exception:
+                traceback.print_exc(file=sys.stderr)
+                return json_response({'error': HTTP_REASONS[500]}, status=500)
+
+        if allowed_methods:
+            return json_response({'error': HTTP_REASONS[405]}, status=405, headers={'Allow': ', '.join(allowed_methods)})
+
+        return json_response({'error': HTTP_REASONS[404]}, status=404)
+
+    async def read_request(self, reader):
+        """the next request on the connection, None if the client closed it"""
+        request_line = await reader.readline()
+        if not request_line.strip():
+            return None
+
+        try:
+            method, target, version = request_line.decode('latin-1').split()
+        except ValueError:
+            raise HTTPError(400, 'malformed request line')
+
+        headers = dict()
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            content_length = int(headers.get('content-length', 0) or 0)
+        except ValueError:
+            raise HTTPError(400, 'malformed Content-Length')
+        if content_length > self.max_body_size:
+            raise HTTPError(413)
+        body = await reader.readexactly(content_length) if content_length else b''
+
+        return Request(method.upper(), target, headers, body, version=version)
+
+    async def write_response(self, writer, response, keep_alive):
+        head = ['HTTP/1.1 %d %s' % (response.status, HTTP_REASONS.get(response.status, '')),
+                'Content-Type: %s' % response.content_type,
+                'Connection: %s' % ('keep-alive' if keep_alive else 'close')]
+        if isinstance(response, StreamResponse):
+            head.append('Transfer-Encoding: chunked')
+        else:
+            head.append('Content-Length: %d' % len(response.body))
+        head.extend('%s: %s' % (name, value) for name, value in response.headers.items())
+
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+
+        if isinstance(response, StreamResponse):
+            async for chunk in response.chunks:
+                if chunk:
+                    writer.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                    await writer.drain()
+            writer.write(b'0\r\n\r\n')
+        else:
+            writer.write(response.body)
+
+        await writer.drain()
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await self.read_request(reader)
+                except HTTPError as e:
+                    await self.write_response(writer, json_response({'error': e.message}, status=e.status),
+                                              keep_alive=False)
+                    break
+
+                if request is None:
+                    break
+
+                connection = request.headers.get('connection', '').lower()
+                keep_alive = connection == 'keep-alive' if request.version == 'HTTP/1.0' else connection != 'close'
+
+                response = await self.dispatch(request)
+                await self.write_response(writer, response, keep_alive)
+
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def start(self, host, port, **kwargs):
+        """start listening, returns the coroutine of `asyncio.start_server`"""
+        return asyncio.start_server(self.handle_connection, host, port, **kwargs)
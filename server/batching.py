@@ -0,0 +1,104 @@
+# coding=utf-8
+"""
+Dynamic micro-batching of concurrent requests on an asyncio event loop (Python 3 only).
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+
+class MicroBatcher(object):
+    """
+    collects concurrent requests into batches of at most `max_batch_size` items, waiting at most `max_wait` seconds
+    after the first item of a batch, and runs `process_batch(items)` on a worker thread, which returns one result
+    (or exception) per item. At most `max_concurrent_batches` batches are processed at a time, so requests that arrive while all
+    of them are busy form the next batch
+    """
+
+    def __init__(self, process_batch, max_batch_size=16, max_wait=0.005, max_concurrent_batches=1):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_concurrent_batches = max_concurrent_batches
+        # worker threads keep decoding off the event loop
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrent_batches)
+
+        self.queue = None
+        self._task = None
+
+    def start(self):
+        loop = asyncio.get_event_loop()
+        self.queue = asyncio.Queue()
+        self._task = loop.create_task(self._run())
+
+    def submit_nowait(self, item):
+        """queue an item for the next batch, returns the future of its result"""
+        future = asyncio.get_event_loop().create_future()
+        self.queue.put_nowait((item, future))
+
+        return future
+
+    async def submit(self, item):
+        """process an item in the next batch and return its result"""
+        return await self.submit_nowait(item)
+
+    async def _next_batch(self):
+        batch = [await self.queue.get()]
+
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _process(self, batch):
+        loop = asyncio.get_event_loop()
+        try:
+            results = await loop.run_in_executor(self.executor, self.process_batch, [item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        semaphore = asyncio.Semaphore(self.max_concurrent_batches)
+        while True:
+            await semaphore.acquire()
+            batch = await self._next_batch()
+            # requests whose clients went away are not decoded
+            batch = [(item, future) for item, future in batch if not future.done()]
+            if not batch:
+                semaphore.release()
+                continue
+
+            task = loop.create_task(self._process(batch))
+            task.add_done_callback(lambda _: semaphore.release())
+
+    @property
+    def queue_size(self):
+        return self.queue.qsize() if self.queue is not None else 0
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,235 @@
+# coding=utf-8
+"""
+Serving metrics in the Prometheus text exposition format, collected in process without any external service.
+"""
+
+from __future__ import division
+
+import threading
+import time
+from collections import OrderedDict
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10.)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+# stages of `StandaloneParser.parse_batch`, in the order they run
+PARSE_STAGES = ('pre_process_utterance', 'encode', 'beam_search', 'is_valid_hypothesis', 'post_process_hypothesis')
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"'))
+                             for name, value in labels)
+
+
+class Metric(object):
+    """a metric, whose values are updated, or read from `callback()` (a dict of label values to value) when rendered"""
+    type = None
+
+    def __init__(self, name, documentation, label_names=(), callback=None):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.callback = callback
+        self.lock = threading.Lock()
+        # tuple of label values -> value
+        self.values = OrderedDict()
+
+    def label_values(self, labels):
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def samples(self):
+        """list of (name, labels as (name, value) pairs, value)"""
+        if self.callback is not None:
+            values = self.callback()
+            with self.lock:
+                self.values = OrderedDict((tuple(str(v) for v in key), value) for key, value in values.items())
+
+        with self.lock:
+            return [(self.name, list(zip(self.label_names, label_values)), value)
+                    for label_values, value in self.values.items()]
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.documentation), '# TYPE %s %s' % (self.name, self.type)]
+        lines.extend('%s%s %s' % (name, format_labels(labels), format_value(value))
+                     for name, labels, value in self.samples())
+
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.label_values(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.label_values(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self.label_values(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, label_names=(), buckets=LATENCY_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self.label_values(labels)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                # bucket counts (not cumulative), sum, count
+                entry = self.values[key] = [[0] * len(self.buckets), 0., 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for label_values, (bucket_counts, value_sum, count) in self.values.items():
+                labels = list(zip(self.label_names, label_values))
+                cumulative_count = 0
+                for bound, bucket_count in zip(self.buckets, bucket_counts):
+                    cumulative_count += bucket_count
+                    samples.append((self.name + '_bucket', labels + [('le', format_value(float(bound)))],
+                                    cumulative_count))
+                samples.append((self.name + '_sum', labels, value_sum))
+                samples.append((self.name + '_count', labels, count))
+
+        return samples
+
+
+class MetricsRegistry(object):
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+
+        return '\n'.join(lines) + '\n'
+
+
+class ServingMetrics(object):
+    """
+    metrics of the parse server, labelled by dataset (the model id). `queue_depth` is a callback returning a dict
+    of dataset to the number of requests waiting to be decoded, and `model_registry` the `ModelRegistry` whose
+    cache hits and misses are reported
+    """
+
+    def __init__(self, model_registry=None, queue_depth=None):
+        self.registry = MetricsRegistry()
+        self.model_registry = model_registry
+        self.start_time = time.time()
+
+        self.requests = self.registry.register(Counter(
+            'tranx_requests_total', 'Parse requests, by dataset and HTTP status', ('dataset', 'status')))
+        self.request_latency = self.registry.register(Histogram(
+            'tranx_request_latency_seconds', 'Latency of parse requests', ('dataset',)))
+        self.degraded_requests = self.registry.register(Counter(
+            'tranx_degraded_requests_total', 'Requests decoded with a lower beam size, as the queue was deep',
+            ('dataset',)))
+        self.utterances = self.registry.register(Counter(
+            'tranx_utterances_total', 'Parsed utterances', ('dataset',)))
+        self.batch_size = self.registry.register(Histogram(
+            'tranx_batch_size', 'Number of utterances decoded in a batch', ('dataset',), buckets=COUNT_BUCKETS))
+        self.stage_latency = self.registry.register(Histogram(
+            'tranx_stage_latency_seconds', 'Latency of a stage of parsing an utterance (encode: of a batch)',
+            ('dataset', 'stage')))
+        self.beam_steps = self.registry.register(Histogram(
+            'tranx_beam_steps', 'Decoding steps of the beam search of an utterance', ('dataset',),
+            buckets=COUNT_BUCKETS))
+        self.hypotheses_expanded = self.registry.register(Histogram(
+            'tranx_hypotheses_expanded', 'Hypotheses expanded by the beam search of an utterance', ('dataset',),
+            buckets=COUNT_BUCKETS))
+        self.queue_depth = self.registry.register(Gauge(
+            'tranx_queue_depth', 'Requests waiting to be decoded', ('dataset',),
+            callback=(lambda: {(dataset,): depth for dataset, depth in queue_depth().items()}) if queue_depth else None))
+
+        self.registry.register(Gauge('tranx_uptime_seconds', 'Time since the server started',
+                                     callback=lambda: {(): time.time() - self.start_time}))
+        if model_registry is not None:
+            self.registry.register(Counter(
+                'tranx_model_cache_hits_total', 'Requests of a model that was already loaded', ('dataset',),
+                callback=lambda: self.get_model_stats('num_hits')))
+            self.registry.register(Counter(
+                'tranx_model_cache_misses_total', 'Requests of a model that was not loaded', ('dataset',),
+                callback=lambda: self.get_model_stats('num_misses')))
+            self.registry.register(Gauge(
+                'tranx_model_cache_hit_rate', 'Fraction of the requests of a model that found it loaded', ('dataset',),
+                callback=self.get_model_hit_rates))
+            self.registry.register(Gauge(
+                'tranx_model_loaded', 'Whether a model is loaded', ('dataset',),
+                callback=lambda: self.get_model_stats('loaded')))
+            self.registry.register(Gauge(
+                'tranx_model_memory_bytes', 'Memory of the parameters of a loaded model', ('dataset',),
+                callback=lambda: self.get_model_stats('memory')))
+
+    def get_model_stats(self, key):
+        return {(dataset,): int(stats[key]) for dataset, stats in self.model_registry.get_stats()['models'].items()}
+
+    def get_model_hit_rates(self):
+        hit_rates = dict()
+        for dataset, stats in self.model_registry.get_stats()['models'].items():
+            num_requests = stats['num_hits'] + stats['num_misses']
+            hit_rates[(dataset,)] = stats['num_hits'] / num_requests if num_requests else 0.
+
+        return hit_rates
+
+    def observe_request(self, dataset, status, latency):
+        self.requests.inc(dataset=dataset, status=status)
+        self.request_latency.observe(latency, dataset=dataset)
+
+    def observe_parse(self, dataset, stats):
+        """record the decoding statistics of a batch, filled by `StandaloneParser.parse_batch`"""
+        num_utterances = len(stats.get('pre_process_utterance', []))
+        self.utterances.inc(num_utterances, dataset=dataset)
+        if num_utterances:
+            self.batch_size.observe(num_utterances, dataset=dataset)
+
+        for stage in PARSE_STAGES:
+            for latency in stats.get(stage, []):
+                self.stage_latency.observe(latency, dataset=dataset, stage=stage)
+        for num_steps in stats.get('beam_steps', []):
+            self.beam_steps.observe(num_steps, dataset=dataset)
+        for num_expanded in stats.get('hypotheses_expanded', []):
+            self.hypotheses_expanded.observe(num_expanded, dataset=dataset)
+
+    def render(self):
+        return self.registry.render()
@@ -0,0 +1,344 @@
+# coding=utf-8
+from __future__ import print_function
+
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from components.standalone_parser import StandaloneParser
+
+
+def get_parser_memory(parser):
+    """bytes of the parameters and buffers of the model of a `StandaloneParser`"""
+    tensors = list(parser.parser.parameters()) + list(parser.parser.buffers())
+
+    return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+
+
+def get_file_mtime(file_path):
+    try:
+        return os.path.getmtime(file_path)
+    except OSError:
+        return None
+
+
+class LoadedModel(object):
+    def __init__(self, parser, memory, load_time, model_path=None):
+        self.parser = parser
+        self.memory = memory
+        self.load_time = load_time
+        self.model_path = model_path
+        # modification time of the checkpoint when it was loaded
+        self.model_mtime = get_file_mtime(model_path) if model_path else None
+        self.last_used = time.time()
+        # number of requests using the parser, which is not evicted while in use
+        self.in_use = 0
+
+
+class LoadingModel(object):
+    """a model being loaded by one thread, which the other requests of the model wait for"""
+
+    def __init__(self, generation=0):
+        self.done = threading.Event()
+        self.model = None
+        self.error = None
+        # the generation of the model when the load started, see `ModelRegistry.generations`
+        self.generation = generation
+        # whether the model was swapped during the load, so that the loaded model is discarded
+        self.stale = False
+
+
+class ModelRegistry(object):
+    """
+    loads the `StandaloneParser` of a model the first time it is requested, and keeps the loaded models in LRU order
+    under a budget of `max_memory` bytes of model parameters. Models that are not used for `idle_timeout` seconds
+    are evicted by `evict_idle`. Concurrent first requests of a model share a single load.
+
+    `swap` replaces a model with a new checkpoint without downtime: the new model is loaded and warmed up while
+    requests keep using the old one, then swapped in atomically. Requests already using the old model finish on it
+
+    Args:
+        configs: dict of model id to a config with `parser`, `model_path`, `example_processor` and `beam_size`, and
+            optionally `beam_recombination` (see `--beam_recombination`)
+    """
+
+    def __init__(self, configs, cuda=False, verbose=False, max_memory=None, idle_timeout=None):
+        self.configs = configs
+        self.cuda = cuda
+        self.verbose = verbose
+        self.max_memory = max_memory
+        self.idle_timeout = idle_timeout
+
+        self.lock = threading.Lock()
+        # model id -> `LoadedModel`, least recently used first
+        self.models = OrderedDict()
+        # model id -> `LoadingModel`
+        self.loading = dict()
+        # ids of the models being swapped
+        self.swapping = set()
+        # model id -> number of swaps of the model, a load started before a swap does not install its model
+        self.generations = dict()
+
+        self.created_time = time.time()
+        # model id -> list of load latencies in seconds
+        self.load_latencies = dict()
+        self.num_hits = 0
+        # model id -> number of requests that found the model loaded / not loaded
+        self.model_hits = dict()
+        self.model_misses = dict()
+        self.num_loads = 0
+        self.num_evictions = 0
+        # model id -> list of dicts of the latencies of the swaps of the model
+        self.swap_latencies = dict()
+        self._watcher = None
+
+    def __contains__(self, model_id):
+        return model_id in self.configs
+
+    def load_model(self, model_id, config=None):
+        config = config or self.configs[model_id]
+        begin = time.time()
+        parser = StandaloneParser(parser_name=config['parser'],
+                                  model_path=config['model_path'],
+                                  example_processor_name=config['example_processor'],
+                                  beam_size=config['beam_size'],
+                                  cuda=self.cuda,
+                                  verbose=self.verbose,
+                                  torchscript=config.get('torchscript', True),
+                                  grammar=config.get('grammar'),
+                                  recombination=config.get('beam_recombination', 'none'))
+        load_time = time.time() - begin
+        print('loaded model [%s] in %.2fs' % (model_id, load_time), file=sys.stderr)
+
+        return LoadedModel(parser, get_parser_memory(parser), load_time, model_path=config['model_path'])
+
+    def _get_model(self, model_id):
+        """the loaded model, marked as in use"""
+        if model_id not in self.configs:
+            raise KeyError(model_id)
+
+        while True:
+            with self.lock:
+                model = self.models.get(model_id)
+                if model is not None:
+                    self.num_hits += 1
+                    self.model_hits[model_id] = self.model_hits.get(model_id, 0) + 1
+                    self.models[model_id] = self.models.pop(model_id)
+                    model.in_use += 1
+                    return model
+
+                self.model_misses[model_id] = self.model_misses.get(model_id, 0) + 1
+                loading = self.loading.get(model_id)
+                is_loader = loading is None
+                if is_loader:
+                    loading = self.loading[model_id] = LoadingModel(self.generations.get(model_id, 0))
+
+            if is_loader:
+                try:
+                    loading.model = self.load_model(model_id)
+                except Exception as e:
+                    loading.error = e
+
+                with self.lock:
+                    del self.loading[model_id]
+                    if loading.model is not None:
+                        if self.generations.get(model_id, 0) != loading.generation:
+                            # loaded with the config from before a swap, the swapped model is used instead
+                            loading.model = None
+                            loading.stale = True
+                        else:
+                            self.num_loads += 1
+                            self.load_latencies.setdefault(model_id, []).append(loading.model.load_time)
+                            self.models[model_id] = loading.model
+                            loading.model.in_use += 1
+                            self._evict_over_budget()
+                loading.done.set()
+
+                if loading.error is not None:
+                    raise loading.error
+                if loading.stale:
+                    continue
+
+                return loading.model
+
+            loading.done.wait()
+            if loading.error is not None:
+                raise loading.error
+            if loading.stale:
+                continue
+
+            with self.lock:
+                loading.model.in_use += 1
+
+            return loading.model
+
+    @contextmanager
+    def use(self, model_id):
+        """the parser of a model, which is not evicted until the context exits"""
+        model = self._get_model(model_id)
+        try:
+            yield model.parser
+        finally:
+            with self.lock:
+                model.in_use -= 1
+                model.last_used = time.time()
+
+    def get(self, model_id):
+        with self.use(model_id) as parser:
+            return parser
+
+    def warm_up(self, parser, utterances):
+        """parse the warm-up utterances with a new parser, returns the time it took"""
+        begin = time.time()
+        for utterance in utterances:
+            parser.parse(utterance)
+
+        return time.time() - begin
+
+    def swap(self, model_id, model_path=None, warmup_utterances=None):
+        """
+        load the checkpoint at `model_path` (by default the current checkpoint of the model, e.g. after it was
+        overwritten), warm it up with `warmup_utterances` (by default the `warmup_utterances` of the model config)
+        and swap it in. Returns the latencies of the swap in seconds
+        """
+        if model_id not in self.configs:
+            raise KeyError(model_id)
+
+        with self.lock:
+            if model_id in self.swapping:
+                raise RuntimeError('model [%s] is already being swapped' % model_id)
+            self.swapping.add(model_id)
+
+        try:
+            begin = time.time()
+            config = dict(self.configs[model_id])
+            if model_path:
+                config['model_path'] = model_path
+            if warmup_utterances is None:
+                warmup_utterances = config.get('warmup_utterances', [])
+
+            model = self.load_model(model_id, config)
+            warmup_time = self.warm_up(model.parser, warmup_utterances)
+
+            swap_begin = time.time()
+            with self.lock:
+                self.configs[model_id] = config
+                # a first load of the model that is still running does not overwrite the new model
+                self.generations[model_id] = self.generations.get(model_id, 0) + 1
+                old_model = self.models.pop(model_id, None)
+                self.models[model_id] = model
+                if old_model is not None:
+                    # the old model is kept alive by the requests still using it
+                    model.last_used = old_model.last_used
+                self._evict_over_budget()
+            end = time.time()
+
+            latencies = dict(load_seconds=model.load_time,
+                             warmup_seconds=warmup_time,
+                             swap_seconds=end - swap_begin,
+                             total_seconds=end - begin,
+                             old_model_in_use=old_model.in_use if old_model is not None else 0,
+                             time=end)
+            with self.lock:
+                self.swap_latencies.setdefault(model_id, []).append(latencies)
+            print('swapped in model [%s] from %s in %.2fs' % (model_id, config['model_path'], end - begin),
+                  file=sys.stderr)
+
+            return latencies
+        finally:
+            with self.lock:
+                self.swapping.discard(model_id)
+
+    def check_model_files(self):
+        """swap in the loaded models whose checkpoint was overwritten, returns the ids of the swapped models"""
+        with self.lock:
+            changed_model_ids = [model_id for model_id, model in self.models.items()
+                                 if model.model_mtime is not None and model_id not in self.swapping and
+                                 get_file_mtime(model.model_path) not in (None, model.model_mtime)]
+
+        swapped_model_ids = []
+        for model_id in changed_model_ids:
+            try:
+                self.swap(model_id)
+                swapped_model_ids.append(model_id)
+            except Exception as e:
+                # e.g. a checkpoint that is still being written, which is retried at the next check
+                print('failed to swap in model [%s]: %s' % (model_id, e), file=sys.stderr)
+
+        return swapped_model_ids
+
+    def watch_model_files(self, interval=5.):
+        """check the checkpoints of the loaded models every `interval` seconds in a background thread"""
+        def watch():
+            while True:
+                time.sleep(interval)
+                self.check_model_files()
+
+        self._watcher = threading.Thread(target=watch, name='model-file-watcher')
+        self._watcher.daemon = True
+        self._watcher.start()
+
+    def preload(self, model_ids=None):
+        """load models ahead of requests, returns a dict of model id to parser"""
+        return {model_id: self.get(model_id) for model_id in (model_ids or self.configs)}
+
+    def _evict(self, model_id):
+        del self.models[model_id]
+        self.num_evictions += 1
+        print('evicted model [%s]' % model_id, file=sys.stderr)
+
+    def _evict_over_budget(self):
+        if not self.max_memory:
+            return
+
+        for model_id, model in list(self.models.items()):
+            if self.memory_usage <= self.max_memory:
+                break
+            # the model that was just loaded is the last one and in use
+            if model.in_use == 0:
+                self._evict(model_id)
+
+    def evict_idle(self):
+        if not self.idle_timeout:
+            return
+
+        with self.lock:
+            now = time.time()
+            for model_id, model in list(self.models.items()):
+                if model.in_use == 0 and now - model.last_used > self.idle_timeout:
+                    self._evict(model_id)
+
+    @property
+    def memory_usage(self):
+        return sum(model.memory for model in self.models.values())
+
+    def get_stats(self):
+        with self.lock:
+            models = OrderedDict()
+            for model_id in self.configs:
+                model = self.models.get(model_id)
+                latencies = self.load_latencies.get(model_id, [])
+                swap_latencies = self.swap_latencies.get(model_id, [])
+                models[model_id] = dict(loaded=model is not None,
+                                        loading=model_id in self.loading,
+                                        memory=model.memory if model else 0,
+                                        in_use=model.in_use if model else 0,
+                                        idle_seconds=time.time() - model.last_used if model else None,
+                                        num_hits=self.model_hits.get(model_id, 0),
+                                        num_misses=self.model_misses.get(model_id, 0),
+                                        num_loads=len(latencies),
+                                        last_load_seconds=latencies[-1] if latencies else None,
+                                        model_path=self.configs[model_id]['model_path'],
+                                        swapping=model_id in self.swapping,
+                                        num_swaps=len(swap_latencies),
+                                        last_swap=swap_latencies[-1] if swap_latencies else None)
+
+            return dict(models=models,
+                        memory_usage=self.memory_usage,
+                        max_memory=self.max_memory,
+                        num_hits=self.num_hits,
+                        num_loads=self.num_loads,
+                        num_evictions=self.num_evictions)
@@ -0,0 +1,382 @@
+# coding=utf-8
+"""
+Production serving mode of `app.py` (Python 3 only): an asyncio HTTP front end that collects concurrent requests
+to the same parser into micro-batches, decodes each batch on a worker thread, and fans the results back out.
+"""
+
+from __future__ import print_function
+
+import asyncio
+import json
+import sys
+import time
+from collections import OrderedDict
+
+from server.admission import AdmissionController, DecodeTimeout, Overloaded
+from server.async_http import HTTPServer, HTTPError, Response, StreamResponse, json_response
+from server.batching import MicroBatcher
+from server.metrics import CONTENT_TYPE, ServingMetrics
+
+
+def hypothesis_to_dict(hyp_id, hyp, debug=False):
+    return dict(id=hyp_id + 1,
+                value=hyp.code,
+                tree_repr=hyp.tree.to_string(),
+                score=float(hyp.score),
+                actions=[action.__repr__(debug) for action in hyp.action_infos])
+
+
+def parse_jobs(parser, jobs, stats=None):
+    """
+    decode a batch of (utterance, beam size, debug, deadline) jobs with a `StandaloneParser`, jobs with the same
+    beam size and debug flag are decoded in one batch. Returns the hypotheses of each job as dicts of the JSON
+    response, or the exception raised when decoding the job (`DecodeTimeout` for a job whose beam search stopped at
+    its deadline). Decoding statistics are appended to the optional dict `stats`
+    """
+    job_groups = OrderedDict()
+    for job_id, (utterance, beam_size, debug, deadline) in enumerate(jobs):
+        job_groups.setdefault((beam_size, debug), []).append(job_id)
+
+    results = [None] * len(jobs)
+    for (beam_size, debug), job_ids in job_groups.items():
+        # an utterance that fails gets its exception, without failing or re-decoding the other jobs
+        timed_out = []
+        errors = []
+        hypotheses_batch = parser.parse_batch([jobs[job_id][0] for job_id in job_ids],
+                                              beam_size=beam_size, debug=debug, stats=stats,
+                                              deadlines=[jobs[job_id][3] for job_id in job_ids],
+                                              timed_out=timed_out, errors=errors)
+
+        for job_id, hypotheses, job_timed_out, error in zip(job_ids, hypotheses_batch, timed_out, errors):
+            if error is not None:
+                results[job_id] = error
+            elif job_timed_out:
+                # the beam search was cancelled, its hypotheses are incomplete
+                results[job_id] = DecodeTimeout('parsing timed out')
+            else:
+                results[job_id] = [hypothesis_to_dict(hyp_id, hyp, debug) for hyp_id, hyp in enumerate(hypotheses)]
+
+    return results
+
+
+def parse_jobs_with_stats(parser, jobs):
+    """`parse_jobs` for the pre-forked workers, which send the decoding statistics back with the results"""
+    stats = dict()
+    results = parse_jobs(parser, jobs, stats)
+
+    return results, stats
+
+
+def parse_bool(value):
+    return str(value).lower() in ('1', 'true', 'yes')
+
+
+def parse_beam_size(value):
+    if value is None:
+        return None
+
+    try:
+        beam_size = int(value)
+    except (TypeError, ValueError):
+        beam_size = 0
+    if beam_size < 1:
+        raise HTTPError(400, 'beam size must be a positive integer')
+
+    return beam_size
+
+
+def parse_timeout(value):
+    if value is None:
+        return None
+
+    try:
+        timeout = float(value)
+    except (TypeError, ValueError):
+        timeout = 0.
+    if not timeout > 0:
+        raise HTTPError(400, 'timeout must be a positive number of seconds')
+
+    return timeout
+
+
+def get_batch_jobs(request):
+    """
+    (utterance, beam size, debug) jobs of a batch request, whose body is a JSON list of utterances or an object
+
+        {"utterances": [...], "beam_size": 5, "debug": false, "stream": false, "timeout": 2.5}
+
+    where an utterance is a string or an object {"utterance": ..., "beam_size": ..., "debug": ...} that overrides
+    the options of the request. Options can also be given as query parameters. Returns the jobs, whether to stream
+    the results, and the timeout of the request in seconds
+    """
+    body = request.json()
+    options = dict(request.query)
+    if isinstance(body, dict):
+        options.update((key, value) for key, value in body.items() if key != 'utterances')
+        body = body.get('utterances')
+    if not isinstance(body, list):
+        raise HTTPError(400, 'expect a list of utterances')
+
+    beam_size = parse_beam_size(options.get('beam_size'))
+    debug = parse_bool(options.get('debug', False))
+
+    jobs = []
+    for entry in body:
+        if isinstance(entry, dict):
+            jobs.append((entry.get('utterance'),
+                         parse_beam_size(entry.get('beam_size', beam_size)),
+                         parse_bool(entry.get('debug', debug))))
+        else:
+            jobs.append((entry, beam_size, debug))
+
+        if not isinstance(jobs[-1][0], str):
+            raise HTTPError(400, 'utterance must be a string')
+
+    return jobs, parse_bool(options.get('stream', False)), parse_timeout(options.get('timeout'))
+
+
+def get_job_result(job_id, future):
+    """result entry of a finished (or timed out) job of a batch request"""
+    if not future.done() or future.cancelled():
+        return {'index': job_id, 'error': 'parsing timed out'}
+    if future.exception() is not None:
+        return {'index': job_id, 'error': str(future.exception())}
+
+    return {'index': job_id, 'hypotheses': future.result()}
+
+
+class ParsingService(object):
+    """
+    serves the models of a `ModelRegistry` in this process, or in the pre-forked workers of `worker_pool`
+    (a `PreforkWorkerPool` running `parse_jobs_with_stats` with the preloaded models), which decode as many batches
+    at a time as there are workers.
+
+    Requests are admitted by `admission` (an `AdmissionController`), which bounds the queue and the concurrency
+    of each model, sets the deadlines of requests, and lowers the beam size when a queue is deep
+    """
+
+    def __init__(self, registry, max_batch_size=16, max_batch_wait=0.005, worker_pool=None, admission=None):
+        self.registry = registry
+        self.worker_pool = worker_pool
+        self.admission = admission or AdmissionController(
+            registry.configs, max_concurrency=worker_pool.num_workers if worker_pool is not None else 1)
+        self.batchers = dict()
+        for dataset in registry.configs:
+            if worker_pool is not None:
+                process_batch = lambda jobs, dataset=dataset: self.parse_jobs_in_worker(dataset, jobs)
+            else:
+                process_batch = lambda jobs, dataset=dataset: self.parse_jobs(dataset, jobs)
+
+            self.batchers[dataset] = MicroBatcher(process_batch, max_batch_size=max_batch_size,
+                                                  max_wait=max_batch_wait,
+                                                  max_concurrent_batches=self.admission.get_max_concurrency(dataset))
+
+        self.ready_time = None
+        self.metrics = ServingMetrics(registry,
+                                      queue_depth=lambda: {dataset: batcher.queue_size
+                                                           for dataset, batcher in self.batchers.items()})
+
+        self.http = HTTPServer()
+        self.http.add_route('GET', '/parse/<dataset>/<utterance>', self.observe_request(self.handle_parse))
+        self.http.add_route('POST', '/parse_batch/<dataset>', self.observe_request(self.handle_parse_batch))
+        self.http.add_route('GET', '/metrics', self.handle_metrics)
+        self.http.add_route('GET', '/models', self.handle_models)
+        self.http.add_route('POST', '/models/<dataset>/swap', self.handle_swap)
+
+    def parse_jobs(self, dataset, jobs):
+        # the model is loaded by the first batch that needs it, on the worker thread of the batcher
+        stats = dict()
+        with self.registry.use(dataset) as parser:
+            results = parse_jobs(parser, jobs, stats)
+        self.metrics.observe_parse(dataset, stats)
+
+        return results
+
+    def parse_jobs_in_worker(self, dataset, jobs):
+        results, stats = self.worker_pool.submit(dataset, jobs).result()
+        self.metrics.observe_parse(dataset, stats)
+
+        return results
+
+    def observe_request(self, handler):
+        """wrap the handler of a parse request, to record its status and latency"""
+        async def handle(request):
+            begin = time.time()
+            status = 500
+            try:
+                response = await handler(request)
+                status = response.status
+                return response
+            except HTTPError as e:
+                status = e.status
+                raise
+            finally:
+                dataset = request.match_info['dataset']
+                # requests of unknown datasets are not labelled by them
+                self.metrics.observe_request(dataset if dataset in self.batchers else '', status,
+                                             time.time() - begin)
+
+        return handle
+
+    def get_batcher(self, dataset):
+        if dataset not in self.batchers:
+            raise HTTPError(404, 'unknown dataset [%s]' % dataset)
+
+        return self.batchers[dataset]
+
+    def admit(self, dataset, jobs, timeout=None):
+        """
+        queue the (utterance, beam size, debug) jobs of a request, or reject all of them with 503 when the queue
+        of the model is full. Returns the futures of the jobs, the deadline of the request, and the beam size of
+        the jobs if it was lowered (None otherwise)
+        """
+        batcher = self.get_batcher(dataset)
+        try:
+            self.admission.check_room(dataset, batcher.queue_size, len(jobs))
+        except Overloaded as e:
+            raise HTTPError(503, str(e), headers=self.admission.get_retry_after_header(e))
+
+        deadline = self.admission.get_deadline(timeout)
+        queue_size = batcher.queue_size
+        futures = []
+        degraded_beam_size = None
+        for utterance, beam_size, debug in jobs:
+            beam_size, degraded = self.admission.get_beam_size(dataset, queue_size, beam_size)
+            if degraded:
+                degraded_beam_size = beam_size
+            futures.append(batcher.submit_nowait((utterance, beam_size, debug, deadline)))
+
+        if degraded_beam_size is not None:
+            self.metrics.degraded_requests.inc(dataset=dataset)
+
+        return futures, deadline, degraded_beam_size
+
+    @staticmethod
+    def get_response_headers(degraded_beam_size):
+        return {'X-Degraded-Beam-Size': str(degraded_beam_size)} if degraded_beam_size is not None else None
+
+    async def handle_parse(self, request):
+        dataset = request.match_info['dataset']
+        debug = parse_bool(request.query.get('debug', False))
+        timeout = parse_timeout(request.query.get('timeout'))
+
+        futures, deadline, degraded_beam_size = self.admit(dataset, [(request.match_info['utterance'], None, debug)],
+                                                           timeout)
+        try:
+            # a job still queued at the deadline is cancelled, and one being decoded stops at its next beam step
+            hypotheses = await asyncio.wait_for(futures[0], deadline - time.time() if deadline else None)
+        except (asyncio.TimeoutError, DecodeTimeout):
+            raise HTTPError(504, 'parsing timed out')
+
+        return json_response({'hypotheses': hypotheses}, headers=self.get_response_headers(degraded_beam_size))
+
+    async def handle_parse_batch(self, request):
+        """
+        parse a list of utterances, which join the micro-batches of the parser. Results are returned in order,
+        as one JSON object, or streamed as one JSON line per utterance with `stream`
+        """
+        self.get_batcher(request.match_info['dataset'])
+        jobs, stream, timeout = get_batch_jobs(request)
+
+        futures, deadline, degraded_beam_size = self.admit(request.match_info['dataset'], jobs, timeout)
+        get_remaining_time = lambda: max(deadline - time.time(), 0.) if deadline else None
+        headers = self.get_response_headers(degraded_beam_size)
+
+        if stream:
+            async def stream_results():
+                try:
+                    for job_id, future in enumerate(futures):
+                        await asyncio.wait([future], timeout=get_remaining_time())
+                        yield (json.dumps(get_job_result(job_id, future)) + '\n').encode('utf-8')
+                finally:
+                    # the client went away
+                    for future in futures:
+                        future.cancel()
+
+            return StreamResponse(stream_results(), headers=headers)
+
+        if futures:
+            await asyncio.wait(futures, timeout=get_remaining_time())
+
+        results = [get_job_result(job_id, future) for job_id, future in enumerate(futures)]
+        for future in futures:
+            # jobs that timed out
+            future.cancel()
+
+        return json_response({'results': results}, headers=headers)
+
+    async def handle_metrics(self, request):
+        return Response(self.metrics.render(), content_type=CONTENT_TYPE)
+
+    async def handle_models(self, request):
+        stats = self.registry.get_stats()
+        stats['startup_seconds'] = self.ready_time - self.registry.created_time
+        stats['uptime_seconds'] = time.time() - self.ready_time
+
+        return json_response(stats)
+
+    async def handle_swap(self, request):
+        """
+        load a new checkpoint of a model and swap it in, while the old model keeps serving. The optional JSON body
+
+            {"model_path": ..., "warmup_utterances": [...]}
+
+        overrides the checkpoint and the warm-up utterances of the model config. Returns the latencies of the swap
+        """
+        dataset = request.match_info['dataset']
+        if dataset not in self.registry:
+            raise HTTPError(404, 'unknown dataset [%s]' % dataset)
+        if self.worker_pool is not None:
+            raise HTTPError(400, 'models cannot be swapped in the pre-forked workers')
+
+        options = request.json() if request.body else dict()
+        if not isinstance(options, dict):
+            raise HTTPError(400, 'expect a JSON object')
+        warmup_utterances = options.get('warmup_utterances')
+        if warmup_utterances is not None and not (isinstance(warmup_utterances, list) and
+                                                  all(isinstance(u, str) for u in warmup_utterances)):
+            raise HTTPError(400, 'warm-up utterances must be a list of strings')
+
+        if dataset in self.registry.swapping:
+            raise HTTPError(409, 'model [%s] is already being swapped' % dataset)
+
+        loop = asyncio.get_event_loop()
+        try:
+            latencies = await loop.run_in_executor(None, self.registry.swap, dataset,
+                                                   options.get('model_path'), warmup_utterances)
+        except RuntimeError as e:
+            raise HTTPError(409, str(e))
+        except Exception as e:
+            # the old model keeps serving
+            raise HTTPError(500, 'failed to swap in model [%s]: %s' % (dataset, e))
+
+        return json_response(latencies)
+
+    def evict_idle_models(self, interval):
+        loop = asyncio.get_event_loop()
+        loop.run_in_executor(None, self.registry.evict_idle)
+        loop.call_later(interval, self.evict_idle_models, interval)
+
+    def serve(self, host='0.0.0.0', port=8081):
+        loop = asyncio.get_event_loop()
+        for batcher in self.batchers.values():
+            batcher.start()
+        if self.registry.idle_timeout:
+            loop.call_later(self.registry.idle_timeout, self.evict_idle_models, self.registry.idle_timeout / 2.)
+
+        server = loop.run_until_complete(self.http.start(host, port))
+        self.ready_time = time.time()
+        print('serving on %s:%d, started in %.2fs' % (host, port, self.ready_time - self.registry.created_time),
+              file=sys.stderr)
+
+        try:
+            loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+            loop.run_until_complete(server.wait_closed())
+            for batcher in self.batchers.values():
+                batcher.close()
+            if self.worker_pool is not None:
+                self.worker_pool.close()
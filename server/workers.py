@@ -0,0 +1,147 @@
+# coding=utf-8
+"""
+Pre-fork decoding workers for the production serving mode (Python 3, Unix only). Parsers are loaded once in the
+parent process and their parameters are moved to shared memory before forking, so all workers read the same copy
+of the model weights.
+"""
+
+from __future__ import print_function
+
+import gc
+import itertools
+import multiprocessing
+import multiprocessing.connection
+import sys
+import threading
+import traceback
+from concurrent.futures import Future
+
+import torch
+
+
+def _worker_loop(conn, parsers, process_jobs, num_threads):
+    # decoding in N workers with the default number of threads each would oversubscribe the CPUs
+    torch.set_num_threads(num_threads)
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if message is None:
+            break
+
+        request_id, parser_id, jobs = message
+        try:
+            results = process_jobs(parsers[parser_id], jobs)
+            conn.send((request_id, results, None))
+        except Exception:
+            conn.send((request_id, None, traceback.format_exc()))
+
+
+class WorkerError(Exception):
+    pass
+
+
+class PreforkWorkerPool(object):
+    """
+    runs `process_jobs(parser, jobs)` in `num_workers` forked processes, which share the parameters of `parsers`.
+    A batch of jobs is sent to the worker with the fewest jobs in flight
+    """
+
+    def __init__(self, parsers, process_jobs, num_workers=2, num_threads=1):
+        self.num_workers = num_workers
+
+        for parser in parsers.values():
+            parser.parser.share_memory()
+
+        # keep the objects created so far out of garbage collection in the workers, which would otherwise write
+        # to (and so copy) their memory pages
+        gc.collect()
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+
+        context = multiprocessing.get_context('fork')
+        self.processes = []
+        self.conns = []
+        for worker_id in range(num_workers):
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(target=_worker_loop, args=(child_conn, parsers, process_jobs, num_threads),
+                                      name='decode-worker-%d' % worker_id, daemon=True)
+            process.start()
+            child_conn.close()
+
+            self.processes.append(process)
+            self.conns.append(parent_conn)
+
+        self.lock = threading.Lock()
+        # number of jobs in flight of each worker
+        self.worker_loads = [0] * num_workers
+        # request id -> (worker id, number of jobs, future)
+        self.pending_requests = dict()
+        self.request_ids = itertools.count()
+        self.closed = False
+
+        self._reader = threading.Thread(target=self._read_results, name='decode-worker-results', daemon=True)
+        self._reader.start()
+
+    def submit(self, parser_id, jobs):
+        """a `concurrent.futures.Future` of the results of `process_jobs` on a batch of jobs"""
+        future = Future()
+        with self.lock:
+            alive_worker_ids = [i for i in range(self.num_workers) if self.processes[i].is_alive()]
+            if not alive_worker_ids:
+                raise WorkerError('no decoding worker is alive')
+
+            worker_id = min(alive_worker_ids, key=lambda i: self.worker_loads[i])
+            request_id = next(self.request_ids)
+            self.worker_loads[worker_id] += len(jobs)
+            self.pending_requests[request_id] = (worker_id, len(jobs), future)
+
+            self.conns[worker_id].send((request_id, parser_id, jobs))
+
+        return future
+
+    def _read_results(self):
+        conns = list(self.conns)
+        while conns and not self.closed:
+            for conn in multiprocessing.connection.wait(conns, timeout=1.):
+                worker_id = self.conns.index(conn)
+                try:
+                    request_id, results, error = conn.recv()
+                except (EOFError, OSError):
+                    conns.remove(conn)
+                    self._fail_worker(worker_id)
+                    continue
+
+                with self.lock:
+                    _, num_jobs, future = self.pending_requests.pop(request_id)
+                    self.worker_loads[worker_id] -= num_jobs
+
+                if error is not None:
+                    future.set_exception(WorkerError(error))
+                else:
+                    future.set_result(results)
+
+    def _fail_worker(self, worker_id):
+        """fail the requests of a worker that died"""
+        if not self.closed:
+            print('decoding worker %d exited unexpectedly' % worker_id, file=sys.stderr)
+
+        with self.lock:
+            for request_id, (request_worker_id, _, future) in list(self.pending_requests.items()):
+                if request_worker_id == worker_id:
+                    del self.pending_requests[request_id]
+                    future.set_exception(WorkerError('decoding worker %d exited' % worker_id))
+            self.worker_loads[worker_id] = 0
+
+    def close(self):
+        self.closed = True
+        for conn, process in zip(self.conns, self.processes):
+            if process.is_alive():
+                try:
+                    conn.send(None)
+                except (BrokenPipeError, OSError):
+                    pass
+        for process in self.processes:
+            process.join(timeout=5)
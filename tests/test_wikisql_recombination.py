@@ -0,0 +1,155 @@
+# coding=utf-8
+"""
+hypothesis recombination in the beam search of `WikiSqlParser`, on a question whose value token occurs twice.
+Run with `python -m unittest discover tests` (Python 3, as the WikiSQL parser)
+"""
+
+from __future__ import print_function
+
+import io
+import math
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+
+import torch
+from torch.autograd import Variable
+
+from asdl.asdl import ASDLGrammar
+from asdl.lang.sql.sql_transition_system import SqlTransitionSystem, WikiSqlSelectColumnAction
+from asdl.transition_system import ApplyRuleAction, GenTokenAction
+from common.utils import init_arg_parser
+from components.vocab import Vocab, VocabEntry
+from model.wikisql.dataset import WikiSqlTable, TableColumn
+from model.wikisql.parser import WikiSqlParser
+
+GRAMMAR_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            'asdl', 'lang', 'sql', 'sql_asdl.txt')
+
+# `5` occurs at positions 3 and 6
+QUESTION = 'which player scored 5 goals in 5 games'.split()
+TABLE = WikiSqlTable([TableColumn('name', ['name'], 'text'), TableColumn('goals', ['goals'], 'real'),
+                      TableColumn('games', ['games'], 'real')])
+
+
+def build_parser(recombination='none', seed=34):
+    torch.manual_seed(seed)
+    grammar = ASDLGrammar.from_text(open(GRAMMAR_FILE).read())
+    args = init_arg_parser().parse_args(['--mode', 'test', '--lang', 'wikisql', '--parser', 'wikisql_parser',
+                                         '--hidden_size', '32', '--embed_size', '16', '--action_embed_size', '16',
+                                         '--field_embed_size', '8', '--type_embed_size', '8', '--att_vec_size', '32',
+                                         '--beam_recombination', recombination])
+    with redirect_stdout(io.StringIO()):
+        src_vocab = VocabEntry.from_corpus([QUESTION + ['name', 'goals', 'games']], size=100, freq_cutoff=0)
+        primitive_vocab = VocabEntry.from_corpus([['</primitive>']], size=10, freq_cutoff=0)
+
+    parser = WikiSqlParser(args, Vocab(source=src_vocab, primitive=primitive_vocab), SqlTransitionSystem(grammar))
+
+    return parser.eval()
+
+
+class Hyp(object):
+    def __init__(self, actions):
+        self.actions = actions
+
+
+def copy_entry(prev_hyp_id, token_pos, score):
+    return {'action_type': 'gen_token', 'token': QUESTION[token_pos], 'token_pos': token_pos,
+            'score': Variable(torch.FloatTensor([score])), 'new_hyp_score': Variable(torch.FloatTensor([score])),
+            'prev_hyp_id': prev_hyp_id}
+
+
+def stop_entry(prev_hyp_id, score):
+    return {'action_type': 'gen_token', 'token': '</primitive>',
+            'score': Variable(torch.FloatTensor([score])), 'new_hyp_score': Variable(torch.FloatTensor([score])),
+            'prev_hyp_id': prev_hyp_id}
+
+
+class TestRecombineHypMeta(unittest.TestCase):
+    def setUp(self):
+        self.grammar = ASDLGrammar.from_text(open(GRAMMAR_FILE).read())
+        self.prefix = [ApplyRuleAction(self.grammar.get_prod_by_ctr_name('Select')), WikiSqlSelectColumnAction(0)]
+
+    def test_copies_from_different_positions_are_not_merged(self):
+        hypotheses = [Hyp(self.prefix)]
+        for mode in ('max', 'logsumexp'):
+            meta = WikiSqlParser.recombine_hyp_meta([copy_entry(0, 3, -1.), copy_entry(0, 6, -2.)], hypotheses, mode)
+            self.assertEqual(sorted(entry['token_pos'] for entry in meta), [3, 6])
+            self.assertEqual(sorted(float(entry['new_hyp_score'].data[0]) for entry in meta), [-2., -1.])
+
+    def test_equivalent_candidates_are_merged(self):
+        # two hypotheses that copied `5` from different positions, and stop the value
+        hypotheses = [Hyp(self.prefix + [GenTokenAction('5')]), Hyp(self.prefix + [GenTokenAction('5')])]
+        candidates = [stop_entry(0, -1.), stop_entry(1, -2.)]
+
+        meta = WikiSqlParser.recombine_hyp_meta(candidates, hypotheses, 'max')
+        self.assertEqual(len(meta), 1)
+        self.assertEqual(meta[0]['prev_hyp_id'], 0)
+        self.assertAlmostEqual(float(meta[0]['new_hyp_score'].data[0]), -1., places=5)
+
+        meta = WikiSqlParser.recombine_hyp_meta(candidates, hypotheses, 'logsumexp')
+        self.assertEqual(len(meta), 1)
+        self.assertAlmostEqual(float(meta[0]['new_hyp_score'].data[0]), math.log(math.exp(-1.) + math.exp(-2.)),
+                               places=5)
+
+
+class TestBeamRecombination(unittest.TestCase):
+    def parse(self, recombination, parser=None):
+        return (parser or build_parser()).parse(QUESTION, TABLE, beam_size=20, recombination=recombination)
+
+    def check_copies(self, hyp):
+        """the tokens of each value are copied from consecutive source positions"""
+        prev_pos = None
+        for action_info in hyp.action_infos:
+            if action_info.copy_from_src:
+                pos = action_info.src_token_position
+                self.assertEqual(QUESTION[pos], action_info.action.token)
+                if prev_pos is not None:
+                    self.assertEqual(pos, prev_pos + 1)
+                prev_pos = pos
+            else:
+                prev_pos = None
+
+    def test_beam_with_and_without_recombination(self):
+        hypotheses = self.parse('none')
+        self.assertTrue(hypotheses)
+        for hyp in hypotheses:
+            self.check_copies(hyp)
+
+        for mode in ('max', 'logsumexp'):
+            recombined_hypotheses = self.parse(mode)
+            self.assertTrue(recombined_hypotheses)
+            for hyp in recombined_hypotheses:
+                self.check_copies(hyp)
+
+            # completed duplicates are merged
+            trees = [hyp.tree.to_string() for hyp in recombined_hypotheses]
+            self.assertEqual(len(trees), len(set(trees)))
+
+            # merging equivalent states never loses the best hypothesis of the plain beam
+            self.assertGreaterEqual(float(recombined_hypotheses[0].score), float(hypotheses[0].score) - 1e-4)
+
+    def test_recombination_of_checkpoint_saved_without_recombination(self):
+        """the recombination of a decode call is not overridden by the `--beam_recombination` saved in the checkpoint"""
+        model_dir = tempfile.mkdtemp()
+        try:
+            model_path = os.path.join(model_dir, 'model.bin')
+            build_parser('none').save(model_path)
+            parser = WikiSqlParser.load(model_path)
+        finally:
+            shutil.rmtree(model_dir)
+        self.assertEqual(parser.args.beam_recombination, 'none')
+
+        trees = [hyp.tree.to_string() for hyp in self.parse('none', parser)]
+        self.assertGreater(len(trees), len(set(trees)))
+
+        for mode in ('max', 'logsumexp'):
+            recombined_hypotheses = self.parse(mode, parser)
+            self.assertEqual([(hyp.tree.to_string(), round(float(hyp.score), 4)) for hyp in recombined_hypotheses],
+                             [(hyp.tree.to_string(), round(float(hyp.score), 4)) for hyp in self.parse(mode)])
+
+
+if __name__ == '__main__':
+    unittest.main()